@@ -3,6 +3,23 @@ from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .modules.database import ConnectToMongoDB, DisconnectMongoDB
+from .modules.http_client import CloseHTTPClients
+from .modules.indexes import StartIndexBuild, StopIndexBuild
+from .modules.ipaymu import StartIpaymuCallbackWorker, StopIpaymuCallbackWorker
+from .modules.jobs import StartJobWorker, StopJobWorker
+from .modules.mikrotik_log import StopMikrotikLogFollowers
+from .modules.mikrotik_mirror import StartMikrotikMirrorWorker, StopMikrotikMirrorWorker
+from .modules.mikrotik_pool import CloseMikrotikPools
+from .modules.mikrotik_telemetry import (
+    StartMikrotikTelemetryWorker,
+    StopMikrotikTelemetryWorker,
+)
+from .modules.mikrotik_traffic import (
+    StartMikrotikTrafficWorker,
+    StopMikrotikTrafficWorker,
+)
+from .modules.moota import StartMootaConfirmWorker, StopMootaConfirmWorker
+from .modules.whatsapp_outbox import StartWhatsappOutboxWorker, StopWhatsappOutboxWorker
 from app.routes import main
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
@@ -22,6 +39,25 @@ app = FastAPI(
     version=app_version,
 )
 app.add_event_handler("startup", ConnectToMongoDB)
+app.add_event_handler("startup", StartIndexBuild)
+app.add_event_handler("startup", StartJobWorker)
+app.add_event_handler("startup", StartWhatsappOutboxWorker)
+app.add_event_handler("startup", StartMikrotikMirrorWorker)
+app.add_event_handler("startup", StartMikrotikTelemetryWorker)
+app.add_event_handler("startup", StartMikrotikTrafficWorker)
+app.add_event_handler("startup", StartMootaConfirmWorker)
+app.add_event_handler("startup", StartIpaymuCallbackWorker)
+app.add_event_handler("shutdown", StopIndexBuild)
+app.add_event_handler("shutdown", StopJobWorker)
+app.add_event_handler("shutdown", StopWhatsappOutboxWorker)
+app.add_event_handler("shutdown", StopMikrotikMirrorWorker)
+app.add_event_handler("shutdown", StopMikrotikTelemetryWorker)
+app.add_event_handler("shutdown", StopMikrotikTrafficWorker)
+app.add_event_handler("shutdown", StopMootaConfirmWorker)
+app.add_event_handler("shutdown", StopIpaymuCallbackWorker)
+app.add_event_handler("shutdown", StopMikrotikLogFollowers)
+app.add_event_handler("shutdown", CloseHTTPClients)
+app.add_event_handler("shutdown", CloseMikrotikPools)
 app.add_event_handler("shutdown", DisconnectMongoDB)
 app.add_middleware(
     CORSMiddleware,
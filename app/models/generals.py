@@ -7,7 +7,9 @@ from pydantic import BaseModel
 class Pagination(BaseModel):
     page: int = 1
     item: int = 10
-    count: int
+    count: Optional[int] = None
+    is_count_exact: Optional[bool] = None
+    next_cursor: Optional[str] = None
 
 
 class SortingDirection(str, Enum):
@@ -0,0 +1,32 @@
+from enum import Enum
+
+# responses
+JobProjections = {
+    "type": 1,
+    "status": 1,
+    "total": 1,
+    "processed": 1,
+    "result": 1,
+    "error": 1,
+    "elapsed_seconds": 1,
+    "created_at": 1,
+    "started_at": 1,
+    "updated_at": 1,
+    "finished_at": 1,
+}
+
+
+# schemas
+class JobStatusData(str, Enum):
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+
+
+class JobTypeData(str, Enum):
+    INVOICE_GENERATE = "INVOICE_GENERATE"
+    CUSTOMER_ISOLIR = "CUSTOMER_ISOLIR"
+    DATA_BACKUP = "DATA_BACKUP"
+    WHATSAPP_BROADCAST = "WHATSAPP_BROADCAST"
+    PACKAGE_PROFILE_PROPAGATE = "PACKAGE_PROFILE_PROPAGATE"
@@ -1,3 +1,4 @@
+from enum import Enum
 from typing import Optional
 from pydantic import BaseModel
 
@@ -17,3 +18,20 @@ class MikrotikDeleteData(BaseModel):
 
 class MikrotikSecretDeleteData(MikrotikDeleteData):
     name: str
+
+
+class MikrotikMirrorStatusData(str, Enum):
+    SYNCING = "SYNCING"
+    SYNCED = "SYNCED"
+    FAILED = "FAILED"
+
+
+class MikrotikTelemetryResolutionData(str, Enum):
+    RAW = "raw"
+    FIVE_MINUTES = "5m"
+    ONE_HOUR = "1h"
+
+
+class MikrotikTrafficPeriodData(str, Enum):
+    HOURLY = "hourly"
+    DAILY = "daily"
@@ -11,6 +11,19 @@ class PaymentMethodData(str, Enum):
     VIRTUAL_ACCOUNT = "VIRTUAL ACCOUNT"
 
 
+class BankMutationStatusData(str, Enum):
+    UNMATCHED = "UNMATCHED"
+    MATCHED = "MATCHED"
+    DUPLICATED = "DUPLICATED"
+
+
+class IpaymuCallbackStatusData(str, Enum):
+    PENDING = "PENDING"
+    PROCESSING = "PROCESSING"
+    PROCESSED = "PROCESSED"
+    FAILED = "FAILED"
+
+
 class PaymentPayOffData(BaseModel):
     method: PaymentMethodData
     image_url: Optional[str] = None
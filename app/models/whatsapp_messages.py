@@ -2,6 +2,19 @@ from typing import Optional
 from pydantic import BaseModel
 from enum import Enum
 
+# responses
+WhatsappOutboxProjections = {
+    "destination": 1,
+    "message": 1,
+    "status": 1,
+    "attempts": 1,
+    "gateway": 1,
+    "last_error": 1,
+    "next_attempt_at": 1,
+    "created_at": 1,
+    "sent_at": 1,
+}
+
 
 # schemas
 class SendMessageType(str, Enum):
@@ -38,3 +51,10 @@ class AdvanceMessageTemplateData(BaseModel):
     unique_code_message: Optional[str] = None
     saldo_fee: Optional[int] = 0
     whatsapp_gateway: Optional[WhatsappGatewayType] = WhatsappGatewayType.BABLAST.value
+
+
+class WhatsappOutboxStatusData(str, Enum):
+    PENDING = "PENDING"
+    SENDING = "SENDING"
+    SENT = "SENT"
+    FAILED = "FAILED"
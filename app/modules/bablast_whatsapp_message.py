@@ -1,5 +1,6 @@
-import requests
+import httpx
 import os
+from app.modules.http_client import GetHTTPClient
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,10 +21,10 @@ async def SendBablastWhatsappSingleMessage(destination_number: str, message: str
     }
 
     try:
-        res = requests.post(url=url, headers=headers, json=body, timeout=15)
+        res = await GetHTTPClient("bablast").post(url=url, headers=headers, json=body)
         res.raise_for_status()
         return {"success": True, "data": res.json()}
-    except requests.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         return {
             "success": False,
             "error": f"HTTP error: {http_err}",
@@ -58,10 +59,10 @@ async def SendBablastWhatsappBulkMessage(
     }
 
     try:
-        res = requests.post(url=url, headers=headers, json=body, timeout=15)
+        res = await GetHTTPClient("bablast").post(url=url, headers=headers, json=body)
         res.raise_for_status()
         return {"success": True, "data": res.json()}
-    except requests.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         return {
             "success": False,
             "error": f"HTTP error: {http_err}",
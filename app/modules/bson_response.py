@@ -0,0 +1,21 @@
+from typing import Any
+import orjson
+from fastapi.responses import JSONResponse
+from app.modules.crud_operations import JsonObjectFormatter
+
+
+class BSONJSONResponse(JSONResponse):
+    """
+    JSONResponse for native documents: ObjectId and datetime are written
+    as str() in the same single serialization pass, so the CRUD helpers can
+    be called with is_json=False.
+    """
+
+    def render(self, content: Any) -> bytes:
+        # datetimes go through JsonObjectFormatter to keep the str() format
+        # of the helpers instead of the orjson ISO format
+        return orjson.dumps(
+            content,
+            default=JsonObjectFormatter,
+            option=orjson.OPT_PASSTHROUGH_DATETIME,
+        )
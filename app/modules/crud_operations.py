@@ -1,8 +1,13 @@
 from typing import Any
+import base64
 from datetime import datetime
-from bson import ObjectId
+import time
+from bson import ObjectId, json_util
 from app.models.generals import Pagination
-import json
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
 
 
 def JsonObjectFormatter(obj: Any):
@@ -15,6 +20,46 @@ def JsonObjectFormatter(obj: Any):
     raise TypeError("%r is not JSON serializable" % obj)
 
 
+BSON_STRING_TYPES = (ObjectId, datetime)
+# documents fetched per round trip by the streaming helpers
+CURSOR_BATCH_SIZE = 500
+# listing counts are reused for a while as long as the collection is not
+# written through the helpers below
+COUNT_CACHE_TTL_SECONDS = int(os.getenv("COUNT_CACHE_TTL_SECONDS", 30))
+COUNT_CACHE_MAX_SIZE = int(os.getenv("COUNT_CACHE_MAX_SIZE", 1000))
+# stages that never change how many documents a pipeline returns
+COUNT_NEUTRAL_STAGES = {"$sort", "$project", "$addFields", "$set", "$unset"}
+
+# (collection, normalized filter) -> {"count", "expires_at"}
+COUNT_CACHE = {}
+
+
+def JsonObjectConverter(obj: Any):
+    """
+    Same result as a json.dumps / json.loads round trip with
+    JsonObjectFormatter, done in one pass without building the JSON text.
+    """
+    obj_type = type(obj)
+    if obj_type is dict:
+        return {
+            key: (
+                JsonObjectConverter(value)
+                if type(value) in (dict, list, tuple)
+                or isinstance(value, BSON_STRING_TYPES)
+                else value
+            )
+            for key, value in obj.items()
+        }
+
+    if obj_type is list or obj_type is tuple:
+        return [JsonObjectConverter(value) for value in obj]
+
+    if isinstance(obj, BSON_STRING_TYPES):
+        return str(obj)
+
+    return obj
+
+
 async def GetDistinctData(v_db_collection, v_query=None, v_field="_id"):
     if v_query is not None:
         cursor = v_db_collection.distinct(v_field, v_query)
@@ -29,6 +74,63 @@ async def GetDataCount(v_db_collection, v_query={}):
     return count
 
 
+def GetCountCacheKey(v_db_collection, v_pipeline: list):
+    # the listing sort and the added fields do not change the count, a user
+    # flipping pages or sorting reuses the same entry
+    stages = [stage for stage in v_pipeline if not COUNT_NEUTRAL_STAGES & set(stage)]
+    return (v_db_collection.full_name, json_util.dumps(stages, sort_keys=True))
+
+
+def IsUnfilteredPipeline(v_pipeline: list):
+    return all(stage["$match"] == {} for stage in v_pipeline if "$match" in stage)
+
+
+def GetCachedCount(key: tuple):
+    entry = COUNT_CACHE.get(key)
+    if entry is None or entry["expires_at"] <= time.monotonic():
+        return None
+
+    return entry["count"]
+
+
+def SetCachedCount(key: tuple, count: int):
+    COUNT_CACHE.pop(key, None)
+    if len(COUNT_CACHE) >= COUNT_CACHE_MAX_SIZE:
+        # dicts keep insertion order, the first entry is the oldest one
+        COUNT_CACHE.pop(next(iter(COUNT_CACHE)))
+
+    COUNT_CACHE[key] = {
+        "count": count,
+        "expires_at": time.monotonic() + COUNT_CACHE_TTL_SECONDS,
+    }
+
+
+def InvalidateDataCount(v_db_collection):
+    for key in [key for key in COUNT_CACHE if key[0] == v_db_collection.full_name]:
+        COUNT_CACHE.pop(key, None)
+
+
+async def GetCachedDataCount(v_db_collection, v_pipeline: list):
+    """
+    Return the count of documents of a listing pipeline and whether it is
+    exact. An unfiltered listing uses the collection metadata estimate,
+    a filtered one is counted once and cached for COUNT_CACHE_TTL_SECONDS.
+    """
+    if IsUnfilteredPipeline(v_pipeline):
+        return await v_db_collection.estimated_document_count(), False
+
+    key = GetCountCacheKey(v_db_collection, v_pipeline)
+    count = GetCachedCount(key)
+    if count is None:
+        stages = [stage for stage in v_pipeline if "$sort" not in stage]
+        count = await GetPipelineDataCount(
+            v_db_collection, stages + [{"$count": "count"}]
+        )
+        SetCachedCount(key, count)
+
+    return count, True
+
+
 async def GetOneData(
     v_db_collection,
     v_query={},
@@ -44,25 +146,30 @@ async def GetOneData(
     cursor = v_db_collection.find_one(v_query, v_projection, sort=sort_value)
     result = await cursor
     if is_json:
-        result = json.dumps(result, default=JsonObjectFormatter)
-        result = json.loads(result)
+        result = JsonObjectConverter(result)
 
     return result
 
 
-async def GetAggregateData(v_db_collection, v_pipeline: list = [], v_projection={}):
+async def GetAggregateData(
+    v_db_collection, v_pipeline: list = [], v_projection={}, is_json=True
+):
     pipeline = v_pipeline.copy()
     if v_projection:
         pipeline.append({"$project": v_projection})
     result = await v_db_collection.aggregate(pipeline).to_list(None)
-    result = json.dumps(result, default=JsonObjectFormatter)
-    result = json.loads(result)
+    if is_json:
+        result = JsonObjectConverter(result)
 
     return result
 
 
 async def GetManyData(
-    v_db_collection, v_query, v_projection={}, v_pagination: Pagination = {}
+    v_db_collection,
+    v_query,
+    v_projection={},
+    v_pagination: Pagination = {},
+    is_json=True,
 ):
     query = []
     query_facet = v_query.copy()
@@ -92,8 +199,9 @@ async def GetManyData(
         }
     )
     result = await v_db_collection.aggregate(query_facet).to_list(None)
-    result = json.dumps(result, default=JsonObjectFormatter)
-    result = json.loads(result)
+    if is_json:
+        result = JsonObjectConverter(result)
+
     data = []
     if "data" in result[0]:
         data = result[0]["data"]
@@ -105,33 +213,255 @@ async def GetManyData(
     return data, count
 
 
+async def GetManyDataCachedCount(
+    v_db_collection,
+    v_query,
+    v_projection={},
+    v_pagination: Pagination = {},
+    is_json=True,
+):
+    """
+    GetManyData with the count taken from GetCachedDataCount. The facet
+    counting every document only runs when the count is not known yet.
+    Returns the data, the count and whether the count is exact.
+    """
+    is_unfiltered = IsUnfilteredPipeline(v_query)
+    key = GetCountCacheKey(v_db_collection, v_query)
+    if not is_unfiltered and GetCachedCount(key) is None:
+        data, count = await GetManyData(
+            v_db_collection, v_query, v_projection, v_pagination, is_json
+        )
+        SetCachedCount(key, count)
+        return data, count, True
+
+    pipeline = v_query.copy()
+    if v_pagination:
+        pipeline.append({"$skip": (v_pagination["page"] - 1) * v_pagination["items"]})
+        pipeline.append({"$limit": v_pagination["items"]})
+
+    data = await GetAggregateData(v_db_collection, pipeline, v_projection, is_json)
+    count, is_count_exact = await GetCachedDataCount(v_db_collection, v_query)
+    return data, count, is_count_exact
+
+
+def EncodePaginationCursor(sort_keys: list, values: list):
+    # json_util keeps ObjectId and datetime values typed inside the cursor
+    cursor = json_util.dumps({"s": sort_keys, "v": values})
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def DecodePaginationCursor(cursor: str, sort_keys: list):
+    """
+    Return the sort values of the last document of the previous page.
+    Raises ValueError for a malformed cursor or one made for another sort.
+    """
+    try:
+        cursor_data = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("invalid cursor")
+
+    if not isinstance(cursor_data, dict) or cursor_data.get("s") != sort_keys:
+        raise ValueError("cursor does not match the sort")
+
+    return cursor_data["v"]
+
+
+def GetKeysetCondition(key: str, direction: int, value: Any):
+    # nulls sort first, so they come before any value ascending and after
+    # any value descending
+    if direction == 1:
+        return {key: {"$gt": value}} if value is not None else {key: {"$ne": None}}
+
+    if value is None:
+        return None
+
+    return {"$or": [{key: {"$lt": value}}, {key: None}]}
+
+
+def GetKeysetMatch(sort: list, values: list):
+    branches = []
+    for index, (key, direction) in enumerate(sort):
+        condition = GetKeysetCondition(key, direction, values[index])
+        if condition is None:
+            continue
+
+        branches.append(
+            {
+                "$and": [
+                    *[{sort[item][0]: values[item]} for item in range(index)],
+                    condition,
+                ]
+            }
+        )
+
+    return {"$or": branches} if branches else {"_id": {"$exists": False}}
+
+
+async def GetManyDataByCursor(
+    v_db_collection,
+    v_pipeline: list,
+    v_sort: list,
+    v_cursor: str = None,
+    v_items: int = 10,
+    v_after_pipeline: list = [],
+    v_projection={},
+    with_count=True,
+    is_json=True,
+):
+    """
+    Keyset version of GetManyData. v_pipeline matches and computes the sort
+    fields, v_sort is [(key, 1 | -1)] and _id is added as the tie breaker,
+    v_after_pipeline (lookups) only runs for the documents of the page. A
+    page after a cursor is as cheap as the first one, skip is never used.
+    Returns the data, the count (None without with_count), the cursor of
+    the next page (None on the last page) and whether the count is exact.
+    """
+    sort = [(key, direction) for key, direction in v_sort]
+    if "_id" not in [key for key, _ in sort]:
+        sort.append(("_id", sort[-1][1] if sort else 1))
+
+    sort_keys = [key for key, _ in sort]
+    pipeline = v_pipeline.copy()
+    if v_cursor:
+        pipeline.append(
+            {
+                "$match": GetKeysetMatch(
+                    sort, DecodePaginationCursor(v_cursor, sort_keys)
+                )
+            }
+        )
+
+    pipeline += [
+        {"$sort": {key: direction for key, direction in sort}},
+        {"$limit": v_items + 1},
+        # a missing sort field is left out of _cursor and read back as null
+        {
+            "$addFields": {
+                "_cursor": {
+                    str(index): f"${key}" for index, key in enumerate(sort_keys)
+                }
+            }
+        },
+        *v_after_pipeline,
+    ]
+    if v_projection:
+        projection = dict(v_projection)
+        if any(value not in (0, False) for value in projection.values()):
+            projection["_cursor"] = 1
+
+        pipeline.append({"$project": projection})
+
+    result = await v_db_collection.aggregate(pipeline).to_list(None)
+    next_cursor = None
+    if len(result) > v_items:
+        result = result[:v_items]
+        values = result[-1]["_cursor"]
+        next_cursor = EncodePaginationCursor(
+            sort_keys, [values.get(str(index)) for index in range(len(sort_keys))]
+        )
+
+    for document in result:
+        document.pop("_cursor", None)
+
+    count, is_count_exact = None, None
+    if with_count:
+        count, is_count_exact = await GetCachedDataCount(v_db_collection, v_pipeline)
+
+    if is_json:
+        result = JsonObjectConverter(result)
+
+    return result, count, next_cursor, is_count_exact
+
+
+async def IterateData(
+    v_db_collection,
+    v_query={},
+    v_projection={},
+    sort_by=None,
+    sort_direction=1,
+    batch_size: int = CURSOR_BATCH_SIZE,
+    is_json=True,
+):
+    """
+    Yield the documents of a find one by one, the cursor holds at most
+    batch_size documents in memory whatever the collection size is.
+    """
+    cursor = v_db_collection.find(v_query, v_projection or None)
+    if sort_by:
+        cursor = cursor.sort(sort_by, sort_direction)
+
+    async for document in cursor.batch_size(batch_size):
+        yield JsonObjectConverter(document) if is_json else document
+
+
+async def IterateAggregateData(
+    v_db_collection,
+    v_pipeline: list = [],
+    v_projection={},
+    batch_size: int = CURSOR_BATCH_SIZE,
+    is_json=True,
+):
+    """
+    Streaming version of GetAggregateData, see IterateData.
+    """
+    pipeline = v_pipeline.copy()
+    if v_projection:
+        pipeline.append({"$project": v_projection})
+
+    cursor = v_db_collection.aggregate(pipeline, batchSize=batch_size)
+    async for document in cursor:
+        yield JsonObjectConverter(document) if is_json else document
+
+
+async def IterateBatches(documents, batch_size: int = CURSOR_BATCH_SIZE):
+    """
+    Group the documents of IterateData or IterateAggregateData into lists
+    of batch_size, for loops that write or send per batch.
+    """
+    batch = []
+    async for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
 async def CreateOneData(v_db_collection, v_data):
     result = await v_db_collection.insert_one(v_data)
+    InvalidateDataCount(v_db_collection)
     return result
 
 
 async def CreateManyData(v_db_collection, v_data):
     result = await v_db_collection.insert_many(v_data)
+    InvalidateDataCount(v_db_collection)
     return result
 
 
 async def UpdateOneData(v_db_collection, v_query, v_update, upsert: bool = False):
     result = await v_db_collection.update_one(v_query, v_update, upsert)
+    InvalidateDataCount(v_db_collection)
     return result
 
 
 async def UpdateManyData(v_db_collection, v_query, v_update):
     result = await v_db_collection.update_many(v_query, v_update)
+    InvalidateDataCount(v_db_collection)
     return result
 
 
 async def DeleteOneData(v_db_collection, v_query):
     result = await v_db_collection.delete_one(v_query)
+    InvalidateDataCount(v_db_collection)
     return result
 
 
 async def DeleteManyData(v_db_collection, v_query):
     result = await v_db_collection.delete_many(v_query)
+    InvalidateDataCount(v_db_collection)
     return result
 
 
@@ -165,10 +165,13 @@ def DateIDFormatter(date, is_show_time: bool = False):
     }
 
     # Parsing tanggal
-    try:
-        parsed_date = datetime.strptime(date, "%Y-%m-%d %H:%M:%S.%f")
-    except ValueError:
-        parsed_date = datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+    if isinstance(date, datetime):
+        parsed_date = date
+    else:
+        try:
+            parsed_date = datetime.strptime(date, "%Y-%m-%d %H:%M:%S.%f")
+        except ValueError:
+            parsed_date = datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
 
     # Format tanggal
     date_part = (
@@ -0,0 +1,44 @@
+import httpx
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+HTTP_KEEPALIVE_SECONDS = int(os.getenv("HTTP_KEEPALIVE_SECONDS", 30))
+HTTP_DEFAULT_TIMEOUT_SECONDS = 15
+# request timeout (seconds) of each outbound gateway
+HTTP_GATEWAY_TIMEOUTS = {
+    "bablast": 15,
+    "mpwa": 15,
+    "telegram": 15,
+    "moota": 30,
+    "ipaymu": 60,
+}
+
+# one pooled client per gateway, created lazily on the running event loop
+HTTP_CLIENTS = {}
+
+
+def GetHTTPClient(gateway: str) -> httpx.AsyncClient:
+    client = HTTP_CLIENTS.get(gateway)
+    if client is None or client.is_closed:
+        timeout = HTTP_GATEWAY_TIMEOUTS.get(gateway, HTTP_DEFAULT_TIMEOUT_SECONDS)
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 10)),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+            ),
+        )
+        HTTP_CLIENTS[gateway] = client
+
+    return client
+
+
+async def CloseHTTPClients():
+    for client in HTTP_CLIENTS.values():
+        await client.aclose()
+
+    HTTP_CLIENTS.clear()
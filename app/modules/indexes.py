@@ -0,0 +1,152 @@
+import asyncio
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from app.modules.database import GetAmretaDatabase
+
+# collection -> index name -> IndexModel. The listing indexes are declared
+# below, the worker collections register theirs next to the code that
+# queries them, so the registry is complete once the app modules are imported
+INDEX_REGISTRY = {}
+INDEX_BUILD = {"task": None}
+
+
+def RegisterIndexes(collection: str, indexes: list):
+    registered = INDEX_REGISTRY.setdefault(collection, {})
+    for index in indexes:
+        registered[index.document["name"]] = index
+
+
+RegisterIndexes(
+    "invoices",
+    [
+        IndexModel(
+            [("id_customer", ASCENDING), ("month", ASCENDING), ("year", ASCENDING)],
+            name="id_customer_month_year",
+        ),
+        IndexModel(
+            [("status", ASCENDING), ("due_date", ASCENDING)], name="status_due_date"
+        ),
+    ],
+)
+RegisterIndexes(
+    "customers",
+    [
+        IndexModel(
+            [("status", ASCENDING), ("due_date", ASCENDING)], name="status_due_date"
+        ),
+        IndexModel([("id_router", ASCENDING)], name="id_router"),
+        IndexModel([("id_odp", ASCENDING)], name="id_odp"),
+        IndexModel([("referral", ASCENDING)], name="referral"),
+    ],
+)
+RegisterIndexes(
+    "notifications",
+    [
+        IndexModel(
+            [("id_user", ASCENDING), ("is_read", ASCENDING)], name="id_user_is_read"
+        ),
+    ],
+)
+# _id follows date so the keyset pages of the date listings are read in
+# index order without a blocking sort
+RegisterIndexes(
+    "incomes",
+    [
+        IndexModel([("date", ASCENDING), ("_id", ASCENDING)], name="date_id"),
+        # payment confirmation upserts the income of an invoice by id_invoice
+        IndexModel(
+            [("id_invoice", ASCENDING)],
+            name="id_invoice",
+            partialFilterExpression={"id_invoice": {"$exists": True}},
+        ),
+    ],
+)
+RegisterIndexes(
+    "expenditures",
+    [IndexModel([("date", ASCENDING), ("_id", ASCENDING)], name="date_id")],
+)
+
+
+async def EnsureIndexes(db, collections: list = None):
+    """
+    Create the registered indexes of the collections, every registered
+    collection when None. Existing indexes are left as they are, an index
+    that cannot be built is printed and skipped. Returns the failures as
+    {"collection.name": error}.
+    """
+    failed = {}
+    for collection in collections or list(INDEX_REGISTRY):
+        for name, index in INDEX_REGISTRY.get(collection, {}).items():
+            try:
+                await db[collection].create_indexes([index])
+            except OperationFailure as e:
+                failed[f"{collection}.{name}"] = str(e)
+                print(f"Index {collection}.{name} not created: {str(e)}")
+
+    return failed
+
+
+async def GetIndexReport(db):
+    """
+    Compare the registered indexes with the database. Per collection:
+    missing registered indexes, existing indexes nobody registered and
+    indexes without any use in $indexStats. The usage counters restart
+    with the mongod process, an index is only unused since "since".
+    """
+    report = {}
+    for collection, indexes in INDEX_REGISTRY.items():
+        existing = {}
+        async for item in db[collection].list_indexes():
+            existing[item["name"]] = list(item["key"].items())
+
+        registered_keys = [
+            list(index.document["key"].items()) for index in indexes.values()
+        ]
+        try:
+            index_stats = (
+                await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+            )
+        except OperationFailure:
+            index_stats = []
+
+        report[collection] = {
+            # an index built by hand under another name still counts
+            "missing": [
+                name
+                for name, index in indexes.items()
+                if name not in existing
+                and list(index.document["key"].items()) not in existing.values()
+            ],
+            "unregistered": [
+                name
+                for name, key in existing.items()
+                if name != "_id_" and name not in indexes and key not in registered_keys
+            ],
+            "unused": [
+                {"name": item["name"], "since": str(item["accesses"]["since"])}
+                for item in index_stats
+                if item["name"] != "_id_" and item["accesses"]["ops"] == 0
+            ],
+        }
+
+    return report
+
+
+async def IndexBuildTask():
+    db = await GetAmretaDatabase()
+    try:
+        await EnsureIndexes(db)
+    except Exception as e:
+        print(f"Index build stopped: {str(e)}")
+
+
+async def StartIndexBuild():
+    # the builds run on the server, startup does not wait for them
+    INDEX_BUILD["task"] = asyncio.create_task(IndexBuildTask())
+
+
+async def StopIndexBuild():
+    task = INDEX_BUILD["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
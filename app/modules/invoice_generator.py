@@ -0,0 +1,207 @@
+from calendar import monthrange
+from datetime import datetime
+import time
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import BulkWriteError
+from dateutil.relativedelta import relativedelta
+from app.models.invoices import InvoiceStatusData
+from app.modules.crud_operations import GetAggregateData, InvalidateDataCount
+from app.modules.generals import GetCurrentDateTime
+from app.modules.indexes import EnsureIndexes, RegisterIndexes
+from app.modules.invoice_pricing import (
+    InvoiceCustomerProjections,
+    GetPackagePriceTable,
+    PriceCustomerInvoices,
+)
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INVOICE_WRITE_BATCH_SIZE = int(os.getenv("INVOICE_WRITE_BATCH_SIZE", 500))
+INVOICE_PERIOD_INDEX_NAME = "service_number_month_year_unique"
+DUPLICATE_KEY_ERROR_CODE = 11000
+INVOICE_INDEX_STATE = {"is_ensured": False}
+
+# unique period key keeps overlapping generate runs from double billing, it
+# also serves the service_number lookups as its prefix
+RegisterIndexes(
+    "invoices",
+    [
+        IndexModel(
+            [
+                ("service_number", ASCENDING),
+                ("month", ASCENDING),
+                ("year", ASCENDING),
+            ],
+            name=INVOICE_PERIOD_INDEX_NAME,
+            unique=True,
+            background=True,
+        )
+    ],
+)
+
+
+async def EnsureInvoicePeriodIndex(db):
+    failed = await EnsureIndexes(db, ["invoices"])
+    if f"invoices.{INVOICE_PERIOD_INDEX_NAME}" in failed:
+        return False
+
+    INVOICE_INDEX_STATE["is_ensured"] = True
+    return True
+
+
+async def GetExistingInvoiceKeys(db, service_numbers: list, periods: list):
+    if len(service_numbers) == 0 or len(periods) == 0:
+        return set()
+
+    pipeline = [
+        {
+            "$match": {
+                "service_number": {"$in": service_numbers},
+                "$or": [{"month": month, "year": year} for month, year in periods],
+            }
+        }
+    ]
+    invoice_keys = await GetAggregateData(
+        db.invoices, pipeline, {"_id": 0, "service_number": 1, "month": 1, "year": 1}
+    )
+    return {
+        (item.get("service_number"), item.get("month"), item.get("year"))
+        for item in invoice_keys
+    }
+
+
+def CreateInvoiceData(
+    customer: dict, line_items: dict, month: str, year: str, due_date: str
+):
+    invoice_data = {
+        "id_customer": ObjectId(customer["_id"]),
+        "name": customer["name"],
+        "service_number": customer["service_number"],
+        "package": line_items["package"],
+        "due_date": datetime.strptime(
+            f"{year}-{month}-{due_date} 23:59:59", "%Y-%m-%d %H:%M:%S"
+        ),
+        "add_on_packages": line_items["add_on_packages"],
+        "month": month,
+        "year": year,
+        "status": InvoiceStatusData.UNPAID.value,
+        "package_amount": line_items["package_amount"],
+        "add_on_package_amount": line_items["add_on_package_amount"],
+        "ppn": line_items["ppn"],
+        "unique_code": line_items["unique_code"],
+        "amount": line_items["amount"],
+        "created_at": GetCurrentDateTime(),
+    }
+    if line_items["paid_leave_discount"]:
+        invoice_data["paid_leave_discount"] = line_items["paid_leave_discount"]
+
+    return invoice_data
+
+
+async def CreateInvoicesInBulk(db, invoices: list):
+    inserted_ids = []
+    duplicated = 0
+    for start in range(0, len(invoices), INVOICE_WRITE_BATCH_SIZE):
+        batch = invoices[start : start + INVOICE_WRITE_BATCH_SIZE]
+        failed_index = set()
+        try:
+            await db.invoices.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed_index.add(error.get("index"))
+                if error.get("code") == DUPLICATE_KEY_ERROR_CODE:
+                    duplicated += 1
+                else:
+                    print(error.get("errmsg"))
+
+        # insert_many assigns the _id client side, so skipped documents are
+        # the only ones without a stored invoice
+        for index, invoice in enumerate(batch):
+            if index not in failed_index:
+                inserted_ids.append(invoice["_id"])
+
+    InvalidateDataCount(db.invoices)
+    return inserted_ids, duplicated
+
+
+async def GenerateCustomerInvoices(
+    db,
+    query: dict,
+    next_month_dates: list = [],
+    current_date: datetime = None,
+    limit: int = 0,
+):
+    if not INVOICE_INDEX_STATE["is_ensured"]:
+        await EnsureInvoicePeriodIndex(db)
+
+    timings = {}
+    if current_date is None:
+        current_date = GetCurrentDateTime()
+    next_month = current_date + relativedelta(months=1)
+    max_date_of_month = monthrange(current_date.year, current_date.month)[1]
+    current_period = (current_date.strftime("%m"), current_date.strftime("%Y"))
+    next_period = (next_month.strftime("%m"), next_month.strftime("%Y"))
+
+    # fetch phase
+    phase_start = time.perf_counter()
+    pipeline = [{"$match": query}, {"$sort": {"_id": 1}}]
+    if limit:
+        pipeline.append({"$limit": limit})
+
+    customer_data = await GetAggregateData(
+        db.customers, pipeline, InvoiceCustomerProjections
+    )
+    price_table = await GetPackagePriceTable(db)
+    service_numbers = [item.get("service_number") for item in customer_data]
+    exist_keys = await GetExistingInvoiceKeys(
+        db, service_numbers, [current_period, next_period]
+    )
+    timings["fetch"] = round(time.perf_counter() - phase_start, 4)
+
+    # price phase
+    phase_start = time.perf_counter()
+    invoices = []
+    invoice_exist = 0
+    invoice_line_items = PriceCustomerInvoices(customer_data, price_table)
+    for customer, line_items in zip(customer_data, invoice_line_items):
+        try:
+            customer_due_date = customer.get("due_date")
+            if int(customer_due_date) > max_date_of_month:
+                customer_due_date = str(max_date_of_month).zfill(2)
+
+            target_month, target_year = current_period
+            if customer_due_date in next_month_dates:
+                target_month, target_year = next_period
+
+            key = (customer["service_number"], target_month, target_year)
+            if key in exist_keys:
+                invoice_exist += 1
+                continue
+
+            exist_keys.add(key)
+            invoices.append(
+                CreateInvoiceData(
+                    customer, line_items, target_month, target_year, customer_due_date
+                )
+            )
+        except Exception as e:
+            print(str(e))
+            continue
+    timings["price"] = round(time.perf_counter() - phase_start, 4)
+
+    # write phase
+    phase_start = time.perf_counter()
+    inserted_ids, duplicated = await CreateInvoicesInBulk(db, invoices)
+    timings["write"] = round(time.perf_counter() - phase_start, 4)
+
+    return {
+        "id_last_customer": customer_data[-1]["_id"] if customer_data else None,
+        "customer_count": len(customer_data),
+        "invoice_exist": invoice_exist + duplicated,
+        "invoice_created": len(inserted_ids),
+        "invoice_ids": [str(id) for id in inserted_ids],
+        "timings": timings,
+    }
@@ -0,0 +1,75 @@
+from app.models.customers import CustomerStatusData
+from app.modules.crud_operations import GetAggregateData
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PPN = int(os.getenv("PPN"))
+PAID_LEAVE_PERCENTAGE = int(os.getenv("PAID_LEAVE_PERCENTAGE"))
+
+# customer fields needed to price an invoice
+InvoiceCustomerProjections = {
+    "name": 1,
+    "service_number": 1,
+    "due_date": 1,
+    "ppn": 1,
+    "status": 1,
+    "unique_code": 1,
+    "id_package": 1,
+    "id_add_on_package": 1,
+}
+
+
+async def GetPackagePriceTable(db):
+    package_data = await GetAggregateData(db.packages, [], {"name": 1, "price": 1})
+    return {item["_id"]: item for item in package_data}
+
+
+def GetPackagePrice(package: dict):
+    return package.get("price", {}).get("regular", 0) or 0
+
+
+def GetInvoiceLineItems(customer: dict, price_table: dict):
+    package = []
+    package_amount = 0
+    main_package = price_table.get(str(customer.get("id_package")))
+    if main_package:
+        package.append(main_package)
+        package_amount = GetPackagePrice(main_package)
+
+    add_on_packages = []
+    add_on_package_amount = 0
+    for id_add_on_package in dict.fromkeys(
+        str(item) for item in customer.get("id_add_on_package") or []
+    ):
+        add_on_package = price_table.get(id_add_on_package)
+        if add_on_package:
+            add_on_packages.append(add_on_package)
+            add_on_package_amount += GetPackagePrice(add_on_package)
+
+    amount = package_amount + add_on_package_amount
+    unique_code = customer.get("unique_code", 1)
+    ppn = 0
+    paid_leave_discount = 0
+    if customer.get("ppn", 0):
+        ppn = amount * (PPN / 100)
+
+    if customer.get("status") == CustomerStatusData.PAID_LEAVE.value:
+        paid_leave_discount = amount * ((100 - PAID_LEAVE_PERCENTAGE) / 100)
+        amount = amount - paid_leave_discount
+
+    return {
+        "package": package,
+        "add_on_packages": add_on_packages,
+        "package_amount": package_amount,
+        "add_on_package_amount": add_on_package_amount,
+        "ppn": ppn,
+        "paid_leave_discount": paid_leave_discount,
+        "unique_code": unique_code,
+        "amount": amount + ppn + unique_code,
+    }
+
+
+def PriceCustomerInvoices(customers: list, price_table: dict):
+    return [GetInvoiceLineItems(customer, price_table) for customer in customers]
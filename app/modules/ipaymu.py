@@ -0,0 +1,350 @@
+import asyncio
+from datetime import timedelta
+import hashlib
+import hmac
+import json
+import time
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from app.models.payments import IpaymuCallbackStatusData
+from app.modules.crud_operations import CreateOneData, GetAggregateData
+from app.modules.database import GetAmretaDatabase
+from app.modules.generals import GetCurrentDateTime
+from app.modules.http_client import GetHTTPClient
+from app.modules.indexes import EnsureIndexes, RegisterIndexes
+from app.modules.jobs import JOB_WORKER_ID
+from app.modules.payment_confirmation import ConfirmInvoicePayments
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IPAYMU_API_DOMAIN = os.getenv("IPAYMU_API_DOMAIN")
+IPAYMU_VA = os.getenv("IPAYMU_VA")
+IPAYMU_API_TOKEN = os.getenv("IPAYMU_API_TOKEN")
+IPAYMU_CALLBACK_BATCH_SIZE = int(os.getenv("IPAYMU_CALLBACK_BATCH_SIZE", 100))
+IPAYMU_CALLBACK_MAX_ATTEMPTS = int(os.getenv("IPAYMU_CALLBACK_MAX_ATTEMPTS", 5))
+IPAYMU_CALLBACK_POLL_SECONDS = int(os.getenv("IPAYMU_CALLBACK_POLL_SECONDS", 30))
+IPAYMU_CALLBACK_LEASE_SECONDS = 300
+# ipaymu status_code of a successful payment
+IPAYMU_SUCCESS_STATUS_CODE = "1"
+
+# channels are served from memory for the ttl, then served stale while one
+# background fetch refreshes them, up to the stale limit
+IPAYMU_CHANNEL_TTL_SECONDS = int(os.getenv("IPAYMU_CHANNEL_TTL_SECONDS", 3600))
+IPAYMU_CHANNEL_STALE_SECONDS = int(os.getenv("IPAYMU_CHANNEL_STALE_SECONDS", 86400))
+# payment channel groups offered at checkout
+IPAYMU_CHANNEL_CODES = ["cstore", "va"]
+
+IPAYMU_CALLBACK_WORKER = {"task": None, "event": None}
+IPAYMU_CHANNEL_CACHE = {
+    "data": None,
+    "fetched_at": None,
+    "loaded_at": None,
+    "task": None,
+    "error": None,
+}
+
+
+def CreateIpaymuHeaders(method: str, data_body: str):
+    encrypt_body = hashlib.sha256(data_body.encode()).hexdigest()
+    string_to_sign = "{}:{}:{}:{}".format(
+        method, IPAYMU_VA, encrypt_body, IPAYMU_API_TOKEN
+    )
+    signature = (
+        hmac.new(IPAYMU_API_TOKEN.encode(), string_to_sign.encode(), hashlib.sha256)
+        .hexdigest()
+        .lower()
+    )
+    return {
+        "Content-type": "application/json",
+        "Accept": "application/json",
+        "signature": signature,
+        "va": IPAYMU_VA,
+        "timestamp": GetCurrentDateTime().strftime("%Y%m%d%H%M%S"),
+    }
+
+
+async def FetchIpaymuChannels():
+    data_body = json.dumps({}, separators=(",", ":"))
+    response = await GetHTTPClient("ipaymu").request(
+        "GET",
+        f"{IPAYMU_API_DOMAIN}/api/v2/payment-channels",
+        headers=CreateIpaymuHeaders("GET", data_body),
+        content=data_body,
+    )
+    response.raise_for_status()
+    channel_options = []
+    for item in response.json().get("Data", []):
+        if item.get("Code") in IPAYMU_CHANNEL_CODES:
+            channel_options += item.get("Channels", [])
+
+    return channel_options
+
+
+async def LoadIpaymuChannels():
+    try:
+        channel_options = await FetchIpaymuChannels()
+    except Exception as e:
+        IPAYMU_CHANNEL_CACHE["error"] = str(e)
+        raise
+    finally:
+        IPAYMU_CHANNEL_CACHE["task"] = None
+
+    IPAYMU_CHANNEL_CACHE.update(
+        {
+            "data": channel_options,
+            "fetched_at": GetCurrentDateTime(),
+            "loaded_at": time.monotonic(),
+            "error": None,
+        }
+    )
+    return channel_options
+
+
+def RefreshIpaymuChannels():
+    # concurrent misses share the fetch that is already running
+    if IPAYMU_CHANNEL_CACHE["task"] is None:
+        task = asyncio.create_task(LoadIpaymuChannels())
+        # a background refresh may fail with nobody awaiting it
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        IPAYMU_CHANNEL_CACHE["task"] = task
+
+    return IPAYMU_CHANNEL_CACHE["task"]
+
+
+def GetIpaymuChannelCacheAge():
+    if IPAYMU_CHANNEL_CACHE["loaded_at"] is None:
+        return None
+
+    return time.monotonic() - IPAYMU_CHANNEL_CACHE["loaded_at"]
+
+
+async def GetIpaymuChannels(is_refresh: bool = False):
+    """
+    Return the checkout payment channels from the cache. A stale catalogue
+    is returned at once and refreshed in the background, only a missing or
+    expired catalogue waits for iPaymu.
+    """
+    age = GetIpaymuChannelCacheAge()
+    if is_refresh or age is None:
+        return await asyncio.shield(RefreshIpaymuChannels())
+
+    if age < IPAYMU_CHANNEL_TTL_SECONDS:
+        return IPAYMU_CHANNEL_CACHE["data"]
+
+    refresh_task = RefreshIpaymuChannels()
+    if age < IPAYMU_CHANNEL_STALE_SECONDS:
+        return IPAYMU_CHANNEL_CACHE["data"]
+
+    try:
+        return await asyncio.shield(refresh_task)
+    except Exception:
+        # an expired catalogue is still better than no checkout at all
+        return IPAYMU_CHANNEL_CACHE["data"]
+
+
+def GetIpaymuChannelCacheInfo():
+    age = GetIpaymuChannelCacheAge()
+    fetched_at = IPAYMU_CHANNEL_CACHE["fetched_at"]
+    return {
+        "count": len(IPAYMU_CHANNEL_CACHE["data"] or []),
+        "fetched_at": str(fetched_at) if fetched_at else None,
+        "age_seconds": round(age, 3) if age is not None else None,
+        "ttl_seconds": IPAYMU_CHANNEL_TTL_SECONDS,
+        "stale_seconds": IPAYMU_CHANNEL_STALE_SECONDS,
+        "is_stale": age is None or age >= IPAYMU_CHANNEL_TTL_SECONDS,
+        "is_refreshing": IPAYMU_CHANNEL_CACHE["task"] is not None,
+        "error": IPAYMU_CHANNEL_CACHE["error"],
+    }
+
+
+RegisterIndexes(
+    "ipaymu_callbacks",
+    [
+        # gateway retries of the same notification are dropped by this key
+        IndexModel(
+            [("reference_id", ASCENDING), ("status_code", ASCENDING)],
+            name="reference_id_status_code",
+            unique=True,
+        ),
+        IndexModel(
+            [("status", ASCENDING), ("received_at", ASCENDING)],
+            name="status_received_at",
+        ),
+    ],
+)
+
+
+async def EnsureIpaymuCallbackIndex(db):
+    await EnsureIndexes(db, ["ipaymu_callbacks"])
+
+
+async def StoreIpaymuCallback(db, callback_data: dict):
+    """
+    Persist a callback once per reference_id and status_code. Returns False
+    when the same notification was already received.
+    """
+    try:
+        await db.ipaymu_callbacks.insert_one(
+            {
+                "reference_id": str(callback_data.get("reference_id")),
+                "status_code": str(callback_data.get("status_code", "0")),
+                "payment_channel": callback_data.get("payment_channel", ""),
+                "raw": callback_data,
+                "status": IpaymuCallbackStatusData.PENDING.value,
+                "attempts": 0,
+                "received_at": GetCurrentDateTime(),
+            }
+        )
+    except DuplicateKeyError:
+        return False
+
+    if IPAYMU_CALLBACK_WORKER["event"]:
+        IPAYMU_CALLBACK_WORKER["event"].set()
+
+    return True
+
+
+async def ClaimIpaymuCallback(db):
+    now = GetCurrentDateTime()
+    return await db.ipaymu_callbacks.find_one_and_update(
+        {
+            "$or": [
+                {"status": IpaymuCallbackStatusData.PENDING.value},
+                # picked by a worker that died before recording the result
+                {
+                    "status": IpaymuCallbackStatusData.PROCESSING.value,
+                    "locked_until": {"$lt": now},
+                },
+            ]
+        },
+        {
+            "$set": {
+                "status": IpaymuCallbackStatusData.PROCESSING.value,
+                "locked_by": JOB_WORKER_ID,
+                "locked_until": now + timedelta(seconds=IPAYMU_CALLBACK_LEASE_SECONDS),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("received_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def ProcessIpaymuCallbacks(db, limit: int = IPAYMU_CALLBACK_BATCH_SIZE):
+    """
+    Claim up to limit pending callbacks and confirm their invoices in one
+    batch, so the router provisioning and messages of a burst are sent
+    together. A failed batch goes back to PENDING, its retry resumes the
+    invoices already marked PAID. Returns the number of processed callbacks.
+    """
+    callbacks = []
+    while len(callbacks) < limit:
+        callback_data = await ClaimIpaymuCallback(db)
+        if not callback_data:
+            break
+
+        callbacks.append(callback_data)
+
+    if len(callbacks) == 0:
+        return 0
+
+    paid_callbacks = {
+        item["reference_id"]: item
+        for item in callbacks
+        if item["status_code"] == IPAYMU_SUCCESS_STATUS_CODE
+        and ObjectId.is_valid(item["reference_id"])
+    }
+    now = GetCurrentDateTime()
+    try:
+        invoices = await GetAggregateData(
+            db.invoices,
+            [
+                {
+                    "$match": {
+                        "_id": {"$in": [ObjectId(id) for id in paid_callbacks]},
+                    }
+                }
+            ],
+        )
+        await ConfirmInvoicePayments(
+            db,
+            invoices,
+            "IPaymu",
+            {
+                invoice["_id"]: {
+                    "channel": paid_callbacks[invoice["_id"]].get("payment_channel")
+                }
+                for invoice in invoices
+            },
+        )
+        await db.ipaymu_callbacks.update_many(
+            {"_id": {"$in": [item["_id"] for item in callbacks]}},
+            {
+                "$set": {
+                    "status": IpaymuCallbackStatusData.PROCESSED.value,
+                    "processed_at": now,
+                },
+                "$unset": {"locked_by": "", "locked_until": ""},
+            },
+        )
+    except Exception as e:
+        await CreateOneData(
+            db.logs_plugin,
+            {"plugin": "Ipaymu", "created_at": now, "error_message": str(e)},
+        )
+        await db.ipaymu_callbacks.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": item["_id"]},
+                    {
+                        "$set": {
+                            "status": (
+                                IpaymuCallbackStatusData.FAILED.value
+                                if item["attempts"] >= IPAYMU_CALLBACK_MAX_ATTEMPTS
+                                else IpaymuCallbackStatusData.PENDING.value
+                            ),
+                            "last_error": str(e),
+                        },
+                        "$unset": {"locked_by": "", "locked_until": ""},
+                    },
+                )
+                for item in callbacks
+            ],
+            ordered=False,
+        )
+
+    return len(callbacks)
+
+
+async def IpaymuCallbackWorkerLoop():
+    db = await GetAmretaDatabase()
+    await EnsureIpaymuCallbackIndex(db)
+    event = IPAYMU_CALLBACK_WORKER["event"]
+    while True:
+        event.clear()
+        try:
+            # a full batch means a burst, keep draining before waiting
+            if await ProcessIpaymuCallbacks(db) >= IPAYMU_CALLBACK_BATCH_SIZE:
+                continue
+        except Exception as e:
+            print(str(e))
+
+        try:
+            await asyncio.wait_for(event.wait(), timeout=IPAYMU_CALLBACK_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def StartIpaymuCallbackWorker():
+    IPAYMU_CALLBACK_WORKER["event"] = asyncio.Event()
+    IPAYMU_CALLBACK_WORKER["task"] = asyncio.create_task(IpaymuCallbackWorkerLoop())
+
+
+async def StopIpaymuCallbackWorker():
+    task = IPAYMU_CALLBACK_WORKER["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,305 @@
+import asyncio
+from datetime import timedelta
+import os
+import socket
+import time
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.models.jobs import JobStatusData
+from app.modules.crud_operations import CreateOneData, GetAggregateData, GetOneData
+from app.modules.database import GetAmretaDatabase
+from app.modules.generals import GetCurrentDateTime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", 200))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 300))
+JOB_WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+# job type -> chunk handler, filled by RegisterJobHandler at import time
+JOB_HANDLERS = {}
+# running job tasks of this process
+JOB_TASKS = {}
+JOB_WORKER = {"task": None}
+
+
+def RegisterJobHandler(job_type: str):
+    """
+    Register a chunk handler for a job type. The handler is called as
+    handler(db, job) and processes the next chunk after job["checkpoint"],
+    returning {"checkpoint", "processed", "is_done"} and optionally
+    "total" and "result" (numbers are accumulated, other values replaced).
+    """
+
+    def decorator(handler):
+        JOB_HANDLERS[job_type] = handler
+        return handler
+
+    return decorator
+
+
+def GetJobLeaseExpiredAt():
+    return GetCurrentDateTime() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+
+def GetJobProgress(job: dict):
+    total = job.get("total")
+    processed = job.get("processed", 0)
+    elapsed_seconds = job.get("elapsed_seconds", 0)
+    progress = None
+    throughput = None
+    eta_seconds = None
+    if total:
+        progress = round(min(processed / total, 1) * 100, 2)
+
+    if elapsed_seconds > 0:
+        throughput = round(processed / elapsed_seconds, 4)
+
+    if total is not None and throughput:
+        eta_seconds = round(max(total - processed, 0) / throughput, 2)
+
+    return {
+        "progress": progress,
+        "throughput": throughput,
+        "eta_seconds": eta_seconds,
+    }
+
+
+async def CreateJob(db, job_type: str, params: dict = {}):
+    job_data = {
+        "type": job_type,
+        "status": JobStatusData.PENDING.value,
+        "params": params,
+        "checkpoint": None,
+        "total": None,
+        "processed": 0,
+        "result": {},
+        "elapsed_seconds": 0,
+        "created_at": GetCurrentDateTime(),
+    }
+    result = await CreateOneData(db.jobs, job_data)
+    id_job = result.inserted_id
+    StartJobTask(db, id_job)
+    return str(id_job)
+
+
+def StartJobTask(db, id_job):
+    id_job = str(id_job)
+    task = JOB_TASKS.get(id_job)
+    if task and not task.done():
+        return task
+
+    task = asyncio.create_task(RunJob(db, id_job))
+    JOB_TASKS[id_job] = task
+    task.add_done_callback(lambda _: JOB_TASKS.pop(id_job, None))
+    return task
+
+
+async def ClaimJob(db, id_job: str):
+    now = GetCurrentDateTime()
+    job = await db.jobs.find_one_and_update(
+        {
+            "_id": ObjectId(id_job),
+            "status": {
+                "$in": [JobStatusData.PENDING.value, JobStatusData.RUNNING.value]
+            },
+            "$or": [
+                {"lease": {"$exists": False}},
+                {"lease.expired_at": {"$lt": now}},
+                {"lease.worker": JOB_WORKER_ID},
+            ],
+        },
+        {
+            "$set": {
+                "status": JobStatusData.RUNNING.value,
+                "lease": {
+                    "worker": JOB_WORKER_ID,
+                    "expired_at": GetJobLeaseExpiredAt(),
+                },
+                "updated_at": now,
+            },
+            "$min": {"started_at": now},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    return job
+
+
+async def SaveJobChunk(db, job: dict, chunk: dict, chunk_seconds: float):
+    update_set = {
+        "checkpoint": chunk.get("checkpoint"),
+        "lease.expired_at": GetJobLeaseExpiredAt(),
+        "updated_at": GetCurrentDateTime(),
+    }
+    update_inc = {
+        "processed": chunk.get("processed", 0),
+        "elapsed_seconds": chunk_seconds,
+    }
+    if "total" in chunk:
+        update_set["total"] = chunk["total"]
+
+    for key, value in chunk.get("result", {}).items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                update_inc[f"result.{key}.{sub_key}"] = sub_value
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            update_inc[f"result.{key}"] = value
+        else:
+            update_set[f"result.{key}"] = value
+
+    if chunk.get("is_done"):
+        update_set["status"] = JobStatusData.COMPLETED.value
+        update_set["finished_at"] = GetCurrentDateTime()
+
+    # only the lease holder may move the checkpoint forward, a lease that
+    # passed mid chunk may already belong to another worker
+    result = await db.jobs.update_one(
+        {
+            "_id": job["_id"],
+            "lease.worker": JOB_WORKER_ID,
+            "lease.expired_at": {"$gt": GetCurrentDateTime()},
+        },
+        {"$set": update_set, "$inc": update_inc},
+    )
+    return result.matched_count > 0
+
+
+async def RenewJobLease(db, job: dict):
+    """
+    Extend the lease of a job while one of its chunks runs. Stops once the
+    lease is no longer ours, SaveJobChunk then refuses the chunk.
+    """
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            result = await db.jobs.update_one(
+                {
+                    "_id": job["_id"],
+                    "lease.worker": JOB_WORKER_ID,
+                    "lease.expired_at": {"$gt": GetCurrentDateTime()},
+                },
+                {"$set": {"lease.expired_at": GetJobLeaseExpiredAt()}},
+            )
+            if result.matched_count == 0:
+                return
+        except Exception as e:
+            print(f"Job lease renewal failed: {str(e)}")
+
+
+async def RunJob(db, id_job: str):
+    job = await ClaimJob(db, id_job)
+    if not job:
+        return
+
+    handler = JOB_HANDLERS.get(job.get("type"))
+    try:
+        if not handler:
+            raise ValueError(f"Job handler {job.get('type')} is not registered")
+
+        while True:
+            chunk_start = time.perf_counter()
+            lease_task = asyncio.create_task(RenewJobLease(db, job))
+            try:
+                chunk = await handler(db, job)
+            finally:
+                lease_task.cancel()
+                await asyncio.gather(lease_task, return_exceptions=True)
+            chunk_seconds = time.perf_counter() - chunk_start
+            is_saved = await SaveJobChunk(db, job, chunk, chunk_seconds)
+            if not is_saved or chunk.get("is_done"):
+                break
+
+            job["checkpoint"] = chunk.get("checkpoint")
+            if "total" in chunk:
+                job["total"] = chunk["total"]
+    except asyncio.CancelledError:
+        # leave the job RUNNING, it is resumed once the lease expires
+        raise
+    except Exception as e:
+        print(str(e))
+        await db.jobs.update_one(
+            {"_id": job["_id"], "lease.worker": JOB_WORKER_ID},
+            {
+                "$set": {
+                    "status": JobStatusData.FAILED.value,
+                    "error": str(e),
+                    "updated_at": GetCurrentDateTime(),
+                    "finished_at": GetCurrentDateTime(),
+                }
+            },
+        )
+
+
+async def ResumeJobs(db):
+    job_data = await GetAggregateData(
+        db.jobs,
+        [
+            {
+                "$match": {
+                    "status": {
+                        "$in": [
+                            JobStatusData.PENDING.value,
+                            JobStatusData.RUNNING.value,
+                        ]
+                    },
+                    "$or": [
+                        {"lease": {"$exists": False}},
+                        {"lease.expired_at": {"$lt": GetCurrentDateTime()}},
+                    ],
+                }
+            },
+            {"$sort": {"created_at": 1}},
+        ],
+        {"_id": 1},
+    )
+    for job in job_data:
+        StartJobTask(db, job["_id"])
+
+    return len(job_data)
+
+
+async def GetJobDetail(db, id_job: str):
+    job = await GetOneData(db.jobs, {"_id": ObjectId(id_job)})
+    if job:
+        job.pop("params", None)
+        job.pop("lease", None)
+        job.update(GetJobProgress(job))
+
+    return job
+
+
+async def JobWorkerLoop():
+    db = await GetAmretaDatabase()
+    while True:
+        try:
+            await ResumeJobs(db)
+        except Exception as e:
+            print(str(e))
+
+        await asyncio.sleep(JOB_LEASE_SECONDS)
+
+
+async def StartJobWorker():
+    JOB_WORKER["task"] = asyncio.create_task(JobWorkerLoop())
+
+
+async def StopJobWorker():
+    tasks = list(JOB_TASKS.values())
+    if JOB_WORKER["task"]:
+        tasks.append(JOB_WORKER["task"])
+
+    for task in tasks:
+        task.cancel()
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    # hand the unfinished jobs over to the next worker right away
+    db = await GetAmretaDatabase()
+    await db.jobs.update_many(
+        {
+            "status": JobStatusData.RUNNING.value,
+            "lease.worker": JOB_WORKER_ID,
+        },
+        {"$set": {"lease.expired_at": GetCurrentDateTime()}},
+    )
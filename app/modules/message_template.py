@@ -0,0 +1,116 @@
+from datetime import datetime
+import re
+import time
+from app.modules.crud_operations import GetAggregateData
+from app.modules.generals import DateIDFormatter
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# other workers pick up template changes after this many seconds
+MESSAGE_TEMPLATE_CACHE_SECONDS = int(os.getenv("MESSAGE_TEMPLATE_CACHE_SECONDS", 60))
+TEMPLATE_FIELD_PATTERN = re.compile(r"\[[a-z_]+\]")
+
+# WHATSAPP_BOT and WHATSAPP_MESSAGE_TEMPLATE documents with the templates
+# compiled from them, dropped by InvalidateWhatsappTemplateCache
+WHATSAPP_TEMPLATE_CACHE = {
+    "loaded_at": None,
+    "bot": None,
+    "config": None,
+    "templates": {},
+}
+
+
+def CompileMessageTemplate(template: str):
+    """
+    Turn a template into a format string with one positional slot per
+    [field] placeholder, so every render is a single str.format call.
+    """
+    template = template or ""
+    format_parts = []
+    field_names = []
+    last_index = 0
+    for match in TEMPLATE_FIELD_PATTERN.finditer(template):
+        literal = template[last_index : match.start()]
+        format_parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        format_parts.append(f"{{{len(field_names)}}}")
+        field_names.append(match.group(0))
+        last_index = match.end()
+
+    literal = template[last_index:]
+    format_parts.append(literal.replace("{", "{{").replace("}", "}}"))
+    return "".join(format_parts), tuple(field_names)
+
+
+def FormatTemplateValue(value):
+    if isinstance(value, str):
+        return value
+
+    if isinstance(value, datetime):
+        return DateIDFormatter(value)
+
+    try:
+        return str(value)
+    except Exception:
+        return "-"
+
+
+def RenderMessageTemplate(compiled_template: tuple, fields_to_replace: dict):
+    format_string, field_names = compiled_template
+    # unknown placeholders are kept as they are written in the template
+    return format_string.format(
+        *[
+            (
+                FormatTemplateValue(fields_to_replace[name])
+                if name in fields_to_replace
+                else name
+            )
+            for name in field_names
+        ]
+    )
+
+
+async def GetWhatsappTemplateConfig(db):
+    cache = WHATSAPP_TEMPLATE_CACHE
+    if (
+        cache["loaded_at"] is None
+        or time.monotonic() - cache["loaded_at"] > MESSAGE_TEMPLATE_CACHE_SECONDS
+    ):
+        config_data = await GetAggregateData(
+            db.configurations,
+            [
+                {
+                    "$match": {
+                        "type": {"$in": ["WHATSAPP_BOT", "WHATSAPP_MESSAGE_TEMPLATE"]}
+                    }
+                }
+            ],
+        )
+        configs = {item["type"]: item for item in config_data}
+        cache.update(
+            {
+                "loaded_at": time.monotonic(),
+                "bot": configs.get("WHATSAPP_BOT"),
+                "config": configs.get("WHATSAPP_MESSAGE_TEMPLATE"),
+                "templates": {},
+            }
+        )
+
+    return cache
+
+
+def GetWhatsappTemplate(template_config: dict, name: str):
+    templates = template_config["templates"]
+    if name not in templates:
+        templates[name] = CompileMessageTemplate(
+            (template_config["config"] or {}).get(name, "")
+        )
+
+    return templates[name]
+
+
+def InvalidateWhatsappTemplateCache():
+    WHATSAPP_TEMPLATE_CACHE.update(
+        {"loaded_at": None, "bot": None, "config": None, "templates": {}}
+    )
@@ -1,10 +1,25 @@
+import asyncio
+import time
 from bson import ObjectId
 from app.modules.generals import GetCurrentDateTime
 from app.modules.crud_operations import CreateOneData, GetAggregateData, GetOneData
 from app.models.notifications import NotificationTypeData
 from app.models.users import UserRole
-from librouteros import connect
+from app.modules.mikrotik_mirror import RequestMikrotikMirrorSync
+from app.modules.mikrotik_pool import RunMikrotikCommand
+from librouteros.exceptions import LibRouterosError
 from librouteros.query import Key
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# errors of an unreachable router or a rejected RouterOS command
+MIKROTIK_ERRORS = (LibRouterosError, OSError)
+# active sessions are kicked in batches so customers do not all reconnect
+# to the router at the same moment
+MIKROTIK_KICK_BATCH_SIZE = int(os.getenv("MIKROTIK_KICK_BATCH_SIZE", 50))
+MIKROTIK_KICK_DELAY_SECONDS = float(os.getenv("MIKROTIK_KICK_DELAY_SECONDS", 2))
 
 
 async def GetMikrotikRouterDataByName(db, router_name: str):
@@ -37,11 +52,6 @@ async def GetMikrotikRouterDataByID(db, id_router: str):
     return host, username, password, port
 
 
-def MikrotikConnection(host: str, username: str, password: str, port: int):
-    connection = connect(username=username, password=password, host=host, port=port)
-    return connection
-
-
 async def CreateMikrotikErrorNotification(db, description: str):
     notification_data = {
         "title": "Mikrotik Message Error",
@@ -58,6 +68,15 @@ async def CreateMikrotikErrorNotification(db, description: str):
         await CreateOneData(db.notifications, notification_data.copy())
 
 
+def RemoveMikrotikPPPActive(mikrotik, pppoe_username: str):
+    name = Key("name")
+    active_data = list(
+        mikrotik.path("/ppp/active").select().where(name == pppoe_username)
+    )
+    if len(active_data) > 0:
+        mikrotik.path("/ppp/active").remove(active_data[0].get(".id"))
+
+
 async def ActivateMikrotikPPPSecret(db, customer_data, disabled: bool = False):
     try:
         pppoe_username = customer_data.get("pppoe_username", None)
@@ -69,65 +88,62 @@ async def ActivateMikrotikPPPSecret(db, customer_data, disabled: bool = False):
         if not host:
             return False
 
-        secret_data = []
-        secret_id = None
-        mikrotik = MikrotikConnection(host, username, password, port)
-        name = Key("name")
-        for row in mikrotik.path("/ppp/secret").select().where(name == pppoe_username):
-            secret_data.append(row)
-
-        # get specified secret
-        secret_id = None
-        if len(secret_data) > 0:
-            secret_id = secret_data[0].get(".id", None)
-
-        if secret_id:
-            # update exist secret
-            update_data = {
-                ".id": secret_id,
-                "disabled": disabled,
-            }
-            if pppoe_username:
-                update_data["name"] = pppoe_username
-            if pppoe_password:
-                update_data["password"] = pppoe_password
-
-            mikrotik.path("/ppp/secret").update(**update_data)
-        else:
-            # create new secret data
+        package_data = None
+        if customer_data.get("id_package", None):
             package_data = await GetOneData(
-                db.packages, {"_id": ObjectId(customer_data.get("id_package", None))}
+                db.packages,
+                {"_id": ObjectId(customer_data["id_package"])},
+                {"router_profile": 1},
             )
 
-            if not package_data:
-                return False
+        def command(mikrotik):
+            name = Key("name")
+            secret_data = list(
+                mikrotik.path("/ppp/secret").select().where(name == pppoe_username)
+            )
 
-            insert_data = {
-                "name": str(pppoe_username),
-                "password": str(pppoe_password),
-                "service": "ppp",
-                "profile": package_data.get("router_profile", "default"),
-                "disabled": disabled,
-                "comment": customer_data.get("name", "Undefined"),
-            }
-            mikrotik.path("/ppp/secret").add(**insert_data)
+            # get specified secret
+            secret_id = None
+            if len(secret_data) > 0:
+                secret_id = secret_data[0].get(".id", None)
 
-        if disabled:
-            active_data = []
-            for row in (
-                mikrotik.path("/ppp/active").select().where(name == pppoe_username)
-            ):
-                active_data.append(row)
+            if secret_id:
+                # update exist secret
+                update_data = {
+                    ".id": secret_id,
+                    "disabled": disabled,
+                }
+                if pppoe_username:
+                    update_data["name"] = pppoe_username
+                if pppoe_password:
+                    update_data["password"] = pppoe_password
 
-            if len(active_data) > 0:
-                active_id = active_data[0].get(".id")
-                mikrotik.path("/ppp/active").remove(active_id)
+                mikrotik.path("/ppp/secret").update(**update_data)
+            else:
+                # create new secret data
+                if not package_data:
+                    return False
+
+                insert_data = {
+                    "name": str(pppoe_username),
+                    "password": str(pppoe_password),
+                    "service": "ppp",
+                    "profile": package_data.get("router_profile", "default"),
+                    "disabled": disabled,
+                    "comment": customer_data.get("name", "Undefined"),
+                }
+                mikrotik.path("/ppp/secret").add(**insert_data)
+
+            if disabled:
+                RemoveMikrotikPPPActive(mikrotik, pppoe_username)
+
+            return True
+
+        return await RunMikrotikCommand(host, username, password, port, command)
     except Exception as e:
         await CreateMikrotikErrorNotification(db, str(e))
         return False
 
-    return True
-
 
 async def DeleteMikrotikPPPSecret(db, customer_data):
     try:
@@ -139,29 +155,373 @@ async def DeleteMikrotikPPPSecret(db, customer_data):
         if not host:
             return False
 
-        secret_data = []
-        secret_id = None
-        mikrotik = MikrotikConnection(host, username, password, port)
-        name = Key("name")
-        for row in mikrotik.path("/ppp/secret").select().where(name == pppoe_username):
-            secret_data.append(row)
-
-        if len(secret_data) > 0:
-            # remove ppp secret
-            secret_id = secret_data[0].get(".id", None)
-            mikrotik.path("/ppp/secret").remove(secret_id)
-
-            # remove ppp active
-            active_data = []
-            for row in (
-                mikrotik.path("/ppp/active").select().where(name == pppoe_username)
-            ):
-                active_data.append(row)
-
-            if len(active_data) > 0:
-                active_id = active_data[0].get(".id")
-                mikrotik.path("/ppp/active").remove(active_id)
+        def command(mikrotik):
+            name = Key("name")
+            secret_data = list(
+                mikrotik.path("/ppp/secret").select().where(name == pppoe_username)
+            )
+            if len(secret_data) > 0:
+                # remove ppp secret
+                secret_id = secret_data[0].get(".id", None)
+                mikrotik.path("/ppp/secret").remove(secret_id)
+
+                # remove ppp active
+                RemoveMikrotikPPPActive(mikrotik, pppoe_username)
+
+        await RunMikrotikCommand(host, username, password, port, command)
         return True
     except Exception as e:
         await CreateMikrotikErrorNotification(db, str(e))
         return False
+
+
+def ApplyMikrotikPPPSecrets(mikrotik, customers: list, disabled: bool):
+    """
+    Read /ppp/secret (and /ppp/active when disabling) once, work out which
+    secrets must be created, updated, enabled or disabled and apply them.
+    A rejected secret only fails its own customer. Runs in the RouterOS
+    thread pool, customers carry a "router_profile".
+    """
+    summary = {"created": 0, "updated": 0, "active_removed": 0, "failed": []}
+    secrets = {
+        str(row.get("name")): row
+        for row in mikrotik.path("/ppp/secret").select(
+            Key(".id"), Key("name"), Key("password"), Key("disabled")
+        )
+    }
+    active_ids = {}
+    if disabled:
+        active_ids = {
+            str(row.get("name")): row.get(".id")
+            for row in mikrotik.path("/ppp/active").select(Key(".id"), Key("name"))
+        }
+
+    def failed(customer: dict, error):
+        summary["failed"].append(
+            {
+                "id_customer": customer.get("_id"),
+                "pppoe_username": customer.get("pppoe_username"),
+                "error": str(error),
+            }
+        )
+
+    # secrets that only need their disabled flag flipped are set in one call
+    toggle_ids = []
+    applied_usernames = set()
+    for customer in customers:
+        pppoe_username = str(customer.get("pppoe_username"))
+        pppoe_password = customer.get("pppoe_password", None)
+        if pppoe_username in applied_usernames:
+            continue
+
+        applied_usernames.add(pppoe_username)
+        secret = secrets.get(pppoe_username)
+        try:
+            if not secret:
+                if not customer.get("router_profile"):
+                    raise ValueError("Data Paket Tidak Ditemukan!")
+
+                mikrotik.path("/ppp/secret").add(
+                    name=pppoe_username,
+                    password=str(pppoe_password),
+                    service="ppp",
+                    profile=customer["router_profile"],
+                    disabled=disabled,
+                    comment=customer.get("name", "Undefined"),
+                )
+                summary["created"] += 1
+            elif pppoe_password and str(secret.get("password")) != str(pppoe_password):
+                mikrotik.path("/ppp/secret").update(
+                    **{
+                        ".id": secret[".id"],
+                        "password": pppoe_password,
+                        "disabled": disabled,
+                    }
+                )
+                summary["updated"] += 1
+            elif secret.get("disabled") != disabled:
+                toggle_ids.append((customer, secret[".id"]))
+        except Exception as e:
+            failed(customer, e)
+
+    if toggle_ids:
+        try:
+            mikrotik.path("/ppp/secret").update(
+                **{
+                    ".id": ",".join(secret_id for _, secret_id in toggle_ids),
+                    "disabled": disabled,
+                }
+            )
+            summary["updated"] += len(toggle_ids)
+        except LibRouterosError:
+            # a secret of the batch is gone since the print, retry them one
+            # by one so only that customer fails
+            for customer, secret_id in toggle_ids:
+                try:
+                    mikrotik.path("/ppp/secret").update(
+                        **{".id": secret_id, "disabled": disabled}
+                    )
+                    summary["updated"] += 1
+                except LibRouterosError as e:
+                    failed(customer, e)
+
+    if disabled:
+        remove_ids = [
+            active_ids[pppoe_username]
+            for pppoe_username in applied_usernames
+            if pppoe_username in active_ids
+        ]
+        if remove_ids:
+            summary["active_removed"] += RemoveMikrotikPPPActiveIds(
+                mikrotik, remove_ids
+            )
+
+    return summary
+
+
+async def ProvisionMikrotikPPPSecrets(db, customers: list, disabled: bool = False):
+    """
+    Batch version of ActivateMikrotikPPPSecret: customers are grouped by
+    id_router and every router is provisioned with a single pooled session.
+    Returns the per-router counters, seconds and failed customers.
+    """
+    result = {"routers": {}, "failed": []}
+    router_customers = {}
+    for customer in customers:
+        if not customer.get("id_router"):
+            result["failed"].append(
+                {
+                    "id_customer": customer.get("_id"),
+                    "pppoe_username": customer.get("pppoe_username"),
+                    "error": "Router Tidak Ditemukan!",
+                }
+            )
+            continue
+
+        router_customers.setdefault(str(customer["id_router"]), []).append(customer)
+
+    if len(router_customers) == 0:
+        return result
+
+    router_data = await GetAggregateData(
+        db.router,
+        [
+            {
+                "$match": {
+                    "_id": {"$in": [ObjectId(id) for id in router_customers.keys()]}
+                }
+            }
+        ],
+        {"name": 1, "ip_address": 1, "username": 1, "password": 1, "api_port": 1},
+    )
+    routers = {item["_id"]: item for item in router_data}
+    package_data = await GetAggregateData(
+        db.packages,
+        [
+            {
+                "$match": {
+                    "_id": {
+                        "$in": list(
+                            {
+                                ObjectId(customer["id_package"])
+                                for customer in customers
+                                if customer.get("id_package")
+                            }
+                        )
+                    }
+                }
+            }
+        ],
+        {"router_profile": 1},
+    )
+    router_profiles = {
+        item["_id"]: item.get("router_profile", "default") for item in package_data
+    }
+
+    async def provision(id_router: str, customers: list):
+        router = routers.get(id_router)
+        router_result = {"name": router.get("name") if router else None}
+        start = time.perf_counter()
+        try:
+            if not router or not router.get("ip_address"):
+                raise ValueError("Router Tidak Ditemukan!")
+
+            for customer in customers:
+                customer["router_profile"] = router_profiles.get(
+                    str(customer.get("id_package"))
+                )
+
+            summary = await RunMikrotikCommand(
+                router["ip_address"],
+                router.get("username"),
+                router.get("password"),
+                router.get("api_port"),
+                lambda mikrotik: ApplyMikrotikPPPSecrets(mikrotik, customers, disabled),
+            )
+            router_result.update(summary)
+        except Exception as e:
+            router_result["error"] = str(e)
+            router_result["failed"] = [
+                {
+                    "id_customer": customer.get("_id"),
+                    "pppoe_username": customer.get("pppoe_username"),
+                    "error": str(e),
+                }
+                for customer in customers
+            ]
+            await CreateMikrotikErrorNotification(db, str(e))
+
+        router_result["seconds"] = round(time.perf_counter() - start, 4)
+        result["routers"][id_router] = router_result
+        result["failed"].extend(router_result["failed"])
+
+    await asyncio.gather(
+        *[
+            provision(id_router, customers)
+            for id_router, customers in router_customers.items()
+        ]
+    )
+    return result
+
+
+def ApplyMikrotikPPPProfile(mikrotik, pppoe_usernames: set, router_profile: str):
+    """
+    Move the secrets of pppoe_usernames to router_profile with one multi-id
+    set and return the active session ids of the moved secrets.
+    """
+    update_ids = []
+    updated_usernames = set()
+    found_usernames = set()
+    for row in mikrotik.path("/ppp/secret").select(
+        Key(".id"), Key("name"), Key("profile")
+    ):
+        pppoe_username = str(row.get("name"))
+        if pppoe_username not in pppoe_usernames:
+            continue
+
+        found_usernames.add(pppoe_username)
+        if str(row.get("profile")) != router_profile:
+            update_ids.append(row[".id"])
+            updated_usernames.add(pppoe_username)
+
+    if update_ids:
+        mikrotik.path("/ppp/secret").update(
+            **{".id": ",".join(update_ids), "profile": router_profile}
+        )
+
+    active_ids = []
+    if updated_usernames:
+        active_ids = [
+            row[".id"]
+            for row in mikrotik.path("/ppp/active").select(Key(".id"), Key("name"))
+            if str(row.get("name")) in updated_usernames
+        ]
+
+    return {
+        "updated": len(update_ids),
+        "missing": len(pppoe_usernames - found_usernames),
+        "active_ids": active_ids,
+    }
+
+
+def RemoveMikrotikPPPActiveIds(mikrotik, active_ids: list):
+    try:
+        mikrotik.path("/ppp/active").remove(*active_ids)
+        return len(active_ids)
+    except LibRouterosError:
+        # a session of the batch is already gone, retry them one by one
+        removed = 0
+        for active_id in active_ids:
+            try:
+                mikrotik.path("/ppp/active").remove(active_id)
+                removed += 1
+            except LibRouterosError:
+                pass
+
+        return removed
+
+
+async def PropagateMikrotikPPPProfile(db, customers: list, router_profile: str):
+    """
+    Set router_profile on the secrets of the customers, one pooled session
+    per router, and kick their active sessions in batches of
+    MIKROTIK_KICK_BATCH_SIZE so they reconnect under the new profile.
+    """
+    result = {"routers": {}, "failed": []}
+    router_customers = {}
+    for customer in customers:
+        if customer.get("id_router") and customer.get("pppoe_username"):
+            router_customers.setdefault(str(customer["id_router"]), set()).add(
+                str(customer["pppoe_username"])
+            )
+
+    if len(router_customers) == 0:
+        return result
+
+    router_data = await GetAggregateData(
+        db.router,
+        [
+            {
+                "$match": {
+                    "_id": {"$in": [ObjectId(id) for id in router_customers.keys()]}
+                }
+            }
+        ],
+        {"name": 1, "ip_address": 1, "username": 1, "password": 1, "api_port": 1},
+    )
+    routers = {item["_id"]: item for item in router_data}
+
+    async def propagate(id_router: str, pppoe_usernames: set):
+        router = routers.get(id_router)
+        router_result = {"name": router.get("name") if router else None}
+        start = time.perf_counter()
+        try:
+            if not router or not router.get("ip_address"):
+                raise ValueError("Router Tidak Ditemukan!")
+
+            connection = (
+                router["ip_address"],
+                router.get("username"),
+                router.get("password"),
+                router.get("api_port"),
+            )
+            summary = await RunMikrotikCommand(
+                *connection,
+                lambda mikrotik: ApplyMikrotikPPPProfile(
+                    mikrotik, pppoe_usernames, router_profile
+                ),
+            )
+            active_ids = summary.pop("active_ids")
+            summary["active_removed"] = 0
+            for index in range(0, len(active_ids), MIKROTIK_KICK_BATCH_SIZE):
+                if index > 0:
+                    await asyncio.sleep(MIKROTIK_KICK_DELAY_SECONDS)
+
+                batch = active_ids[index : index + MIKROTIK_KICK_BATCH_SIZE]
+                summary["active_removed"] += await RunMikrotikCommand(
+                    *connection,
+                    lambda mikrotik: RemoveMikrotikPPPActiveIds(mikrotik, batch),
+                )
+
+            router_result.update(summary)
+            await RequestMikrotikMirrorSync(db, router.get("name"))
+        except Exception as e:
+            router_result["error"] = str(e)
+            result["failed"].extend(
+                [
+                    {"pppoe_username": pppoe_username, "error": str(e)}
+                    for pppoe_username in pppoe_usernames
+                ]
+            )
+            await CreateMikrotikErrorNotification(db, str(e))
+
+        router_result["seconds"] = round(time.perf_counter() - start, 4)
+        result["routers"][id_router] = router_result
+
+    await asyncio.gather(
+        *[
+            propagate(id_router, pppoe_usernames)
+            for id_router, pppoe_usernames in router_customers.items()
+        ]
+    )
+    return result
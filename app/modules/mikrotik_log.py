@@ -0,0 +1,206 @@
+import asyncio
+from collections import deque
+import json
+import select
+import socket
+import threading
+import time
+from librouteros import connect
+from app.modules.mikrotik_pool import MIKROTIK_TIMEOUT_SECONDS
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIKROTIK_LOG_BUFFER_SIZE = int(os.getenv("MIKROTIK_LOG_BUFFER_SIZE", 1000))
+MIKROTIK_LOG_QUEUE_SIZE = int(os.getenv("MIKROTIK_LOG_QUEUE_SIZE", 500))
+MIKROTIK_LOG_RETRY_SECONDS = int(os.getenv("MIKROTIK_LOG_RETRY_SECONDS", 5))
+# followers without viewers are kept a little, a page refresh reuses them
+MIKROTIK_LOG_IDLE_SECONDS = int(os.getenv("MIKROTIK_LOG_IDLE_SECONDS", 30))
+MIKROTIK_LOG_HEARTBEAT_SECONDS = int(os.getenv("MIKROTIK_LOG_HEARTBEAT_SECONDS", 15))
+# a quiet router is polled this often, a stopped follower exits within it
+MIKROTIK_LOG_POLL_SECONDS = float(os.getenv("MIKROTIK_LOG_POLL_SECONDS", 1))
+
+# router name -> follower, one upstream /log follow shared by every viewer
+MIKROTIK_LOG_FOLLOWERS = {}
+
+
+def IsMikrotikLogMatch(entry: dict, topics: set, pattern):
+    if topics and not topics & set(str(entry.get("topics", "")).split(",")):
+        return False
+
+    if pattern and not pattern.search(str(entry.get("message", ""))):
+        return False
+
+    return True
+
+
+def PublishMikrotikLog(follower: dict, entry: dict):
+    # runs on the event loop, called from the follow thread
+    follower["sequence"] += 1
+    entry = {"sequence": follower["sequence"], **entry}
+    follower["buffer"].append(entry)
+    for queue in follower["subscribers"]:
+        try:
+            queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            # a slow viewer misses entries, it can resume from the buffer
+            # with Last-Event-ID
+            pass
+
+
+def FollowMikrotikLog(follower: dict, loop, host, username, password, port):
+    """
+    Read /log/print follow=yes on a dedicated connection. The pooled
+    sessions are never used, a follow keeps the session busy forever.
+    """
+    command = "=follow="
+    while not follower["is_stopped"]:
+        try:
+            mikrotik = connect(
+                username=username,
+                password=password,
+                host=host,
+                port=port,
+                timeout=MIKROTIK_TIMEOUT_SECONDS,
+            )
+            follower["mikrotik"] = mikrotik
+            sock = mikrotik.protocol.transport.sock
+            mikrotik.protocol.writeSentence("/log/print", command)
+            # after a reconnect the router buffer is not replayed again
+            command = "=follow-only="
+            while not follower["is_stopped"]:
+                # wait for the next sentence in short polls, a timeout in the
+                # middle of a sentence would lose the rest of the stream
+                is_readable, _, _ = select.select(
+                    [sock], [], [], MIKROTIK_LOG_POLL_SECONDS
+                )
+                if not is_readable:
+                    continue
+
+                reply_word, words = mikrotik.readSentence()
+                if reply_word == "!re":
+                    loop.call_soon_threadsafe(PublishMikrotikLog, follower, words)
+                elif reply_word in ("!trap", "!done"):
+                    raise ConnectionError(words.get("message", reply_word))
+        except Exception as e:
+            if not follower["is_stopped"]:
+                print(f"{host}: {str(e)}")
+                time.sleep(MIKROTIK_LOG_RETRY_SECONDS)
+        finally:
+            if follower.get("mikrotik"):
+                try:
+                    follower["mikrotik"].close()
+                except Exception:
+                    pass
+                follower["mikrotik"] = None
+
+
+def GetMikrotikLogFollower(router: str, host, username, password, port):
+    follower = MIKROTIK_LOG_FOLLOWERS.get(router)
+    if follower is None:
+        follower = {
+            "buffer": deque(maxlen=MIKROTIK_LOG_BUFFER_SIZE),
+            "subscribers": set(),
+            "sequence": 0,
+            "is_stopped": False,
+            "mikrotik": None,
+            "idle_handle": None,
+        }
+        follower["thread"] = threading.Thread(
+            target=FollowMikrotikLog,
+            args=(follower, asyncio.get_running_loop(), host, username, password, port),
+            name=f"mikrotik-log-{router}",
+            daemon=True,
+        )
+        MIKROTIK_LOG_FOLLOWERS[router] = follower
+        follower["thread"].start()
+
+    if follower["idle_handle"]:
+        follower["idle_handle"].cancel()
+        follower["idle_handle"] = None
+
+    return follower
+
+
+def StopMikrotikLogFollower(router: str):
+    follower = MIKROTIK_LOG_FOLLOWERS.pop(router, None)
+    if follower is None:
+        return
+
+    follower["is_stopped"] = True
+    # shutdown wakes a read blocked in the follow thread, close alone does
+    # not on every platform. An idle thread sees is_stopped on its next poll
+    mikrotik = follower["mikrotik"]
+    if mikrotik:
+        try:
+            mikrotik.protocol.transport.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        try:
+            mikrotik.close()
+        except Exception:
+            pass
+
+
+def StopMikrotikLogFollowerIfIdle(router: str):
+    follower = MIKROTIK_LOG_FOLLOWERS.get(router)
+    if follower and not follower["subscribers"]:
+        StopMikrotikLogFollower(router)
+
+
+async def StreamMikrotikLog(
+    router: str,
+    host,
+    username,
+    password,
+    port,
+    topics: set = None,
+    pattern=None,
+    last_sequence: int = 0,
+    is_disconnected=None,
+):
+    """
+    Yield Server-Sent Events of the router log: the buffered entries after
+    last_sequence first, then every new entry matching topics and pattern.
+    """
+    follower = GetMikrotikLogFollower(router, host, username, password, port)
+    queue = asyncio.Queue(maxsize=MIKROTIK_LOG_QUEUE_SIZE)
+    follower["subscribers"].add(queue)
+    try:
+        for entry in list(follower["buffer"]):
+            if entry["sequence"] > last_sequence and IsMikrotikLogMatch(
+                entry, topics, pattern
+            ):
+                yield CreateMikrotikLogEvent(entry)
+
+        while True:
+            try:
+                entry = await asyncio.wait_for(
+                    queue.get(), timeout=MIKROTIK_LOG_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                if is_disconnected and await is_disconnected():
+                    break
+
+                yield ": heartbeat\n\n"
+                continue
+
+            if IsMikrotikLogMatch(entry, topics, pattern):
+                yield CreateMikrotikLogEvent(entry)
+    finally:
+        follower["subscribers"].discard(queue)
+        if not follower["subscribers"] and router in MIKROTIK_LOG_FOLLOWERS:
+            follower["idle_handle"] = asyncio.get_running_loop().call_later(
+                MIKROTIK_LOG_IDLE_SECONDS, StopMikrotikLogFollowerIfIdle, router
+            )
+
+
+def CreateMikrotikLogEvent(entry: dict):
+    data = json.dumps(entry, default=str)
+    return f"id: {entry['sequence']}\nevent: log\ndata: {data}\n\n"
+
+
+async def StopMikrotikLogFollowers():
+    for router in list(MIKROTIK_LOG_FOLLOWERS):
+        StopMikrotikLogFollower(router)
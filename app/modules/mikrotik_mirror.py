@@ -0,0 +1,368 @@
+import asyncio
+from datetime import timedelta
+import time
+from bson import ObjectId
+from pymongo import ASCENDING, DeleteMany, IndexModel, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+from app.models.mikrotik import MikrotikMirrorStatusData
+from app.modules.crud_operations import GetAggregateData, GetOneData
+from app.modules.database import GetAmretaDatabase
+from app.modules.generals import GetCurrentDateTime
+from app.modules.indexes import EnsureIndexes, RegisterIndexes
+from app.modules.jobs import JOB_WORKER_ID
+from app.modules.mikrotik_pool import RunMikrotikCommand
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIKROTIK_MIRROR_INTERVAL_SECONDS = int(
+    os.getenv("MIKROTIK_MIRROR_INTERVAL_SECONDS", 60)
+)
+MIKROTIK_MIRROR_POLL_SECONDS = int(os.getenv("MIKROTIK_MIRROR_POLL_SECONDS", 5))
+MIKROTIK_MIRROR_LEASE_SECONDS = int(os.getenv("MIKROTIK_MIRROR_LEASE_SECONDS", 300))
+
+# mirrored RouterOS tables, keyed by the name used in the routes
+MIKROTIK_MIRROR_TABLES = {
+    "interface": {
+        "path": "/interface",
+        "collection": "mikrotik_interfaces",
+        # traffic counters change on every print, they would turn every
+        # sync into a full rewrite and are not shown from the mirror
+        "volatile_fields": (
+            "rx-byte",
+            "tx-byte",
+            "rx-packet",
+            "tx-packet",
+            "rx-drop",
+            "tx-drop",
+            "tx-queue-drop",
+            "rx-error",
+            "tx-error",
+            "fp-rx-byte",
+            "fp-tx-byte",
+            "fp-rx-packet",
+            "fp-tx-packet",
+        ),
+        "str_fields": ("name", "comment"),
+    },
+    "profile": {
+        "path": "/ppp/profile",
+        "collection": "mikrotik_profiles",
+        "volatile_fields": (),
+        "str_fields": ("name", "comment"),
+    },
+    "secret": {
+        "path": "/ppp/secret",
+        "collection": "mikrotik_secrets",
+        "volatile_fields": (),
+        "str_fields": ("name", "password", "profile", "comment"),
+    },
+    "active": {
+        "path": "/ppp/active",
+        "collection": "mikrotik_active",
+        "volatile_fields": ("uptime",),
+        "str_fields": ("name", "caller-id", "address"),
+    },
+}
+# fields added by the mirror, ignored when diffing against the router
+MIKROTIK_MIRROR_FIELDS = ("_id", "id_router", "mikrotik_id", "updated_at")
+
+MIKROTIK_MIRROR_WORKER = {"task": None, "router_ids": None}
+
+
+for table in MIKROTIK_MIRROR_TABLES.values():
+    RegisterIndexes(
+        table["collection"],
+        [
+            IndexModel(
+                [("id_router", ASCENDING), ("mikrotik_id", ASCENDING)],
+                name="id_router_mikrotik_id",
+                unique=True,
+            ),
+            IndexModel(
+                [("id_router", ASCENDING), ("name", ASCENDING)],
+                name="id_router_name",
+            ),
+        ],
+    )
+
+
+async def EnsureMikrotikMirrorIndex(db):
+    await EnsureIndexes(
+        db, [table["collection"] for table in MIKROTIK_MIRROR_TABLES.values()]
+    )
+
+
+def FormatMikrotikMirrorRow(row: dict, table: dict):
+    # RouterOS values are typed by librouteros, a numeric name or password
+    # would come back as int
+    mirror_row = {
+        key: value
+        for key, value in row.items()
+        if key != ".id" and key not in table["volatile_fields"]
+    }
+    for key in table["str_fields"]:
+        if key in mirror_row:
+            mirror_row[key] = str(mirror_row[key])
+
+    return mirror_row
+
+
+def FormatMikrotikMirrorData(mirror_data: list):
+    """
+    Turn mirror documents back into RouterOS rows, the frontend keeps
+    using .id for the write endpoints.
+    """
+    return [
+        {
+            ".id": item["mikrotik_id"],
+            **{
+                key: value
+                for key, value in item.items()
+                if key not in MIKROTIK_MIRROR_FIELDS
+            },
+        }
+        for item in mirror_data
+    ]
+
+
+def FetchMikrotikMirrorTables(mikrotik):
+    return {
+        name: list(mikrotik.path(table["path"]).select())
+        for name, table in MIKROTIK_MIRROR_TABLES.items()
+    }
+
+
+async def SyncMikrotikMirrorTable(db, id_router: ObjectId, name: str, rows: list):
+    """
+    Write only the rows that changed since the last sync and drop the rows
+    that are gone from the router.
+    """
+    table = MIKROTIK_MIRROR_TABLES[name]
+    collection = db[table["collection"]]
+    mirror_data = await GetAggregateData(
+        collection, [{"$match": {"id_router": id_router}}], {"_id": 0, "id_router": 0}
+    )
+    mirror_rows = {
+        item["mikrotik_id"]: {
+            key: value
+            for key, value in item.items()
+            if key not in MIKROTIK_MIRROR_FIELDS
+        }
+        for item in mirror_data
+    }
+
+    current_time = GetCurrentDateTime()
+    operations = []
+    mikrotik_ids = set()
+    for row in rows:
+        mikrotik_id = row.get(".id")
+        if not mikrotik_id:
+            continue
+
+        mikrotik_ids.add(mikrotik_id)
+        mirror_row = FormatMikrotikMirrorRow(row, table)
+        if mirror_rows.get(mikrotik_id) == mirror_row:
+            continue
+
+        operations.append(
+            ReplaceOne(
+                {"id_router": id_router, "mikrotik_id": mikrotik_id},
+                {
+                    "id_router": id_router,
+                    "mikrotik_id": mikrotik_id,
+                    **mirror_row,
+                    "updated_at": current_time,
+                },
+                upsert=True,
+            )
+        )
+
+    deleted_ids = [
+        mikrotik_id for mikrotik_id in mirror_rows if mikrotik_id not in mikrotik_ids
+    ]
+    if deleted_ids:
+        operations.append(
+            DeleteMany({"id_router": id_router, "mikrotik_id": {"$in": deleted_ids}})
+        )
+
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+
+    return {
+        "count": len(mikrotik_ids),
+        "changed": len(operations) - (1 if deleted_ids else 0),
+        "deleted": len(deleted_ids),
+    }
+
+
+async def ClaimMikrotikMirrorSync(db, router: dict):
+    current_time = GetCurrentDateTime()
+    id_router = ObjectId(router["_id"])
+    claim_data = {
+        "name": router.get("name"),
+        "status": MikrotikMirrorStatusData.SYNCING.value,
+        "locked_by": JOB_WORKER_ID,
+        # a crashed worker only holds the router until the lease runs out
+        "next_sync_at": current_time + timedelta(seconds=MIKROTIK_MIRROR_LEASE_SECONDS),
+    }
+    result = await db.mikrotik_mirror_sync.update_one(
+        {"_id": id_router, "next_sync_at": {"$lte": current_time}},
+        {"$set": claim_data},
+    )
+    if result.modified_count == 1:
+        return True
+
+    try:
+        await db.mikrotik_mirror_sync.insert_one({"_id": id_router, **claim_data})
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def SyncMikrotikMirror(db, router: dict):
+    id_router = ObjectId(router["_id"])
+    start = time.perf_counter()
+    sync_data = {}
+    try:
+        tables = await RunMikrotikCommand(
+            router.get("ip_address"),
+            router.get("username"),
+            router.get("password"),
+            router.get("api_port"),
+            FetchMikrotikMirrorTables,
+            is_retry=True,
+        )
+        changes = {}
+        for name, rows in tables.items():
+            changes[name] = await SyncMikrotikMirrorTable(db, id_router, name, rows)
+
+        sync_data = {
+            "status": MikrotikMirrorStatusData.SYNCED.value,
+            "synced_at": GetCurrentDateTime(),
+            "changes": changes,
+            "error": None,
+        }
+    except Exception as e:
+        # the mirror keeps the last synced rows, synced_at tells how old
+        sync_data = {"status": MikrotikMirrorStatusData.FAILED.value, "error": str(e)}
+
+    sync_data["seconds"] = round(time.perf_counter() - start, 4)
+    sync_data["next_sync_at"] = GetCurrentDateTime() + timedelta(
+        seconds=MIKROTIK_MIRROR_INTERVAL_SECONDS
+    )
+    await db.mikrotik_mirror_sync.update_one(
+        {"_id": id_router}, {"$set": sync_data, "$unset": {"locked_by": ""}}
+    )
+    return sync_data
+
+
+async def DeleteMikrotikMirrorRouters(db, router_ids: list):
+    # mirror rows of routers removed from db.router
+    query = {"id_router": {"$nin": router_ids}}
+    for table in MIKROTIK_MIRROR_TABLES.values():
+        await db[table["collection"]].delete_many(query)
+
+    await db.mikrotik_mirror_sync.delete_many({"_id": {"$nin": router_ids}})
+
+
+async def SyncMikrotikMirrors(db):
+    router_data = await GetAggregateData(
+        db.router,
+        [],
+        {"name": 1, "ip_address": 1, "username": 1, "password": 1, "api_port": 1},
+    )
+    router_ids = [ObjectId(router["_id"]) for router in router_data]
+    if set(router_ids) != MIKROTIK_MIRROR_WORKER["router_ids"]:
+        await DeleteMikrotikMirrorRouters(db, router_ids)
+        MIKROTIK_MIRROR_WORKER["router_ids"] = set(router_ids)
+
+    claimed_routers = [
+        router for router in router_data if await ClaimMikrotikMirrorSync(db, router)
+    ]
+    await asyncio.gather(
+        *[SyncMikrotikMirror(db, router) for router in claimed_routers]
+    )
+    return len(claimed_routers)
+
+
+async def MikrotikMirrorWorkerLoop():
+    db = await GetAmretaDatabase()
+    await EnsureMikrotikMirrorIndex(db)
+    while True:
+        try:
+            await SyncMikrotikMirrors(db)
+        except Exception as e:
+            print(str(e))
+
+        await asyncio.sleep(MIKROTIK_MIRROR_POLL_SECONDS)
+
+
+async def StartMikrotikMirrorWorker():
+    MIKROTIK_MIRROR_WORKER["task"] = asyncio.create_task(MikrotikMirrorWorkerLoop())
+
+
+async def StopMikrotikMirrorWorker():
+    task = MIKROTIK_MIRROR_WORKER["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def RequestMikrotikMirrorSync(db, router_name: str):
+    """
+    Let the worker sync the router on its next poll, used after writes so
+    the mirror does not wait for the full interval.
+    """
+    router_data = await GetOneData(db.router, {"name": router_name}, {"_id": 1})
+    if not router_data:
+        return
+
+    await db.mikrotik_mirror_sync.update_one(
+        {"_id": ObjectId(router_data["_id"]), "locked_by": {"$exists": False}},
+        {"$set": {"next_sync_at": GetCurrentDateTime()}},
+    )
+
+
+async def GetMikrotikMirrorRouter(db, router_name: str):
+    """
+    Return (id_router, mirror_info) for a router name, mirror_info tells
+    when the mirror was last synced and why the last sync failed, if so.
+    """
+    router_data = await GetOneData(db.router, {"name": router_name}, {"_id": 1})
+    if not router_data:
+        return None, None
+
+    sync_data = await GetOneData(
+        db.mikrotik_mirror_sync, {"_id": ObjectId(router_data["_id"])}
+    )
+    sync_data = sync_data or {}
+    mirror_info = {
+        "synced_at": sync_data.get("synced_at"),
+        "status": sync_data.get("status"),
+        "error": sync_data.get("error"),
+    }
+    return ObjectId(router_data["_id"]), mirror_info
+
+
+async def GetMikrotikMirrorData(
+    db,
+    name: str,
+    id_router: ObjectId,
+    query: dict = {},
+    pagination: dict = {},
+    sort_by: str = "name",
+):
+    collection = db[MIKROTIK_MIRROR_TABLES[name]["collection"]]
+    pipeline = [{"$match": {"id_router": id_router, **query}}, {"$sort": {sort_by: 1}}]
+    if pagination:
+        pipeline.append({"$skip": (pagination["page"] - 1) * pagination["items"]})
+        pipeline.append({"$limit": pagination["items"]})
+
+    mirror_data = await GetAggregateData(collection, pipeline)
+    count = len(mirror_data)
+    if pagination:
+        count = await collection.count_documents({"id_router": id_router, **query})
+
+    return FormatMikrotikMirrorData(mirror_data), count
@@ -0,0 +1,182 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from librouteros import connect
+from librouteros.exceptions import MultiTrapError, TrapError
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIKROTIK_POOL_SIZE = int(os.getenv("MIKROTIK_POOL_SIZE", 2))
+MIKROTIK_MAX_WORKERS = int(os.getenv("MIKROTIK_MAX_WORKERS", 8))
+MIKROTIK_TIMEOUT_SECONDS = int(os.getenv("MIKROTIK_TIMEOUT_SECONDS", 10))
+# idle sessions are pinged before reuse, routers drop dead peers silently
+MIKROTIK_IDLE_SECONDS = int(os.getenv("MIKROTIK_IDLE_SECONDS", 60))
+
+# blocking RouterOS socket I/O never runs on the event loop
+MIKROTIK_EXECUTOR = {"executor": None}
+# (host, port, username, password) -> {"semaphore", "sessions"}
+MIKROTIK_POOLS = {}
+
+
+def GetMikrotikExecutor():
+    if MIKROTIK_EXECUTOR["executor"] is None:
+        MIKROTIK_EXECUTOR["executor"] = ThreadPoolExecutor(
+            max_workers=MIKROTIK_MAX_WORKERS, thread_name_prefix="mikrotik"
+        )
+
+    return MIKROTIK_EXECUTOR["executor"]
+
+
+def GetMikrotikPool(host: str, username: str, password: str, port: int):
+    pool_key = (host, port, username, password)
+    pool = MIKROTIK_POOLS.get(pool_key)
+    if pool is None:
+        # the semaphore bounds the calls in flight per router, so a slow
+        # router only queues its own callers
+        pool = {
+            "semaphore": asyncio.Semaphore(MIKROTIK_POOL_SIZE),
+            "sessions": [],
+        }
+        MIKROTIK_POOLS[pool_key] = pool
+
+    return pool
+
+
+def CloseMikrotikSession(session: dict):
+    try:
+        session["api"].close()
+    except Exception:
+        pass
+
+
+def IsMikrotikSessionAlive(session: dict, is_checked: bool = False):
+    if (
+        not is_checked
+        and time.monotonic() - session["last_used"] < MIKROTIK_IDLE_SECONDS
+    ):
+        return True
+
+    try:
+        tuple(session["api"]("/system/identity/print"))
+        return True
+    except Exception:
+        return False
+
+
+def ConnectMikrotikSession(host: str, username: str, password: str, port: int):
+    return {
+        "api": connect(
+            username=username,
+            password=password,
+            host=host,
+            port=port,
+            timeout=MIKROTIK_TIMEOUT_SECONDS,
+        ),
+        "last_used": time.monotonic(),
+    }
+
+
+def ExecuteMikrotikCommand(
+    session: dict,
+    host: str,
+    username: str,
+    password: str,
+    port: int,
+    command,
+    is_retry: bool = False,
+):
+    """
+    Run command(api) on the pooled session. Runs inside the RouterOS thread
+    pool and returns (session, result, error) so the caller can return the
+    session. A dead pooled session is replaced before the command is
+    written. A connection lost while the command runs is only retried on a
+    new session with is_retry, a write (add, remove, reboot) may already
+    have been applied by the router.
+    """
+    # without a retry a reused session is always checked first, the ping
+    # is the only safe moment to find out it is dead
+    if session and not IsMikrotikSessionAlive(session, not is_retry):
+        CloseMikrotikSession(session)
+        session = None
+
+    error = ConnectionError("Mikrotik session is not available")
+    for _ in range(2 if is_retry else 1):
+        if session is None:
+            try:
+                session = ConnectMikrotikSession(host, username, password, port)
+            except Exception as e:
+                # a refused login is a trap too, returned as the router sent it
+                return None, None, e
+
+        try:
+            result = command(session["api"])
+            session["last_used"] = time.monotonic()
+            return session, result, None
+        except (TrapError, MultiTrapError) as e:
+            # the router rejected the command, the session itself is fine
+            session["last_used"] = time.monotonic()
+            return session, None, e
+        except Exception as e:
+            CloseMikrotikSession(session)
+            session = None
+            error = e
+
+    return None, None, error
+
+
+async def RunMikrotikCommand(
+    host: str, username: str, password: str, port: int, command, is_retry=False
+):
+    """
+    Run command(api) against a router on a pooled, authenticated session.
+    The command runs in a worker thread and must consume every RouterOS
+    response it needs (e.g. list(api.path("/ppp/secret").select())). Set
+    is_retry only for read-only commands, they are run again on a new
+    session when the connection drops midway.
+    """
+    pool = GetMikrotikPool(host, username, password, port)
+    async with pool["semaphore"]:
+        session = pool["sessions"].pop() if pool["sessions"] else None
+        session, result, error = await asyncio.get_running_loop().run_in_executor(
+            GetMikrotikExecutor(),
+            ExecuteMikrotikCommand,
+            session,
+            host,
+            username,
+            password,
+            port,
+            command,
+            is_retry,
+        )
+        if session:
+            pool["sessions"].append(session)
+
+    if error:
+        raise error
+
+    return result
+
+
+async def CloseMikrotikPools():
+    sessions = []
+    for pool in MIKROTIK_POOLS.values():
+        sessions.extend(pool["sessions"])
+        pool["sessions"] = []
+
+    MIKROTIK_POOLS.clear()
+    executor = MIKROTIK_EXECUTOR["executor"]
+    if executor is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(
+        *[
+            loop.run_in_executor(executor, CloseMikrotikSession, session)
+            for session in sessions
+        ],
+        return_exceptions=True,
+    )
+    executor.shutdown(wait=False, cancel_futures=True)
+    MIKROTIK_EXECUTOR["executor"] = None
@@ -0,0 +1,309 @@
+import asyncio
+import time
+from bson import ObjectId
+from app.models.customers import CustomerStatusData
+from app.modules.crud_operations import GetAggregateData
+from app.modules.mikrotik import MIKROTIK_ERRORS
+from app.modules.mikrotik_mirror import RequestMikrotikMirrorSync
+from app.modules.mikrotik_pool import RunMikrotikCommand
+from librouteros.query import Key
+
+ReconcileCustomerProjections = {
+    "name": 1,
+    "status": 1,
+    "pppoe_username": 1,
+    "pppoe_password": 1,
+    "id_router": 1,
+    "id_package": 1,
+}
+RECONCILE_DIFF_TYPES = [
+    "missing",
+    "extra",
+    "wrong_profile",
+    "wrong_disabled",
+    "wrong_password",
+]
+
+
+def GetCustomerSecretDisabled(customer: dict):
+    """
+    Expected disabled flag of the customer secret, None when the customer
+    must not have a secret at all (same rules as the customer routes).
+    """
+    status = customer.get("status")
+    if status == CustomerStatusData.NONACTIVE.value:
+        return None
+
+    return status not in [
+        CustomerStatusData.ACTIVE.value,
+        CustomerStatusData.FREE.value,
+    ]
+
+
+def DiffMikrotikPPPSecrets(secrets: list, customers: list, router_profiles: dict):
+    """
+    Compare the router secret table with the customers of that router by
+    pppoe_username. Both sides are indexed once, so the diff is linear in
+    the number of secrets and customers.
+    """
+    diff = {diff_type: [] for diff_type in RECONCILE_DIFF_TYPES}
+    secret_map = {str(row.get("name")): row for row in secrets}
+    customer_map = {}
+    for customer in customers:
+        if customer.get("pppoe_username"):
+            customer_map[str(customer["pppoe_username"])] = customer
+
+    for pppoe_username, customer in customer_map.items():
+        secret = secret_map.get(pppoe_username)
+        disabled = GetCustomerSecretDisabled(customer)
+        router_profile = router_profiles.get(str(customer.get("id_package")))
+        item = {"id_customer": customer["_id"], "name": pppoe_username}
+        if disabled is None:
+            if secret:
+                diff["extra"].append({**item, ".id": secret[".id"]})
+            continue
+
+        if not secret:
+            diff["missing"].append(
+                {
+                    **item,
+                    "password": str(customer.get("pppoe_password")),
+                    "profile": router_profile,
+                    "disabled": disabled,
+                    "comment": customer.get("name", "Undefined"),
+                }
+            )
+            continue
+
+        item[".id"] = secret[".id"]
+        if router_profile and secret.get("profile") != router_profile:
+            diff["wrong_profile"].append(
+                {**item, "profile": router_profile, "actual": secret.get("profile")}
+            )
+        if secret.get("disabled", False) != disabled:
+            diff["wrong_disabled"].append({**item, "disabled": disabled})
+        if customer.get("pppoe_password") and str(secret.get("password")) != str(
+            customer["pppoe_password"]
+        ):
+            diff["wrong_password"].append(
+                {**item, "password": str(customer["pppoe_password"])}
+            )
+
+    for pppoe_username, secret in secret_map.items():
+        if pppoe_username not in customer_map:
+            diff["extra"].append(
+                {"id_customer": None, "name": pppoe_username, ".id": secret[".id"]}
+            )
+
+    return diff
+
+
+def ApplySecretIds(apply, items: list, failed: list):
+    """
+    Run apply(ids) for all the items with one multi-id command. When the
+    router rejects it, every item is applied alone, so one bad secret only
+    fails itself and lands in failed. Returns the number of applied items.
+    """
+    try:
+        apply([item[".id"] for item in items])
+        return len(items)
+    except MIKROTIK_ERRORS as e:
+        if len(items) == 1:
+            failed.append({"name": items[0]["name"], "error": str(e)})
+            return 0
+
+    applied = 0
+    for item in items:
+        try:
+            apply([item[".id"]])
+            applied += 1
+        except MIKROTIK_ERRORS as e:
+            failed.append({"name": item["name"], "error": str(e)})
+
+    return applied
+
+
+def ApplyMikrotikSecretDiff(mikrotik, diff: dict, is_remove_extra: bool):
+    """
+    Apply a diff in bulk: secrets sharing the same target profile or
+    disabled flag are changed with one multi-id set command. A rejected
+    item is reported in failed and the remaining items are still applied.
+    """
+    applied = {diff_type: 0 for diff_type in RECONCILE_DIFF_TYPES}
+    failed = []
+    secret_path = mikrotik.path("/ppp/secret")
+    for item in diff["missing"]:
+        if not item.get("profile"):
+            failed.append({**item, "error": "Data Paket Tidak Ditemukan!"})
+            continue
+
+        try:
+            secret_path.add(
+                name=item["name"],
+                password=item["password"],
+                service="ppp",
+                profile=item["profile"],
+                disabled=item["disabled"],
+                comment=item["comment"],
+            )
+            applied["missing"] += 1
+        except MIKROTIK_ERRORS as e:
+            failed.append({"name": item["name"], "error": str(e)})
+
+    for diff_type, field in [
+        ("wrong_profile", "profile"),
+        ("wrong_disabled", "disabled"),
+    ]:
+        groups = {}
+        for item in diff[diff_type]:
+            groups.setdefault(item[field], []).append(item)
+
+        for value, items in groups.items():
+            applied[diff_type] += ApplySecretIds(
+                lambda ids: secret_path.update(**{".id": ",".join(ids), field: value}),
+                items,
+                failed,
+            )
+
+    for item in diff["wrong_password"]:
+        try:
+            secret_path.update(**{".id": item[".id"], "password": item["password"]})
+            applied["wrong_password"] += 1
+        except MIKROTIK_ERRORS as e:
+            failed.append({"name": item["name"], "error": str(e)})
+
+    # secrets of nonactive customers are always removed, unknown ones only
+    # when asked, routers may hold secrets that are not customers
+    remove_items = [
+        item for item in diff["extra"] if is_remove_extra or item.get("id_customer")
+    ]
+    if remove_items:
+        applied["extra"] += ApplySecretIds(
+            lambda ids: secret_path.remove(*ids), remove_items, failed
+        )
+
+    disabled_names = {
+        item["name"] for item in diff["wrong_disabled"] if item["disabled"]
+    }
+    if disabled_names:
+        try:
+            active_ids = [
+                row[".id"]
+                for row in mikrotik.path("/ppp/active").select(Key(".id"), Key("name"))
+                if str(row.get("name")) in disabled_names
+            ]
+            if active_ids:
+                mikrotik.path("/ppp/active").remove(*active_ids)
+        except MIKROTIK_ERRORS as e:
+            failed.append({"name": "/ppp/active", "error": str(e)})
+
+    return applied, failed
+
+
+def ReconcileMikrotikSecretTable(
+    mikrotik,
+    customers: list,
+    router_profiles: dict,
+    dry_run: bool,
+    is_remove_extra: bool,
+):
+    # one print of the whole table, only the fields the diff needs
+    secrets = list(
+        mikrotik.path("/ppp/secret").select(
+            Key(".id"), Key("name"), Key("password"), Key("profile"), Key("disabled")
+        )
+    )
+    diff = DiffMikrotikPPPSecrets(secrets, customers, router_profiles)
+    result = {"secret_count": len(secrets), "customer_count": len(customers)}
+    if not dry_run:
+        result["applied"], result["failed"] = ApplyMikrotikSecretDiff(
+            mikrotik, diff, is_remove_extra
+        )
+
+    # passwords are only needed on the router, never in the report
+    result["diff"] = {
+        diff_type: [
+            {key: value for key, value in item.items() if key != "password"}
+            for item in items
+        ]
+        for diff_type, items in diff.items()
+    }
+    return result
+
+
+async def ReconcileMikrotikSecrets(
+    db,
+    router_query: dict = {},
+    dry_run: bool = True,
+    is_remove_extra: bool = False,
+):
+    """
+    Diff every router matched by router_query against its customers and,
+    unless dry_run, apply the missing, extra, wrong-profile, wrong-disabled
+    and wrong-password entries. Returns the result per router id.
+    """
+    router_data = await GetAggregateData(
+        db.router,
+        [{"$match": router_query}],
+        {"name": 1, "ip_address": 1, "username": 1, "password": 1, "api_port": 1},
+    )
+    if len(router_data) == 0:
+        return {}
+
+    customer_data = await GetAggregateData(
+        db.customers,
+        [
+            {
+                "$match": {
+                    "id_router": {
+                        "$in": [ObjectId(router["_id"]) for router in router_data]
+                    }
+                }
+            }
+        ],
+        ReconcileCustomerProjections,
+    )
+    router_customers = {}
+    for customer in customer_data:
+        router_customers.setdefault(customer["id_router"], []).append(customer)
+
+    package_data = await GetAggregateData(db.packages, [], {"router_profile": 1})
+    router_profiles = {
+        item["_id"]: item.get("router_profile", "default") for item in package_data
+    }
+
+    async def reconcile(router: dict):
+        router_result = {"name": router.get("name")}
+        start = time.perf_counter()
+        try:
+            router_result.update(
+                await RunMikrotikCommand(
+                    router.get("ip_address"),
+                    router.get("username"),
+                    router.get("password"),
+                    router.get("api_port"),
+                    lambda mikrotik: ReconcileMikrotikSecretTable(
+                        mikrotik,
+                        router_customers.get(router["_id"], []),
+                        router_profiles,
+                        dry_run,
+                        is_remove_extra,
+                    ),
+                )
+            )
+            router_result["summary"] = {
+                diff_type: len(router_result["diff"][diff_type])
+                for diff_type in RECONCILE_DIFF_TYPES
+            }
+        except Exception as e:
+            router_result["error"] = str(e)
+
+        router_result["seconds"] = round(time.perf_counter() - start, 4)
+        return router["_id"], router_result
+
+    results = await asyncio.gather(*[reconcile(router) for router in router_data])
+    if not dry_run:
+        for router in router_data:
+            await RequestMikrotikMirrorSync(db, router.get("name"))
+
+    return dict(results)
@@ -0,0 +1,354 @@
+import asyncio
+from datetime import datetime, timedelta
+import re
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, InsertOne, UpdateOne
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+from app.modules.crud_operations import GetAggregateData
+from app.modules.database import GetAmretaDatabase
+from app.modules.generals import GetCurrentDateTime
+from app.modules.indexes import EnsureIndexes, RegisterIndexes
+from app.modules.jobs import JOB_WORKER_ID
+from app.modules.mikrotik_pool import RunMikrotikCommand
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIKROTIK_TELEMETRY_INTERVAL_SECONDS = int(
+    os.getenv("MIKROTIK_TELEMETRY_INTERVAL_SECONDS", 60)
+)
+MIKROTIK_TELEMETRY_POLL_SECONDS = int(os.getenv("MIKROTIK_TELEMETRY_POLL_SECONDS", 5))
+MIKROTIK_TELEMETRY_RAW_RETENTION_DAYS = int(
+    os.getenv("MIKROTIK_TELEMETRY_RAW_RETENTION_DAYS", 2)
+)
+MIKROTIK_TELEMETRY_5M_RETENTION_DAYS = int(
+    os.getenv("MIKROTIK_TELEMETRY_5M_RETENTION_DAYS", 30)
+)
+MIKROTIK_TELEMETRY_1H_RETENTION_DAYS = int(
+    os.getenv("MIKROTIK_TELEMETRY_1H_RETENTION_DAYS", 365)
+)
+
+# resolution -> collection, bucket size and retention of the samples
+MIKROTIK_TELEMETRY_RESOLUTIONS = {
+    "raw": {
+        "collection": "mikrotik_telemetry",
+        "seconds": None,
+        "retention_days": MIKROTIK_TELEMETRY_RAW_RETENTION_DAYS,
+    },
+    "5m": {
+        "collection": "mikrotik_telemetry_5m",
+        "seconds": 300,
+        "retention_days": MIKROTIK_TELEMETRY_5M_RETENTION_DAYS,
+    },
+    "1h": {
+        "collection": "mikrotik_telemetry_1h",
+        "seconds": 3600,
+        "retention_days": MIKROTIK_TELEMETRY_1H_RETENTION_DAYS,
+    },
+}
+# averaged in the rollups, the maximum is kept next to the sum
+MIKROTIK_TELEMETRY_FIELDS = (
+    "cpu_load",
+    "memory_used_percent",
+    "ppp_active",
+    "ppp_secret",
+)
+MIKROTIK_DURATION_PATTERN = re.compile(r"(\d+)([wdhms])")
+MIKROTIK_DURATION_SECONDS = {"w": 604800, "d": 86400, "h": 3600, "m": 60, "s": 1}
+
+MIKROTIK_TELEMETRY_WORKER = {"task": None}
+
+
+def ParseMikrotikDuration(duration):
+    # RouterOS prints durations as 1w2d03:04:05 or 1w2d3h4m5s
+    if isinstance(duration, int):
+        return duration
+
+    duration = str(duration or "")
+    seconds = 0
+    if ":" in duration:
+        duration, clock = re.split(r"(?=\d+:\d+:\d+$)", duration, maxsplit=1)
+        hours, minutes, clock_seconds = clock.split(":")
+        seconds += int(hours) * 3600 + int(minutes) * 60 + int(clock_seconds)
+
+    for value, unit in MIKROTIK_DURATION_PATTERN.findall(duration):
+        seconds += int(value) * MIKROTIK_DURATION_SECONDS[unit]
+
+    return seconds
+
+
+# the raw samples are a time series collection that expires by itself
+for resolution, config in MIKROTIK_TELEMETRY_RESOLUTIONS.items():
+    if resolution == "raw":
+        continue
+
+    RegisterIndexes(
+        config["collection"],
+        [
+            IndexModel(
+                [("id_router", ASCENDING), ("timestamp", ASCENDING)],
+                name="id_router_timestamp",
+                unique=True,
+            ),
+            IndexModel(
+                [("timestamp", ASCENDING)],
+                name="timestamp_ttl",
+                expireAfterSeconds=config["retention_days"] * 86400,
+            ),
+        ],
+    )
+
+
+async def EnsureMikrotikTelemetryCollection(db):
+    raw_retention_seconds = MIKROTIK_TELEMETRY_RAW_RETENTION_DAYS * 86400
+    try:
+        await db.create_collection(
+            "mikrotik_telemetry",
+            timeseries={
+                "timeField": "timestamp",
+                "metaField": "id_router",
+                "granularity": "minutes",
+            },
+            expireAfterSeconds=raw_retention_seconds,
+        )
+    except CollectionInvalid:
+        pass
+
+    await EnsureIndexes(
+        db,
+        [
+            config["collection"]
+            for resolution, config in MIKROTIK_TELEMETRY_RESOLUTIONS.items()
+            if resolution != "raw"
+        ],
+    )
+
+
+def GetMikrotikCount(mikrotik, path: str):
+    # count-only lets the router count, the table itself is never sent
+    for row in mikrotik(f"{path}/print", **{"count-only": ""}):
+        return int(row.get("ret", 0))
+
+    return 0
+
+
+def FetchMikrotikTelemetry(mikrotik):
+    resource = {}
+    for row in mikrotik.path("/system/resource").select():
+        resource = row
+
+    total_memory = resource.get("total-memory") or 0
+    free_memory = resource.get("free-memory") or 0
+    return {
+        "cpu_load": resource.get("cpu-load", 0),
+        "free_memory": free_memory,
+        "total_memory": total_memory,
+        "memory_used_percent": (
+            round((total_memory - free_memory) / total_memory * 100, 2)
+            if total_memory
+            else 0
+        ),
+        "uptime": ParseMikrotikDuration(resource.get("uptime")),
+        "ppp_active": GetMikrotikCount(mikrotik, "/ppp/active"),
+        "ppp_secret": GetMikrotikCount(mikrotik, "/ppp/secret"),
+    }
+
+
+def GetMikrotikTelemetryBucket(timestamp: datetime, seconds: int):
+    # bucket sizes divide an hour, so the offset within the hour is enough
+    offset = (timestamp.minute * 60 + timestamp.second) % seconds
+    return timestamp.replace(microsecond=0) - timedelta(seconds=offset)
+
+
+def CreateMikrotikTelemetryRollup(sample: dict, seconds: int):
+    """
+    Fold one sample into its rollup bucket. Sums and counts are
+    incremented, so the average is sum / samples when the bucket is read.
+    """
+    bucket_query = {
+        "id_router": sample["id_router"],
+        "timestamp": GetMikrotikTelemetryBucket(sample["timestamp"], seconds),
+    }
+    update_data = {
+        "$inc": {"samples": 1},
+        "$max": {},
+        "$set": {"uptime": sample["uptime"], "last_at": sample["timestamp"]},
+    }
+    for field in MIKROTIK_TELEMETRY_FIELDS:
+        update_data["$inc"][f"{field}_sum"] = sample[field]
+        update_data["$max"][f"{field}_max"] = sample[field]
+
+    return UpdateOne(bucket_query, update_data, upsert=True)
+
+
+async def ClaimMikrotikTelemetryCycle(
+    db,
+    timestamp: datetime,
+    collector: str = "collector",
+    interval_seconds: int = MIKROTIK_TELEMETRY_INTERVAL_SECONDS,
+):
+    # one process samples per interval, otherwise rollups count samples twice
+    claim_data = {
+        "locked_by": JOB_WORKER_ID,
+        "next_run_at": timestamp + timedelta(seconds=interval_seconds),
+    }
+    result = await db.mikrotik_telemetry_schedule.update_one(
+        {"_id": collector, "next_run_at": {"$lte": timestamp}},
+        {"$set": claim_data},
+    )
+    if result.modified_count == 1:
+        return True
+
+    try:
+        await db.mikrotik_telemetry_schedule.insert_one(
+            {"_id": collector, **claim_data}
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def CollectMikrotikTelemetry(db):
+    """
+    Sample every router concurrently and write the raw samples and their
+    5 minute and hourly rollups. Returns the number of sampled routers.
+    """
+    timestamp = GetCurrentDateTime()
+    if not await ClaimMikrotikTelemetryCycle(db, timestamp):
+        return 0
+
+    router_data = await GetAggregateData(
+        db.router,
+        [],
+        {"name": 1, "ip_address": 1, "username": 1, "password": 1, "api_port": 1},
+    )
+
+    async def sample(router: dict):
+        try:
+            telemetry = await RunMikrotikCommand(
+                router.get("ip_address"),
+                router.get("username"),
+                router.get("password"),
+                router.get("api_port"),
+                FetchMikrotikTelemetry,
+                is_retry=True,
+            )
+        except Exception as e:
+            print(f"{router.get('name')}: {str(e)}")
+            return None
+
+        return {
+            "id_router": ObjectId(router["_id"]),
+            "timestamp": timestamp,
+            **telemetry,
+        }
+
+    samples = [
+        item
+        for item in await asyncio.gather(*[sample(router) for router in router_data])
+        if item
+    ]
+    if len(samples) == 0:
+        return 0
+
+    await db.mikrotik_telemetry.bulk_write(
+        [InsertOne(item) for item in samples], ordered=False
+    )
+    for resolution, config in MIKROTIK_TELEMETRY_RESOLUTIONS.items():
+        if resolution == "raw":
+            continue
+
+        await db[config["collection"]].bulk_write(
+            [
+                CreateMikrotikTelemetryRollup(item, config["seconds"])
+                for item in samples
+            ],
+            ordered=False,
+        )
+
+    return len(samples)
+
+
+async def MikrotikTelemetryWorkerLoop():
+    db = await GetAmretaDatabase()
+    await EnsureMikrotikTelemetryCollection(db)
+    while True:
+        try:
+            await CollectMikrotikTelemetry(db)
+        except Exception as e:
+            print(str(e))
+
+        # the claim decides when a cycle is due, polling keeps the drift small
+        await asyncio.sleep(MIKROTIK_TELEMETRY_POLL_SECONDS)
+
+
+async def StartMikrotikTelemetryWorker():
+    MIKROTIK_TELEMETRY_WORKER["task"] = asyncio.create_task(
+        MikrotikTelemetryWorkerLoop()
+    )
+
+
+async def StopMikrotikTelemetryWorker():
+    task = MIKROTIK_TELEMETRY_WORKER["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def GetMikrotikTelemetryResolution(from_date: datetime, to_date: datetime):
+    # keep a chart around a few hundred points whatever the range is
+    range_seconds = (to_date - from_date).total_seconds()
+    if range_seconds <= 6 * 3600:
+        return "raw"
+
+    if range_seconds <= 3 * 86400:
+        return "5m"
+
+    return "1h"
+
+
+async def GetMikrotikTelemetryHistory(
+    db,
+    id_router: ObjectId,
+    from_date: datetime,
+    to_date: datetime,
+    resolution: str = None,
+):
+    """
+    Return chart-ready series, one list per field aligned with labels.
+    """
+    resolution = resolution or GetMikrotikTelemetryResolution(from_date, to_date)
+    config = MIKROTIK_TELEMETRY_RESOLUTIONS[resolution]
+    projection = {"_id": 0, "timestamp": 1, "uptime": 1}
+    for field in MIKROTIK_TELEMETRY_FIELDS:
+        if resolution == "raw":
+            projection[field] = 1
+        else:
+            projection[field] = {
+                "$round": [{"$divide": [f"${field}_sum", "$samples"]}, 2]
+            }
+            projection[f"{field}_max"] = 1
+
+    telemetry_data = await GetAggregateData(
+        db[config["collection"]],
+        [
+            {
+                "$match": {
+                    "id_router": id_router,
+                    "timestamp": {"$gte": from_date, "$lte": to_date},
+                }
+            },
+            {"$sort": {"timestamp": 1}},
+        ],
+        projection,
+    )
+    series_fields = [field for field in projection if field not in ["_id", "timestamp"]]
+    return {
+        "resolution": resolution,
+        "labels": [item["timestamp"] for item in telemetry_data],
+        "series": {
+            field: [item.get(field) for item in telemetry_data]
+            for field in series_fields
+        },
+    }
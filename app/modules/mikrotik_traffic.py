@@ -0,0 +1,376 @@
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from app.modules.crud_operations import GetAggregateData, GetOneData
+from app.modules.database import GetAmretaDatabase
+from app.modules.generals import GetCurrentDateTime
+from app.modules.indexes import EnsureIndexes, RegisterIndexes
+from app.modules.mikrotik_pool import RunMikrotikCommand
+from app.modules.mikrotik_telemetry import (
+    MIKROTIK_TELEMETRY_POLL_SECONDS,
+    ClaimMikrotikTelemetryCycle,
+)
+from librouteros.query import Key
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIKROTIK_TRAFFIC_INTERVAL_SECONDS = int(
+    os.getenv("MIKROTIK_TRAFFIC_INTERVAL_SECONDS", 300)
+)
+MIKROTIK_TRAFFIC_HOURLY_RETENTION_DAYS = int(
+    os.getenv("MIKROTIK_TRAFFIC_HOURLY_RETENTION_DAYS", 90)
+)
+MIKROTIK_TRAFFIC_DAILY_RETENTION_DAYS = int(
+    os.getenv("MIKROTIK_TRAFFIC_DAILY_RETENTION_DAYS", 730)
+)
+
+# period -> rollup collection and retention
+MIKROTIK_TRAFFIC_PERIODS = {
+    "hourly": {
+        "collection": "customer_usage_hourly",
+        "retention_days": MIKROTIK_TRAFFIC_HOURLY_RETENTION_DAYS,
+    },
+    "daily": {
+        "collection": "customer_usage_daily",
+        "retention_days": MIKROTIK_TRAFFIC_DAILY_RETENTION_DAYS,
+    },
+}
+# dynamic PPPoE server interfaces are named <pppoe-username>
+PPPOE_INTERFACE_PREFIX = "<pppoe-"
+PPPOE_INTERFACE_SUFFIX = ">"
+
+MIKROTIK_TRAFFIC_WORKER = {"task": None}
+
+
+for config in MIKROTIK_TRAFFIC_PERIODS.values():
+    RegisterIndexes(
+        config["collection"],
+        [
+            IndexModel(
+                [
+                    ("id_router", ASCENDING),
+                    ("pppoe_username", ASCENDING),
+                    ("timestamp", ASCENDING),
+                ],
+                name="id_router_pppoe_username_timestamp",
+                unique=True,
+            ),
+            IndexModel(
+                [("id_customer", ASCENDING), ("timestamp", ASCENDING)],
+                name="id_customer_timestamp",
+            ),
+            IndexModel(
+                [("timestamp", ASCENDING)],
+                name="timestamp_ttl",
+                expireAfterSeconds=config["retention_days"] * 86400,
+            ),
+        ],
+    )
+
+
+async def EnsureMikrotikTrafficIndex(db):
+    await EnsureIndexes(
+        db, [config["collection"] for config in MIKROTIK_TRAFFIC_PERIODS.values()]
+    )
+
+
+def FetchMikrotikTrafficCounters(mikrotik):
+    # one print of the pppoe-in interfaces carries the counters of every
+    # session, no per-session queries
+    return list(
+        mikrotik.path("/interface")
+        .select(Key(".id"), Key("name"), Key("rx-byte"), Key("tx-byte"))
+        .where(Key("type") == "pppoe-in")
+    )
+
+
+def GetMikrotikTrafficDeltas(counters: dict, rows: list):
+    """
+    Compare the current pppoe-in counters with the previous ones, keyed by
+    pppoe username as [interface id, rx-byte, tx-byte]. Returns the new
+    counters and the {pppoe_username: (upload, download)} deltas.
+
+    A reconnect creates a new interface with a new id and a counter reset
+    makes the counter go down, in both cases the session started from
+    zero so the current value is the delta. A username seen for the first
+    time is only used as the baseline.
+    """
+    current_counters = {}
+    deltas = {}
+    for row in rows:
+        name = str(row.get("name", ""))
+        if not (
+            name.startswith(PPPOE_INTERFACE_PREFIX)
+            and name.endswith(PPPOE_INTERFACE_SUFFIX)
+        ):
+            continue
+
+        pppoe_username = name[
+            len(PPPOE_INTERFACE_PREFIX) : -len(PPPOE_INTERFACE_SUFFIX)
+        ]
+        # the router is the server, its rx is the customer upload
+        upload = int(row.get("rx-byte") or 0)
+        download = int(row.get("tx-byte") or 0)
+        current_counters[pppoe_username] = [row.get(".id"), upload, download]
+        previous = counters.get(pppoe_username)
+        if previous is None:
+            continue
+
+        previous_id, previous_upload, previous_download = previous
+        if previous_id != row.get(".id") or upload < previous_upload:
+            upload_delta = upload
+        else:
+            upload_delta = upload - previous_upload
+
+        if previous_id != row.get(".id") or download < previous_download:
+            download_delta = download
+        else:
+            download_delta = download - previous_download
+
+        if upload_delta or download_delta:
+            deltas[pppoe_username] = (upload_delta, download_delta)
+
+    return current_counters, deltas
+
+
+def CreateMikrotikTrafficRollups(
+    id_router: ObjectId,
+    deltas: dict,
+    customers: dict,
+    timestamp: datetime,
+):
+    hour = timestamp.replace(minute=0, second=0, microsecond=0)
+    buckets = {"hourly": hour, "daily": hour.replace(hour=0)}
+    operations = {period: [] for period in MIKROTIK_TRAFFIC_PERIODS}
+    for pppoe_username, (upload, download) in deltas.items():
+        id_customer = customers.get(pppoe_username)
+        for period, bucket in buckets.items():
+            operations[period].append(
+                UpdateOne(
+                    {
+                        "id_router": id_router,
+                        "pppoe_username": pppoe_username,
+                        "timestamp": bucket,
+                    },
+                    {
+                        "$inc": {
+                            "upload": upload,
+                            "download": download,
+                            "total": upload + download,
+                        },
+                        "$set": {
+                            "id_customer": (
+                                ObjectId(id_customer) if id_customer else None
+                            )
+                        },
+                    },
+                    upsert=True,
+                )
+            )
+
+    return operations
+
+
+async def CollectRouterTraffic(db, router: dict, customers: dict, timestamp: datetime):
+    id_router = ObjectId(router["_id"])
+    rows = await RunMikrotikCommand(
+        router.get("ip_address"),
+        router.get("username"),
+        router.get("password"),
+        router.get("api_port"),
+        FetchMikrotikTrafficCounters,
+        is_retry=True,
+    )
+    # the counters of a router are kept in a single document, one write per
+    # router per cycle whatever the session count is
+    counter_data = await GetOneData(
+        db.mikrotik_traffic_counters, {"_id": id_router}, {"counters": 1}
+    )
+    # stored as rows, a pppoe username is not a safe document key
+    counters, deltas = GetMikrotikTrafficDeltas(
+        {item[0]: item[1:] for item in (counter_data or {}).get("counters", [])},
+        rows,
+    )
+    for period, operations in CreateMikrotikTrafficRollups(
+        id_router, deltas, customers, timestamp
+    ).items():
+        if operations:
+            await db[MIKROTIK_TRAFFIC_PERIODS[period]["collection"]].bulk_write(
+                operations, ordered=False
+            )
+
+    await db.mikrotik_traffic_counters.update_one(
+        {"_id": id_router},
+        {
+            "$set": {
+                "counters": [[name, *item] for name, item in counters.items()],
+                "sampled_at": timestamp,
+            }
+        },
+        upsert=True,
+    )
+    return len(deltas)
+
+
+async def CollectMikrotikTraffic(db):
+    timestamp = GetCurrentDateTime()
+    if not await ClaimMikrotikTelemetryCycle(
+        db, timestamp, "traffic", MIKROTIK_TRAFFIC_INTERVAL_SECONDS
+    ):
+        return 0
+
+    router_data = await GetAggregateData(
+        db.router,
+        [],
+        {"name": 1, "ip_address": 1, "username": 1, "password": 1, "api_port": 1},
+    )
+    customer_data = await GetAggregateData(
+        db.customers,
+        [{"$match": {"pppoe_username": {"$exists": True}}}],
+        {"pppoe_username": 1, "id_router": 1},
+    )
+    router_customers = {}
+    for customer in customer_data:
+        router_customers.setdefault(customer.get("id_router"), {})[
+            str(customer["pppoe_username"])
+        ] = customer["_id"]
+
+    async def collect(router: dict):
+        try:
+            return await CollectRouterTraffic(
+                db, router, router_customers.get(router["_id"], {}), timestamp
+            )
+        except Exception as e:
+            print(f"{router.get('name')}: {str(e)}")
+            return 0
+
+    return sum(await asyncio.gather(*[collect(router) for router in router_data]))
+
+
+async def MikrotikTrafficWorkerLoop():
+    db = await GetAmretaDatabase()
+    await EnsureMikrotikTrafficIndex(db)
+    while True:
+        try:
+            await CollectMikrotikTraffic(db)
+        except Exception as e:
+            print(str(e))
+
+        await asyncio.sleep(MIKROTIK_TELEMETRY_POLL_SECONDS)
+
+
+async def StartMikrotikTrafficWorker():
+    MIKROTIK_TRAFFIC_WORKER["task"] = asyncio.create_task(MikrotikTrafficWorkerLoop())
+
+
+async def StopMikrotikTrafficWorker():
+    task = MIKROTIK_TRAFFIC_WORKER["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def GetTopCustomerUsage(
+    db,
+    period: str,
+    from_date: datetime,
+    to_date: datetime,
+    limit: int = 10,
+    id_router: ObjectId = None,
+):
+    query = {"timestamp": {"$gte": from_date, "$lte": to_date}}
+    if id_router:
+        query["id_router"] = id_router
+
+    return await GetAggregateData(
+        db[MIKROTIK_TRAFFIC_PERIODS[period]["collection"]],
+        [
+            {"$match": query},
+            {
+                "$group": {
+                    "_id": {
+                        "id_router": "$id_router",
+                        "pppoe_username": "$pppoe_username",
+                    },
+                    "id_customer": {"$last": "$id_customer"},
+                    "upload": {"$sum": "$upload"},
+                    "download": {"$sum": "$download"},
+                    "total": {"$sum": "$total"},
+                }
+            },
+            {"$sort": {"total": DESCENDING}},
+            {"$limit": limit},
+            {
+                "$lookup": {
+                    "from": "customers",
+                    "localField": "id_customer",
+                    "foreignField": "_id",
+                    "as": "customer",
+                }
+            },
+        ],
+        {
+            "_id": 0,
+            "id_router": "$_id.id_router",
+            "pppoe_username": "$_id.pppoe_username",
+            "id_customer": 1,
+            "name": {"$arrayElemAt": ["$customer.name", 0]},
+            "service_number": {"$arrayElemAt": ["$customer.service_number", 0]},
+            "upload": 1,
+            "download": 1,
+            "total": 1,
+        },
+    )
+
+
+async def GetCustomerUsageHistory(
+    db,
+    id_customer: ObjectId,
+    period: str,
+    from_date: datetime,
+    to_date: datetime,
+):
+    """
+    Return chart-ready usage of a customer, one point per period bucket.
+    """
+    usage_data = await GetAggregateData(
+        db[MIKROTIK_TRAFFIC_PERIODS[period]["collection"]],
+        [
+            {
+                "$match": {
+                    "id_customer": id_customer,
+                    "timestamp": {"$gte": from_date, "$lte": to_date},
+                }
+            },
+            {
+                "$group": {
+                    "_id": "$timestamp",
+                    "upload": {"$sum": "$upload"},
+                    "download": {"$sum": "$download"},
+                    "total": {"$sum": "$total"},
+                }
+            },
+            {"$sort": {"_id": ASCENDING}},
+        ],
+    )
+    return {
+        "labels": [item["_id"] for item in usage_data],
+        "series": {
+            field: [item[field] for item in usage_data]
+            for field in ["upload", "download", "total"]
+        },
+        "upload": sum(item["upload"] for item in usage_data),
+        "download": sum(item["download"] for item in usage_data),
+        "total": sum(item["total"] for item in usage_data),
+    }
+
+
+def GetDefaultUsageRange(period: str, from_date: datetime, to_date: datetime):
+    to_date = to_date or GetCurrentDateTime()
+    if from_date is None:
+        from_date = to_date - timedelta(days=1 if period == "hourly" else 30)
+
+    return from_date, to_date
@@ -1,11 +1,41 @@
+import asyncio
+from datetime import datetime, timedelta
 import os
-import requests
+import time
+from bson import ObjectId
+import httpx
+from pymongo import ASCENDING, IndexModel, UpdateMany, UpdateOne
+from app.models.invoices import InvoiceStatusData
+from app.models.payments import BankMutationStatusData
+from app.modules.crud_operations import GetAggregateData, IterateAggregateData
+from app.modules.database import GetAmretaDatabase
+from app.modules.generals import GetCurrentDateTime
+from app.modules.indexes import EnsureIndexes, RegisterIndexes
+from app.modules.http_client import GetHTTPClient
+from app.modules.payment_confirmation import ConfirmInvoicePayments
 from dotenv import load_dotenv
 
 load_dotenv()
 
 MOOTA_API_TOKEN = os.getenv("MOOTA_API_TOKEN")
 MOOTA_BANK_ACCOUNT_ID = os.getenv("MOOTA_BANK_ACCOUNT_ID")
+MOOTA_MUTATION_PER_PAGE = int(os.getenv("MOOTA_MUTATION_PER_PAGE", 100))
+# mutation notes posted at once, moota rate limits the api token
+MOOTA_CONFIRM_CONCURRENCY = int(os.getenv("MOOTA_CONFIRM_CONCURRENCY", 5))
+MOOTA_MUTATION_DAYS = int(os.getenv("MOOTA_MUTATION_DAYS", 3))
+# moota can post a mutation late with an older date, every sync fetches
+# this many days before the watermark again
+MOOTA_MUTATION_LOOKBACK_DAYS = int(
+    os.getenv("MOOTA_MUTATION_LOOKBACK_DAYS", MOOTA_MUTATION_DAYS)
+)
+MOOTA_INVOICE_DUE_DAYS = int(os.getenv("MOOTA_INVOICE_DUE_DAYS", 5))
+# callbacks wake the worker at once, the poll catches what other processes
+# received
+MOOTA_CONFIRM_POLL_SECONDS = int(os.getenv("MOOTA_CONFIRM_POLL_SECONDS", 60))
+# credit mutations are the incoming transfers
+MOOTA_CREDIT_TYPE = "CR"
+
+MOOTA_CONFIRM_WORKER = {"task": None, "event": None}
 
 
 async def GetMootaMutationTracking():
@@ -17,9 +47,9 @@ async def GetMootaMutationTracking():
     url = "https://app.moota.co/api/v2/mutation-tracking?page=&per_page="
 
     try:
-        response = requests.get(url, headers=headers)
+        response = await GetHTTPClient("moota").get(url, headers=headers)
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return str(e)
 
 
@@ -32,9 +62,9 @@ async def GetDetailMootaMutation(trx_id: str):
     url = f"https://app.moota.co/api/v2/mutation-tracking/detail?trx_id={trx_id}"
 
     try:
-        response = requests.get(url, headers=headers)
+        response = await GetHTTPClient("moota").get(url, headers=headers)
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return str(e)
 
 
@@ -62,7 +92,361 @@ async def CreateMootaMutation(customer_name: str, item_name: str, ammount: int):
     url = "https://app.moota.co/api/v2/mutation-tracking"
 
     try:
-        response = requests.post(url, json=data, headers=headers)
+        response = await GetHTTPClient("moota").post(url, json=data, headers=headers)
         return response.json()
-    except requests.exceptions.RequestException:
+    except httpx.HTTPError:
         return None
+
+
+async def GetMootaMutations(start_date: str, end_date: str):
+    """
+    Download every mutation between start_date and end_date (YYYY-MM-DD),
+    page by page. Raises httpx.HTTPError when a page cannot be fetched, a
+    partial list would make an ambiguous amount look unique.
+    """
+    headers = {
+        "Accept": "application/json",
+        "Authorization": f"Bearer {MOOTA_API_TOKEN}",
+    }
+    url = "https://app.moota.co/api/v2/mutation"
+    mutations = []
+    page = 1
+    while True:
+        response = await GetHTTPClient("moota").get(
+            url,
+            headers=headers,
+            params={
+                "start_date": start_date,
+                "end_date": end_date,
+                "page": page,
+                "per_page": MOOTA_MUTATION_PER_PAGE,
+            },
+        )
+        response.raise_for_status()
+        response = response.json()
+        mutations.extend(response.get("data", []))
+        if page >= int(response.get("last_page") or page):
+            return mutations
+
+        page += 1
+
+
+async def CreateMootaMutationNote(mutation_id: str, note: str):
+    headers = {
+        "Accept": "application/json",
+        "Authorization": f"Bearer {MOOTA_API_TOKEN}",
+    }
+
+    url = f"https://app.moota.co/api/v2/mutation/{mutation_id}/note"
+
+    try:
+        response = await GetHTTPClient("moota").post(
+            url, json={"note": note}, headers=headers
+        )
+        return response.json()
+    except httpx.HTTPError as e:
+        return str(e)
+
+
+def ParseMootaDate(value):
+    # moota prints local times as YYYY-MM-DD HH:MM:SS
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def FormatBankMutation(mutation: dict):
+    return {
+        "mutation_id": str(mutation.get("mutation_id")),
+        "bank_id": mutation.get("bank_id"),
+        "type": mutation.get("type"),
+        "amount": int(float(mutation.get("amount") or 0)),
+        "description": mutation.get("description"),
+        "note": mutation.get("note"),
+        "date": ParseMootaDate(mutation.get("date")),
+        "status": BankMutationStatusData.UNMATCHED.value,
+        "id_invoice": None,
+        "matched_at": None,
+        "raw": mutation,
+    }
+
+
+RegisterIndexes(
+    "bank_mutations",
+    [
+        IndexModel([("mutation_id", ASCENDING)], name="mutation_id", unique=True),
+        IndexModel(
+            [("type", ASCENDING), ("id_invoice", ASCENDING), ("date", ASCENDING)],
+            name="type_id_invoice_date",
+        ),
+        IndexModel([("amount", ASCENDING), ("date", ASCENDING)], name="amount_date"),
+    ],
+)
+
+
+async def EnsureBankMutationIndex(db):
+    await EnsureIndexes(db, ["bank_mutations"])
+
+
+async def StoreBankMutations(db, mutations: list):
+    """
+    Upsert mutations into the bank_mutations ledger by mutation_id. Stored
+    mutations are kept as they are, their match status and invoice link
+    survive every later sync. Returns the number of new mutations.
+    """
+    if len(mutations) == 0:
+        return 0
+
+    now = GetCurrentDateTime()
+    result = await db.bank_mutations.bulk_write(
+        [
+            UpdateOne(
+                {"mutation_id": item["mutation_id"]},
+                {
+                    "$setOnInsert": {**item, "created_at": now},
+                    "$set": {"synced_at": now},
+                },
+                upsert=True,
+            )
+            for item in [FormatBankMutation(mutation) for mutation in mutations]
+        ],
+        ordered=False,
+    )
+    return result.upserted_count
+
+
+async def SyncMootaMutations(db):
+    """
+    Download the mutations since the stored high-watermark, minus the
+    lookback window, into the bank_mutations ledger. The overlap catches
+    mutations posted late with an older date, the unique mutation_id drops
+    what is already stored.
+    """
+    now = GetCurrentDateTime()
+    sync_data = await db.bank_mutation_sync.find_one({"_id": "moota"})
+    if sync_data and sync_data.get("last_date"):
+        start_date = sync_data["last_date"] - timedelta(
+            days=MOOTA_MUTATION_LOOKBACK_DAYS
+        )
+    else:
+        start_date = now - timedelta(days=MOOTA_MUTATION_DAYS)
+
+    mutations = await GetMootaMutations(
+        start_date.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
+    )
+    inserted = await StoreBankMutations(db, mutations)
+    dates = [
+        date
+        for date in [ParseMootaDate(item.get("date")) for item in mutations]
+        if date
+    ]
+    update_data = {"$set": {"synced_at": now}}
+    if dates:
+        update_data["$max"] = {"last_date": max(dates)}
+
+    await db.bank_mutation_sync.update_one({"_id": "moota"}, update_data, upsert=True)
+    return {"fetched": len(mutations), "inserted": inserted}
+
+
+def GetMootaAmountIndex(mutations: list):
+    amount_index = {}
+    for mutation in mutations:
+        if mutation.get("type") != MOOTA_CREDIT_TYPE:
+            continue
+
+        amount_index.setdefault(int(float(mutation.get("amount") or 0)), []).append(
+            mutation
+        )
+
+    return amount_index
+
+
+def MatchMootaMutations(invoices: list, mutations: list):
+    """
+    Match invoices with credit mutations by amount. A match needs exactly
+    one invoice and one mutation with the amount, otherwise the transfer
+    cannot be told apart and is left for a manual confirmation. Returns the
+    [(invoice, mutation)] matches and the [(invoices, mutations)] groups
+    sharing an amount.
+    """
+    amount_index = GetMootaAmountIndex(mutations)
+    amount_invoices = {}
+    for invoice in invoices:
+        amount_invoices.setdefault(int(invoice.get("amount", 0)), []).append(invoice)
+
+    matches = []
+    duplicates = []
+    for amount, items in amount_invoices.items():
+        amount_mutations = amount_index.get(amount, [])
+        if len(amount_mutations) == 0:
+            continue
+
+        if len(items) == 1 and len(amount_mutations) == 1:
+            matches.append((items[0], amount_mutations[0]))
+        else:
+            duplicates.append((items, amount_mutations))
+
+    return matches, duplicates
+
+
+async def ConfirmBankMutations(db):
+    """
+    Match the unlinked credit mutations of the ledger with the unpaid
+    invoices due around today, confirm the matches and link each mutation
+    to its invoice.
+    """
+    now = GetCurrentDateTime()
+    mutations = await GetAggregateData(
+        db.bank_mutations,
+        [
+            {
+                "$match": {
+                    "type": MOOTA_CREDIT_TYPE,
+                    "id_invoice": None,
+                    "date": {"$gte": now - timedelta(days=MOOTA_MUTATION_DAYS)},
+                }
+            }
+        ],
+        {"raw": 0},
+    )
+    amounts = list(GetMootaAmountIndex(mutations))
+    invoices = []
+    if len(amounts) > 0:
+        # streamed, only the invoices with a transferred amount are kept
+        async for invoice in IterateAggregateData(
+            db.invoices,
+            [
+                {
+                    "$match": {
+                        "status": {
+                            "$in": [
+                                InvoiceStatusData.UNPAID.value,
+                                InvoiceStatusData.PENDING.value,
+                            ]
+                        },
+                        "due_date": {
+                            "$gte": now - timedelta(days=MOOTA_INVOICE_DUE_DAYS),
+                            "$lte": now + timedelta(days=MOOTA_INVOICE_DUE_DAYS),
+                        },
+                        "amount": {"$in": amounts},
+                    }
+                }
+            ],
+            {
+                "id_customer": 1,
+                "name": 1,
+                "service_number": 1,
+                "amount": 1,
+                "due_date": 1,
+            },
+        ):
+            invoices.append(invoice)
+
+    matches, duplicates = MatchMootaMutations(invoices, mutations)
+    confirmed_ids = set(
+        await ConfirmInvoicePayments(db, [invoice for invoice, _ in matches], "Moota")
+    )
+    matches = [
+        (invoice, mutation)
+        for invoice, mutation in matches
+        if invoice["_id"] in confirmed_ids
+    ]
+
+    link_operations = [
+        UpdateOne(
+            {"mutation_id": mutation["mutation_id"]},
+            {
+                "$set": {
+                    "status": BankMutationStatusData.MATCHED.value,
+                    "id_invoice": ObjectId(invoice["_id"]),
+                    "matched_at": now,
+                }
+            },
+        )
+        for invoice, mutation in matches
+    ]
+    duplicated_ids = [
+        mutation["mutation_id"]
+        for _, amount_mutations in duplicates
+        for mutation in amount_mutations
+    ]
+    if duplicated_ids:
+        link_operations.append(
+            UpdateMany(
+                {"mutation_id": {"$in": duplicated_ids}, "id_invoice": None},
+                {"$set": {"status": BankMutationStatusData.DUPLICATED.value}},
+            )
+        )
+
+    if link_operations:
+        await db.bank_mutations.bulk_write(link_operations, ordered=False)
+
+    semaphore = asyncio.Semaphore(MOOTA_CONFIRM_CONCURRENCY)
+
+    async def create_note(invoice: dict, mutation: dict):
+        async with semaphore:
+            await CreateMootaMutationNote(
+                mutation.get("mutation_id"),
+                f"{invoice.get('name')} - {invoice.get('service_number')}",
+            )
+
+    await asyncio.gather(
+        *[create_note(invoice, mutation) for invoice, mutation in matches]
+    )
+    return {
+        "invoices": len(invoices),
+        "mutations": len(mutations),
+        "confirmed": len(confirmed_ids),
+        "duplicated": sum(len(items) for items, _ in duplicates),
+    }
+
+
+async def RunMootaAutoconfirm(db):
+    """
+    Sync the mutation ledger from moota and confirm the invoices it pays.
+    """
+    start = time.perf_counter()
+    await EnsureBankMutationIndex(db)
+    sync_result = await SyncMootaMutations(db)
+    result = await ConfirmBankMutations(db)
+    return {
+        **sync_result,
+        **result,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def RequestMootaConfirm():
+    # called by the callback, the confirmation runs outside the request
+    if MOOTA_CONFIRM_WORKER["event"]:
+        MOOTA_CONFIRM_WORKER["event"].set()
+
+
+async def MootaConfirmWorkerLoop():
+    db = await GetAmretaDatabase()
+    await EnsureBankMutationIndex(db)
+    event = MOOTA_CONFIRM_WORKER["event"]
+    while True:
+        try:
+            await asyncio.wait_for(event.wait(), timeout=MOOTA_CONFIRM_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+        event.clear()
+        try:
+            await ConfirmBankMutations(db)
+        except Exception as e:
+            print(str(e))
+
+
+async def StartMootaConfirmWorker():
+    MOOTA_CONFIRM_WORKER["event"] = asyncio.Event()
+    MOOTA_CONFIRM_WORKER["task"] = asyncio.create_task(MootaConfirmWorkerLoop())
+
+
+async def StopMootaConfirmWorker():
+    task = MOOTA_CONFIRM_WORKER["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -1,5 +1,6 @@
 import os
-import requests
+import httpx
+from app.modules.http_client import GetHTTPClient
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,10 +20,10 @@ async def SendMPWAWhatsappSingleMessage(destination_number: str, message: str):
         "message": message,
     }
     try:
-        res = requests.post(url=url, json=body, timeout=15)
+        res = await GetHTTPClient("mpwa").post(url=url, json=body)
         res.raise_for_status()
         return {"success": True, "data": res.json()}
-    except requests.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         return {
             "success": False,
             "error": f"HTTP error: {http_err}",
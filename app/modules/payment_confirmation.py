@@ -0,0 +1,265 @@
+import asyncio
+from datetime import timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from app.models.customers import CustomerStatusData
+from app.models.invoices import InvoiceOwnerVerifiedStatusData, InvoiceStatusData
+from app.models.notifications import NotificationTypeData
+from app.models.payments import PaymentMethodData
+from app.models.users import UserRole
+from app.modules.crud_operations import (
+    CreateOneData,
+    GetAggregateData,
+    GetManyData,
+    GetOneData,
+    InvalidateDataCount,
+    UpdateManyData,
+    UpdateOneData,
+)
+from app.modules.generals import DateIDFormatter, GetCurrentDateTime, ThousandSeparator
+from app.modules.mikrotik import ProvisionMikrotikPPPSecrets
+from app.modules.telegram_message import SendTelegramPaymentMessage
+from app.modules.whatsapp_message import SendWhatsappPaymentSuccessMessage
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+AUTOCONFIRM_USER_ID = os.getenv("AUTOCONFIRM_USER_ID")
+AUTOCONFIRM_USER_EMAIL = os.getenv("AUTOCONFIRM_USER_EMAIL")
+# mitra fee checks running at once while confirming a batch of invoices
+PAYMENT_CONFIRM_CONCURRENCY = int(os.getenv("PAYMENT_CONFIRM_CONCURRENCY", 5))
+# a settlement claimed by a process that died is taken over after this
+PAYMENT_SETTLE_LEASE_SECONDS = int(os.getenv("PAYMENT_SETTLE_LEASE_SECONDS", 300))
+
+
+async def CheckMitraFee(db, customer_data, id_invoice):
+    # a resumed settlement must not pay the fee of an invoice twice
+    if await GetOneData(db.invoice_fees, {"id_invoice": ObjectId(id_invoice)}):
+        return
+
+    invoice_data, count = await GetManyData(
+        db.invoices,
+        [{"$match": {"id_customer": ObjectId(customer_data.get("_id"))}}],
+        {"_id": 1},
+    )
+    if count <= 1:
+        return
+
+    if customer_data.get("referral", None):
+        referral_user = await GetOneData(
+            db.users, {"referral": customer_data.get("referral")}
+        )
+        if referral_user and referral_user.get("role") == UserRole.MITRA:
+            package_data = await GetOneData(
+                db.packages,
+                {"_id": ObjectId(customer_data.get("id_package"))},
+            )
+            if package_data:
+                package_fee = package_data.get("price", {}).get("mitra_fee", 0)
+                # fee checks of one batch run concurrently and may credit the
+                # same mitra, the increment keeps every credit
+                await UpdateOneData(
+                    db.users,
+                    {"referral": customer_data.get("referral")},
+                    {"$inc": {"saldo": package_fee}},
+                )
+                await CreateOneData(
+                    db.invoice_fees,
+                    {
+                        "id_customer": ObjectId(customer_data.get("_id")),
+                        "id_invoice": ObjectId(id_invoice),
+                        "id_user": ObjectId(referral_user.get("_id")),
+                        "referral": referral_user.get("referral"),
+                        "fee": package_fee,
+                        "created_at": GetCurrentDateTime(),
+                    },
+                )
+
+
+async def ConfirmInvoicePayments(db, invoices: list, source: str, payment: dict = {}):
+    """
+    Mark the invoices paid by transfer through an automatic source (Moota,
+    IPaymu), record their incomes and reactivate their customers, all with
+    bulk writes. Invoices that are already PAID are skipped, so a payment
+    seen twice (polling and callback) is confirmed once. An invoice stays
+    payment.is_settled=False until its income, activation and mitra fee are
+    recorded, a repeated call resumes it instead of skipping it. Returns
+    the ids of the invoices settled by this call.
+    """
+    if len(invoices) == 0:
+        return []
+
+    now = GetCurrentDateTime()
+    invoice_operations = []
+    for invoice in invoices:
+        period = DateIDFormatter(invoice.get("due_date"))
+        invoice_operations.append(
+            UpdateOne(
+                {
+                    "_id": ObjectId(invoice["_id"]),
+                    "status": {"$ne": InvoiceStatusData.PAID.value},
+                },
+                {
+                    "$set": {
+                        "status": InvoiceStatusData.PAID.value,
+                        "payment.method": PaymentMethodData.TRANSFER.value,
+                        "payment.paid_at": now,
+                        "payment.description": f"Pembayaran Tagihan Periode {period} (By {source})",
+                        "payment.confirmed_at": now,
+                        "payment.confirmed_by": AUTOCONFIRM_USER_EMAIL,
+                        **{
+                            f"payment.{key}": value
+                            for key, value in payment.get(invoice["_id"], {}).items()
+                        },
+                        "payment.is_settled": False,
+                        "owner_verified_status": InvoiceOwnerVerifiedStatusData.ACCEPTED.value,
+                    }
+                },
+            )
+        )
+
+    await db.invoices.bulk_write(invoice_operations, ordered=False)
+    InvalidateDataCount(db.invoices)
+
+    # claim the unsettled invoices, the ones just moved to PAID and the ones
+    # left behind by an earlier call that failed after its PAID write
+    invoice_ids = [ObjectId(item["_id"]) for item in invoices]
+    await db.invoices.update_many(
+        {
+            "_id": {"$in": invoice_ids},
+            "status": InvoiceStatusData.PAID.value,
+            "payment.is_settled": False,
+            "$or": [
+                {"payment.settling_at": {"$exists": False}},
+                {
+                    "payment.settling_at": {
+                        "$lt": now - timedelta(seconds=PAYMENT_SETTLE_LEASE_SECONDS)
+                    }
+                },
+            ],
+        },
+        {"$set": {"payment.settling_at": now}},
+    )
+    claimed_data = await GetAggregateData(
+        db.invoices,
+        [{"$match": {"_id": {"$in": invoice_ids}, "payment.settling_at": now}}],
+    )
+    if len(claimed_data) == 0:
+        return []
+
+    claimed_ids = [ObjectId(item["_id"]) for item in claimed_data]
+    try:
+        await SettleInvoicePayments(db, claimed_data, now)
+    except Exception:
+        # release the claim so the retry of the payment resumes at once
+        await db.invoices.update_many(
+            {"_id": {"$in": claimed_ids}, "payment.settling_at": now},
+            {"$unset": {"payment.settling_at": ""}},
+        )
+        raise
+
+    await db.invoices.update_many(
+        {"_id": {"$in": claimed_ids}},
+        {
+            "$set": {"payment.is_settled": True},
+            "$unset": {"payment.settling_at": ""},
+        },
+    )
+
+    invoice_ids = [invoice["_id"] for invoice in claimed_data]
+    for id_invoice in invoice_ids:
+        asyncio.create_task(SendTelegramPaymentMessage(db, id_invoice))
+
+    asyncio.create_task(SendWhatsappPaymentSuccessMessage(db, invoice_ids))
+    return invoice_ids
+
+
+async def SettleInvoicePayments(db, invoices: list, now):
+    """
+    Record the incomes, reactivate the customers, pay the mitra fees and
+    notify the customers of invoices that were just confirmed paid. A
+    resumed invoice keeps one income and one mitra fee.
+    """
+    await db.incomes.bulk_write(
+        [
+            UpdateOne(
+                {"id_invoice": ObjectId(invoice["_id"])},
+                {
+                    "$set": {
+                        "id_invoice": ObjectId(invoice["_id"]),
+                        "nominal": invoice.get("amount", 0),
+                        "category": "BAYAR TAGIHAN",
+                        "description": f"Pembayaran Tagihan dengan Nomor Layanan {invoice.get('service_number', '-')} a/n {invoice.get('name', '-')}, Periode {DateIDFormatter(invoice.get('due_date'))}",
+                        "method": PaymentMethodData.TRANSFER.value,
+                        "date": now,
+                        "id_receiver": ObjectId(AUTOCONFIRM_USER_ID),
+                        "created_at": now,
+                    }
+                },
+                upsert=True,
+            )
+            for invoice in invoices
+        ],
+        ordered=False,
+    )
+    InvalidateDataCount(db.incomes)
+
+    customer_data = await GetAggregateData(
+        db.customers,
+        [
+            {
+                "$match": {
+                    "_id": {
+                        "$in": list(
+                            {ObjectId(invoice["id_customer"]) for invoice in invoices}
+                        )
+                    }
+                }
+            }
+        ],
+    )
+    customers = {item["_id"]: item for item in customer_data}
+    inactive_customers = [
+        item
+        for item in customers.values()
+        if item.get("status")
+        not in [CustomerStatusData.ACTIVE.value, CustomerStatusData.FREE.value]
+    ]
+    if len(inactive_customers) > 0:
+        await UpdateManyData(
+            db.customers,
+            {"_id": {"$in": [ObjectId(item["_id"]) for item in inactive_customers]}},
+            {"$set": {"status": CustomerStatusData.ACTIVE.value}},
+        )
+        await ProvisionMikrotikPPPSecrets(db, inactive_customers, False)
+
+    notifications = []
+    semaphore = asyncio.Semaphore(PAYMENT_CONFIRM_CONCURRENCY)
+
+    async def check_mitra_fee(customer: dict, id_invoice: str):
+        async with semaphore:
+            await CheckMitraFee(db, customer, id_invoice)
+
+    fee_tasks = []
+    for invoice in invoices:
+        customer = customers.get(invoice["id_customer"])
+        if not customer:
+            continue
+
+        fee_tasks.append(check_mitra_fee(customer, invoice["_id"]))
+        if customer.get("id_user"):
+            notifications.append(
+                {
+                    "id_user": ObjectId(customer["id_user"]),
+                    "title": "Tagihan Telah Dibayar",
+                    "description": f"Tagihan anda senilai Rp{ThousandSeparator(invoice.get('amount', 0))} telah dikonfirmasi!",
+                    "type": NotificationTypeData.OTHER.value,
+                    "is_read": 0,
+                    "created_at": now,
+                }
+            )
+
+    await asyncio.gather(*fee_tasks)
+    if len(notifications) > 0:
+        await db.notifications.insert_many(notifications)
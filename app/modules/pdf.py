@@ -389,7 +389,7 @@ def CreateThermalInvoiceBody(pdf: FPDF, data):
     pdf.cell(
         0,
         4,
-        f"Dicetak Pada         : {DateIDFormatter(str(GetCurrentDateTime()))}",
+        f"Dicetak Pada         : {DateIDFormatter(GetCurrentDateTime())}",
         ln=True,
         align="L",
     )
@@ -497,7 +497,7 @@ def CreatePDFCashflowBody(
     pdf.cell(
         0,
         4,
-        f"Rekapitulasi {DateIDFormatter(str(from_date))} s/d {DateIDFormatter(str(to_date))}",
+        f"Rekapitulasi {DateIDFormatter(from_date)} s/d {DateIDFormatter(to_date)}",
         border=False,
         ln=True,
         align="R",
@@ -548,7 +548,7 @@ def CreatePDFCashflowBody(
     pdf.cell(
         0,
         4,
-        f"Dicetak Pada {DateIDFormatter(str(GetCurrentDateTime()))}",
+        f"Dicetak Pada {DateIDFormatter(GetCurrentDateTime())}",
         border=False,
         ln=True,
         align="L",
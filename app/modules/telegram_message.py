@@ -1,10 +1,10 @@
 import os
 from urllib.parse import urlencode
 from bson import ObjectId
-import requests
 from app.models.tickets import TicketTypeData
 from app.modules.generals import GetCurrentDateTime, ThousandSeparator, DateIDFormatter
 from app.modules.crud_operations import CreateOneData, GetAggregateData, GetOneData
+from app.modules.http_client import GetHTTPClient
 from app.models.notifications import NotificationTypeData
 from app.models.users import UserRole
 from dotenv import load_dotenv
@@ -57,7 +57,7 @@ async def SendTelegramImage(image_url: list, thread_id):
     telegram_api_url = (
         f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMediaGroup"
     )
-    response = requests.post(telegram_api_url, json=data)
+    response = await GetHTTPClient("telegram").post(telegram_api_url, json=data)
     print(response.json())
 
 
@@ -78,7 +78,7 @@ async def SendTelegramNewCustomerMessage(db, id_customer: str):
 
         v_message = "*⚠️ INFORMASI PEMASANGAN BARU*\n\n"
         v_message += (
-            f"🗓️ *{DateIDFormatter(str(GetCurrentDateTime()), is_show_time=True)}*\n\n\n"
+            f"🗓️ *{DateIDFormatter(GetCurrentDateTime(), is_show_time=True)}*\n\n\n"
         )
         SHORTCUT_BUTTON.append(
             {
@@ -108,7 +108,7 @@ async def SendTelegramNewCustomerMessage(db, id_customer: str):
         telegram_api_url = (
             f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         )
-        response = requests.post(telegram_api_url, json=data)
+        response = await GetHTTPClient("telegram").post(telegram_api_url, json=data)
         return response.json()
     except Exception as e:
         print(e)
@@ -200,7 +200,7 @@ async def SendTelegramTicketOpenMessage(db, id_ticket: str):
         telegram_api_url = (
             f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         )
-        requests.post(telegram_api_url, json=data)
+        await GetHTTPClient("telegram").post(telegram_api_url, json=data)
     except Exception as e:
         await CreateTelegramErrorNotification(db, str(e))
 
@@ -320,7 +320,7 @@ async def SendTelegramTicketClosedMessage(db, id_ticket: str):
         telegram_api_url = (
             f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         )
-        requests.post(telegram_api_url, json=data)
+        await GetHTTPClient("telegram").post(telegram_api_url, json=data)
         await SendTelegramImage(IMAGE_EVIDENCE, data["message_thread_id"])
     except Exception as e:
         await CreateTelegramErrorNotification(db, str(e))
@@ -353,7 +353,7 @@ async def SendTelegramPaymentMessage(db, id_invoice):
             "parse_mode": "Markdown",
         }
         telegram_api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage?{urlencode(params)}"
-        requests.get(telegram_api_url)
+        await GetHTTPClient("telegram").get(telegram_api_url)
 
     except Exception as e:
         print(str(e))
@@ -1,22 +1,23 @@
 from bson import ObjectId
 from app.models.whatsapp_messages import WhatsappGatewayType
 from app.models.tickets import TicketTypeData
-from app.modules.crud_operations import (
-    CreateOneData,
-    GetAggregateData,
-    GetOneData,
-    UpdateOneData,
+from app.modules.crud_operations import GetAggregateData, GetOneData
+from app.modules.bablast_whatsapp_message import SendBablastWhatsappBulkMessage
+from app.modules.generals import DateIDFormatter, GetCurrentDateTime, ThousandSeparator
+from app.modules.message_template import (
+    GetWhatsappTemplate,
+    GetWhatsappTemplateConfig,
+    RenderMessageTemplate,
 )
-import asyncio
-from app.modules.mpwa_whatsapp_message import SendMPWAWhatsappSingleMessage
-from app.modules.bablast_whatsapp_message import (
-    SendBablastWhatsappBulkMessage,
-    SendBablastWhatsappSingleMessage,
+from app.modules.whatsapp_outbox import (
+    CreateWhatsappErrorNotification,
+    CreateWhatsappOutboxData,
+    EnqueueWhatsappMessage,
+    EnqueueWhatsappMessages,
+    GetCurrentWhatsappGateway,
+    SendWhatsappGatewayMessage,
 )
-from app.modules.generals import DateIDFormatter, GetCurrentDateTime, ThousandSeparator
 import os
-from app.models.notifications import NotificationTypeData
-from app.models.users import UserRole
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -40,372 +41,263 @@ MONTH_DICTIONARY = {
 WHATSAPP_DELAY_TIME_SECONDS = int(os.getenv("WHATSAPP_DELAY_TIME_SECONDS"))
 
 
-async def CreateWhatsappErrorNotification(db, description: str):
-    notification_data = {
-        "title": "Whatsapp Message Error",
-        "description": description,
-        "type": NotificationTypeData.SYSTEM_ERROR.value,
-        "is_read": 0,
-        "created_at": GetCurrentDateTime(),
-    }
-    admin_user = await GetAggregateData(
-        db.users, [{"$match": {"role": UserRole.OWNER.value}}]
-    )
-    for user in admin_user:
-        notification_data["id_user"] = ObjectId(user["_id"])
-        await CreateOneData(db.notifications, notification_data.copy())
-
-
-async def GetCurrentWhatsappGateway(db):
-    whatsapp_gateway = WhatsappGatewayType.BABLAST.value
-    whatsapp_config = await GetOneData(
-        db.configurations, {"type": "WHATSAPP_MESSAGE_TEMPLATE"}
-    )
-    if whatsapp_config:
-        whatsapp_gateway = whatsapp_config.get("advance", {}).get(
-            "whatsapp_gateway", WhatsappGatewayType.BABLAST.value
-        )
-
-    return whatsapp_gateway
-
-
 def WhatsappMessageFormatter(title: str, body: str):
     formatted_message = f"*{title}*\n{body}"
     return formatted_message
 
 
 async def SendWhatsappSingleMessage(db, destination_number: str, message: str):
-    response = None
     whatsapp_gateway = await GetCurrentWhatsappGateway(db)
-    destination_number = f"62{destination_number}"
-    if whatsapp_gateway == WhatsappGatewayType.MPWA.value:
-        response = await SendMPWAWhatsappSingleMessage(destination_number, message)
-    else:
-        response = await SendBablastWhatsappSingleMessage(destination_number, message)
-
+    response = await SendWhatsappGatewayMessage(
+        whatsapp_gateway, destination_number, message
+    )
     if not response.get("success"):
-        await CreateWhatsappErrorNotification(db, response.get("data"))
+        await CreateWhatsappErrorNotification(db, response.get("error"))
 
     return response
 
 
+async def GetWhatsappInvoiceRecipients(db, invoice_ids: list):
+    # two $in queries for the whole id list instead of two lookups per invoice
+    invoice_data = await GetAggregateData(
+        db.invoices,
+        [{"$match": {"_id": {"$in": [ObjectId(id) for id in invoice_ids]}}}],
+    )
+    customer_ids = {ObjectId(item["id_customer"]) for item in invoice_data}
+    customer_data = await GetAggregateData(
+        db.customers,
+        [{"$match": {"_id": {"$in": list(customer_ids)}}}],
+        {"name": 1, "service_number": 1, "due_date": 1, "phone_number": 1},
+    )
+    customers = {item["_id"]: item for item in customer_data}
+    return [
+        (item, customers[item["id_customer"]])
+        for item in invoice_data
+        if item.get("id_customer") in customers
+    ]
+
+
+async def SendWhatsappInvoiceMessages(
+    db, invoice_ids: list, render_message, flag: str = None, is_skip_sent=False
+):
+    """
+    Render one message per invoice with render_message(template_config,
+    invoice_data, customer_data) and enqueue them in one bulk write. With a
+    flag, the invoice gets flag=True once its message is delivered. With
+    is_skip_sent an invoice that already has the flag is skipped, so a
+    repeated job chunk never sends the same message twice.
+    """
+    template_config = await GetWhatsappTemplateConfig(db)
+    if not template_config["bot"] or not template_config["config"]:
+        return None
+
+    outbox_items = []
+    for invoice_data, customer_data in await GetWhatsappInvoiceRecipients(
+        db, invoice_ids
+    ):
+        if is_skip_sent and flag and invoice_data.get(flag):
+            continue
+
+        try:
+            message = render_message(template_config, invoice_data, customer_data)
+            key = None
+            on_sent = None
+            if flag:
+                key = f"{flag}:{invoice_data['_id']}"
+                on_sent = {
+                    "collection": "invoices",
+                    "id": ObjectId(invoice_data["_id"]),
+                    "field": flag,
+                }
+
+            outbox_items.append(
+                CreateWhatsappOutboxData(
+                    customer_data["phone_number"], message, key, on_sent
+                )
+            )
+        except Exception as e:
+            print(str(e))
+            continue
+
+    return await EnqueueWhatsappMessages(db, outbox_items)
+
+
 async def SendWhatsappBroadcastMessage(
     db, destination_contacts: list[str], message: str
 ):
-    response = None
     whatsapp_gateway = await GetCurrentWhatsappGateway(db)
 
+    # mpwa has no bulk endpoint, its messages are paced by the outbox worker
     if whatsapp_gateway == WhatsappGatewayType.MPWA.value:
         for destination in destination_contacts:
-            try:
-                destination_number = f"62{destination.get('phone_number')}"
-                response = await SendMPWAWhatsappSingleMessage(
-                    destination_number, message
-                )
-                await asyncio.sleep(WHATSAPP_DELAY_TIME_SECONDS)
-            except Exception as e:
-                print(str(e))
-                continue
-    else:
-        response = await SendBablastWhatsappBulkMessage(
-            delay=WHATSAPP_DELAY_TIME_SECONDS,
-            destination_contacts=destination_contacts,
-            message=message,
-        )
+            await EnqueueWhatsappMessage(db, destination.get("phone_number"), message)
+
+        return {"success": True, "data": "Pesan Telah Diantrikan!"}
+
+    response = await SendBablastWhatsappBulkMessage(
+        delay=WHATSAPP_DELAY_TIME_SECONDS,
+        destination_contacts=destination_contacts,
+        message=message,
+    )
 
     if not response.get("success"):
-        await CreateWhatsappErrorNotification(db, response.get("data"))
+        await CreateWhatsappErrorNotification(db, response.get("error"))
 
     return response
 
 
 async def SendWhatsappCustomerActivatedMessage(db, id_customer):
     customer_data = await GetOneData(db.customers, {"_id": ObjectId(id_customer)})
-    whatsapp_bot = await GetOneData(db.configurations, {"type": "WHATSAPP_BOT"})
-    whatsapp_config = await GetOneData(
-        db.configurations, {"type": "WHATSAPP_MESSAGE_TEMPLATE"}
-    )
-    if not customer_data or not whatsapp_bot or not whatsapp_config:
+    template_config = await GetWhatsappTemplateConfig(db)
+    if not customer_data or not template_config["bot"] or not template_config["config"]:
         return
 
-    message = whatsapp_config.get("activate", "")
+    message = RenderMessageTemplate(
+        GetWhatsappTemplate(template_config, "activate"),
+        {
+            "[nama_pelanggan]": customer_data.get("name", "-"),
+            "[no_servis]": customer_data.get("service_number", "-"),
+        },
+    )
+    await EnqueueWhatsappMessage(db, customer_data["phone_number"], message)
+    return {"message": "Pesan Telah Diantrikan!"}
+
+
+def RenderPaymentCreatedMessage(
+    template_config: dict, invoice_data: dict, customer_data: dict
+):
+    whatsapp_config = template_config["config"]
     fields_to_replace = {
         "[nama_pelanggan]": customer_data.get("name", "-"),
         "[no_servis]": customer_data.get("service_number", "-"),
+        "[nama_paket]": invoice_data.get("package", [])[0]["name"],
+        "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
+        "[status]": "BELUM DIBAYAR",
+        "[tgl_due_date]": customer_data.get("due_date", ""),
+        "[bulan_tagihan]": MONTH_DICTIONARY[int(invoice_data.get("month"))],
+        "[tahun_tagihan]": invoice_data.get("year"),
+        "[link]": f"{FRONTEND_DOMAIN}/quick-payment?id={invoice_data['_id']}",
+        "[footer_wa]": whatsapp_config.get("advance", {}).get("footer", ""),
     }
+    return RenderMessageTemplate(
+        GetWhatsappTemplate(template_config, "billing"), fields_to_replace
+    )
 
-    for key, value in fields_to_replace.items():
-        try:
-            message = message.replace(key, str(value))
-        except Exception:
-            message = message.replace(key, "-")
 
-    response = await SendWhatsappSingleMessage(
-        db, customer_data["phone_number"], message
+def RenderPaymentReminderMessage(
+    template_config: dict, invoice_data: dict, customer_data: dict
+):
+    whatsapp_config = template_config["config"]
+    fields_to_replace = {
+        "[nama_pelanggan]": customer_data.get("name", "-"),
+        "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
+        "[link]": f"{FRONTEND_DOMAIN}/quick-payment?id={invoice_data['_id']}",
+        "[footer_wa]": whatsapp_config.get("advance", {}).get("footer", ""),
+    }
+    return RenderMessageTemplate(
+        GetWhatsappTemplate(template_config, "reminder"), fields_to_replace
     )
-    return response
 
 
-async def SendWhatsappPaymentCreatedMessage(db, invoice_ids: list):
-    whatsapp_bot = await GetOneData(db.configurations, {"type": "WHATSAPP_BOT"})
-    whatsapp_config = await GetOneData(
-        db.configurations, {"type": "WHATSAPP_MESSAGE_TEMPLATE"}
+def RenderPaymentOverdueMessage(
+    template_config: dict, invoice_data: dict, customer_data: dict
+):
+    whatsapp_config = template_config["config"]
+    fields_to_replace = {
+        "[judul]": f"*{whatsapp_config.get('advance', {}).get('header', '')}*",
+        "[nama_pelanggan]": customer_data.get("name", "-"),
+        "[no_servis]": customer_data.get("service_number", "-"),
+        "[link]": f"{FRONTEND_DOMAIN}/quick-payment?id={invoice_data['_id']}",
+    }
+    return RenderMessageTemplate(
+        GetWhatsappTemplate(template_config, "overdue"), fields_to_replace
     )
-    if not whatsapp_bot or not whatsapp_config:
-        return
 
-    for id_invoice in invoice_ids:
-        try:
-            invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id_invoice)})
-            if not invoice_data:
-                continue
 
-            customer_data = await GetOneData(
-                db.customers, {"_id": ObjectId(invoice_data["id_customer"])}
-            )
-            if not customer_data:
-                continue
-
-            message = whatsapp_config.get("billing", "")
-            fields_to_replace = {
-                "[nama_pelanggan]": customer_data.get("name", "-"),
-                "[no_servis]": customer_data.get("service_number", "-"),
-                "[nama_paket]": invoice_data.get("package", [])[0]["name"],
-                "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
-                "[status]": "BELUM DIBAYAR",
-                "[tgl_due_date]": customer_data.get("due_date", ""),
-                "[bulan_tagihan]": MONTH_DICTIONARY[int(invoice_data.get("month"))],
-                "[tahun_tagihan]": invoice_data.get("year"),
-                "[link]": f"{FRONTEND_DOMAIN}/quick-payment?id={id_invoice}",
-                "[footer_wa]": whatsapp_config.get("advance", {}).get("footer", ""),
-            }
-
-            for key, value in fields_to_replace.items():
-                try:
-                    message = message.replace(key, str(value))
-                except Exception:
-                    message = message.replace(key, "-")
-
-            response = await SendWhatsappSingleMessage(
-                db, customer_data["phone_number"], message
-            )
-            if response and response.get("success"):
-                await UpdateOneData(
-                    db.invoices,
-                    {"_id": ObjectId(id_invoice)},
-                    {"$set": {"is_whatsapp_sended": True}},
-                )
+def RenderIsolirMessage(template_config: dict, invoice_data: dict, customer_data: dict):
+    fields_to_replace = {
+        "[nama_pelanggan]": customer_data.get("name", "-"),
+        "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
+    }
+    return RenderMessageTemplate(
+        GetWhatsappTemplate(template_config, "isolir"), fields_to_replace
+    )
 
-            await asyncio.sleep(WHATSAPP_DELAY_TIME_SECONDS)
-        except Exception as e:
-            print(str(e))
-            continue
 
-    return {"message": "Whatsapp Telah Dikirimkan!"}
+def RenderPaymentSuccessMessage(
+    template_config: dict, invoice_data: dict, customer_data: dict
+):
+    whatsapp_config = template_config["config"]
+    fields_to_replace = {
+        "[nama_pelanggan]": customer_data.get("name", "-"),
+        "[no_servis]": customer_data.get("service_number", "-"),
+        "[nama_paket]": invoice_data.get("package", [])[0]["name"],
+        "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
+        "[status]": "SUDAH DIBAYAR",
+        "[hari]": GetCurrentDateTime().strftime("%d"),
+        "[bulan]": MONTH_DICTIONARY[int(invoice_data.get("month"))],
+        "[tahun]": GetCurrentDateTime().strftime("%Y"),
+        "[metode_bayar]": invoice_data.get("payment", {}).get("method", "-"),
+        "[thanks_wa]": whatsapp_config.get("advance", {}).get("thanks_message", ""),
+    }
+    return RenderMessageTemplate(
+        GetWhatsappTemplate(template_config, "paid"), fields_to_replace
+    )
 
 
-async def SendWhatsappPaymentReminderMessage(db, invoice_ids: list):
-    whatsapp_bot = await GetOneData(db.configurations, {"type": "WHATSAPP_BOT"})
-    whatsapp_config = await GetOneData(
-        db.configurations, {"type": "WHATSAPP_MESSAGE_TEMPLATE"}
+async def SendWhatsappPaymentCreatedMessage(
+    db, invoice_ids: list, is_skip_sent: bool = False
+):
+    result = await SendWhatsappInvoiceMessages(
+        db,
+        invoice_ids,
+        RenderPaymentCreatedMessage,
+        "is_whatsapp_sended",
+        is_skip_sent,
     )
-    if not whatsapp_bot or not whatsapp_config:
+    if result is None:
         return
 
-    for id_invoice in invoice_ids:
-        try:
-            invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id_invoice)})
-            if not invoice_data:
-                continue
+    return {"message": "Whatsapp Telah Dikirimkan!"}
 
-            customer_data = await GetOneData(
-                db.customers, {"_id": ObjectId(invoice_data["id_customer"])}
-            )
-            if not customer_data:
-                continue
-
-            message = whatsapp_config.get("reminder", "")
-            fields_to_replace = {
-                "[nama_pelanggan]": customer_data.get("name", "-"),
-                "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
-                "[link]": f"{FRONTEND_DOMAIN}/quick-payment?id={id_invoice}",
-                "[footer_wa]": whatsapp_config.get("advance", {}).get("footer", ""),
-            }
-
-            for key, value in fields_to_replace.items():
-                try:
-                    message = message.replace(key, str(value))
-                except Exception:
-                    message = message.replace(key, "-")
-
-            response = await SendWhatsappSingleMessage(
-                db, customer_data["phone_number"], message
-            )
-            if response.get("success"):
-                await UpdateOneData(
-                    db.invoices,
-                    {"_id": ObjectId(id_invoice)},
-                    {"$set": {"is_whatsapp_reminder_sended": True}},
-                )
 
-            await asyncio.sleep(WHATSAPP_DELAY_TIME_SECONDS)
-        except Exception as e:
-            print(str(e))
-            continue
+async def SendWhatsappPaymentReminderMessage(db, invoice_ids: list):
+    result = await SendWhatsappInvoiceMessages(
+        db, invoice_ids, RenderPaymentReminderMessage, "is_whatsapp_reminder_sended"
+    )
+    if result is None:
+        return
 
     return {"message": "Pengingat Telah Dikirimkan!"}
 
 
 async def SendWhatsappPaymentOverdueMessage(db, invoice_ids):
-    whatsapp_bot = await GetOneData(db.configurations, {"type": "WHATSAPP_BOT"})
-    whatsapp_config = await GetOneData(
-        db.configurations, {"type": "WHATSAPP_MESSAGE_TEMPLATE"}
+    result = await SendWhatsappInvoiceMessages(
+        db, invoice_ids, RenderPaymentOverdueMessage, "is_whatsapp_overdue_sended"
     )
-    if not whatsapp_bot or not whatsapp_config:
+    if result is None:
         return
 
-    for id_invoice in invoice_ids:
-        try:
-            invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id_invoice)})
-            if not invoice_data:
-                continue
-            customer_data = await GetOneData(
-                db.customers, {"_id": ObjectId(invoice_data["id_customer"])}
-            )
-            if not customer_data:
-                continue
-
-            message = whatsapp_config.get("overdue", "")
-            fields_to_replace = {
-                "[judul]": f"*{whatsapp_config.get('advance', {}).get('header', '')}*",
-                "[nama_pelanggan]": customer_data.get("name", "-"),
-                "[no_servis]": customer_data.get("service_number", "-"),
-                "[link]": f"{FRONTEND_DOMAIN}/quick-payment?id={id_invoice}",
-            }
-
-            for key, value in fields_to_replace.items():
-                try:
-                    message = message.replace(key, str(value))
-                except Exception:
-                    message = message.replace(key, "-")
-
-            response = await SendWhatsappSingleMessage(
-                db, customer_data["phone_number"], message
-            )
-            if response.get("success"):
-                await UpdateOneData(
-                    db.invoices,
-                    {"_id": ObjectId(id_invoice)},
-                    {"$set": {"is_whatsapp_overdue_sended": True}},
-                )
-
-            await asyncio.sleep(WHATSAPP_DELAY_TIME_SECONDS)
-        except Exception as e:
-            print(str(e))
-            continue
-
     return {"message": "Pesan Overdue Telah Dikirimkan!"}
 
 
-async def SendWhatsappIsolirMessage(db, invoice_ids):
-    whatsapp_bot = await GetOneData(db.configurations, {"type": "WHATSAPP_BOT"})
-    whatsapp_config = await GetOneData(
-        db.configurations, {"type": "WHATSAPP_MESSAGE_TEMPLATE"}
+async def SendWhatsappIsolirMessage(db, invoice_ids, is_skip_sent: bool = False):
+    result = await SendWhatsappInvoiceMessages(
+        db, invoice_ids, RenderIsolirMessage, "is_whatsapp_isolir_sended", is_skip_sent
     )
-    if not whatsapp_bot or not whatsapp_config:
+    if result is None:
         return
 
-    for id_invoice in invoice_ids:
-        try:
-            invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id_invoice)})
-            if not invoice_data:
-                continue
-
-            customer_data = await GetOneData(
-                db.customers, {"_id": ObjectId(invoice_data["id_customer"])}
-            )
-            if not customer_data:
-                continue
-
-            message = whatsapp_config.get("isolir", "")
-            fields_to_replace = {
-                "[nama_pelanggan]": customer_data.get("name", "-"),
-                "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
-            }
-
-            for key, value in fields_to_replace.items():
-                try:
-                    message = message.replace(key, str(value))
-                except Exception:
-                    message = message.replace(key, "-")
-
-            response = await SendWhatsappSingleMessage(
-                db, customer_data["phone_number"], message
-            )
-            if response.get("success"):
-                await UpdateOneData(
-                    db.invoices,
-                    {"_id": ObjectId(id_invoice)},
-                    {"$set": {"is_whatsapp_isolir_sended": True}},
-                )
-
-            await asyncio.sleep(WHATSAPP_DELAY_TIME_SECONDS)
-        except Exception as e:
-            await CreateWhatsappErrorNotification(db, str(e))
-
     return {"message": "Pesan Isolir Telah Dikirimkan!"}
 
 
 async def SendWhatsappPaymentSuccessMessage(db, invoice_ids: list):
-    whatsapp_bot = await GetOneData(db.configurations, {"type": "WHATSAPP_BOT"})
-    whatsapp_config = await GetOneData(
-        db.configurations, {"type": "WHATSAPP_MESSAGE_TEMPLATE"}
+    result = await SendWhatsappInvoiceMessages(
+        db, invoice_ids, RenderPaymentSuccessMessage
     )
-    if not whatsapp_bot or not whatsapp_config:
+    if result is None:
         return
 
-    for id_invoice in invoice_ids:
-        try:
-            invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id_invoice)})
-            if not invoice_data:
-                continue
-
-            customer_data = await GetOneData(
-                db.customers, {"_id": ObjectId(invoice_data["id_customer"])}
-            )
-            if not customer_data:
-                continue
-
-            message = whatsapp_config.get("paid", "")
-            fields_to_replace = {
-                "[nama_pelanggan]": customer_data.get("name", "-"),
-                "[no_servis]": customer_data.get("service_number", "-"),
-                "[nama_paket]": invoice_data.get("package", [])[0]["name"],
-                "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
-                "[status]": "SUDAH DIBAYAR",
-                "[hari]": GetCurrentDateTime().strftime("%d"),
-                "[bulan]": MONTH_DICTIONARY[int(invoice_data.get("month"))],
-                "[tahun]": GetCurrentDateTime().strftime("%Y"),
-                "[metode_bayar]": invoice_data.get("payment", {}).get("method", "-"),
-                "[thanks_wa]": whatsapp_config.get("advance", {}).get(
-                    "thanks_message", ""
-                ),
-            }
-
-            for key, value in fields_to_replace.items():
-                try:
-                    message = message.replace(key, str(value))
-                except Exception:
-                    message = message.replace(key, "-")
-
-            response = await SendWhatsappSingleMessage(
-                db, customer_data["phone_number"], message
-            )
-            await asyncio.sleep(WHATSAPP_DELAY_TIME_SECONDS)
-        except Exception as e:
-            print(str(e))
-            continue
-
     return {"message": "Pesan Pembayaran Telah Dikirimkan!"}
 
 
@@ -461,8 +353,7 @@ async def SendWhatsappTicketOpenMessage(
 
     for number in PHONE_NUMBERS:
         try:
-            response = await SendWhatsappSingleMessage(db, number, v_message)
-            await asyncio.sleep(WHATSAPP_DELAY_TIME_SECONDS)
+            await EnqueueWhatsappMessage(db, number, v_message)
         except Exception as e:
             print(str(e))
             continue
@@ -516,8 +407,7 @@ async def SendWhatsappTicketClosedMessage(db, id_ticket: str):
 
     for number in PHONE_NUMBERS:
         try:
-            response = await SendWhatsappSingleMessage(db, number, v_message)
-            await asyncio.sleep(WHATSAPP_DELAY_TIME_SECONDS)
+            await EnqueueWhatsappMessage(db, number, v_message)
         except Exception as e:
             print(str(e))
             continue
@@ -529,69 +419,40 @@ async def SendWhatsappFeeRequestedMessage(db, name: str, nominal: int, reason: s
     v_message += f"*Nominal*: Rp{ThousandSeparator(nominal)}\n"
     v_message += f"*Alasan*: {reason}\n"
 
-    response = await SendWhatsappSingleMessage(db, WHATSAPP_ADMIN_NUMBER, v_message)
-    return response
+    await EnqueueWhatsappMessage(db, WHATSAPP_ADMIN_NUMBER, v_message)
+    return {"message": "Pesan Telah Diantrikan!"}
 
 
-async def SendWhatsappPaymentSuccessBillMessage(db, invoice_ids):
-    for id_invoice in invoice_ids:
-        try:
-            invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id_invoice)})
-            whatsapp_bot = await GetOneData(db.configurations, {"type": "WHATSAPP_BOT"})
-            whatsapp_message = await GetOneData(
-                db.configurations, {"type": "WHATSAPP_MESSAGE_TEMPLATE"}
-            )
-            customer_data = await GetOneData(
-                db.customers, {"_id": ObjectId(invoice_data.get("id_customer"))}
-            )
+def RenderPaymentSuccessBillMessage(
+    template_config: dict, invoice_data: dict, customer_data: dict
+):
+    whatsapp_config = template_config["config"]
+    # ✅ Tangani bulan secara dinamis
+    try:
+        bulan_str = MONTH_DICTIONARY[int(invoice_data.get("month"))]
+    except Exception:
+        bulan_str = "-"
+
+    # 🔁 Siapkan field pengganti
+    fields_to_replace = {
+        "[nama_pelanggan]": customer_data.get("name", "-"),
+        "[no_servis]": customer_data.get("service_number", "-"),
+        "[nama_paket]": ", ".join(
+            [pkg.get("name", "-") for pkg in invoice_data.get("package", [])]
+        ),
+        "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
+        "[status]": "SUDAH DIBAYAR",
+        "[hari]": GetCurrentDateTime().strftime("%d"),
+        "[bulan]": bulan_str,
+        "[tahun]": GetCurrentDateTime().strftime("%Y"),
+        "[metode_bayar]": invoice_data.get("payment", {}).get("method", "-"),
+        "[thanks_wa]": whatsapp_config.get("advance", {}).get("thanks_message", ""),
+    }
+    return RenderMessageTemplate(
+        GetWhatsappTemplate(template_config, "paid"), fields_to_replace
+    )
 
-            if (
-                not invoice_data
-                or not whatsapp_bot
-                or not whatsapp_message
-                or not customer_data
-            ):
-                return
-
-            message = whatsapp_message.get("paid", "")
-
-            # ✅ Tangani bulan secara dinamis
-            try:
-                bulan_str = MONTH_DICTIONARY[int(invoice_data.get("month"))]
-            except Exception:
-                bulan_str = "-"
-
-            # 🔁 Siapkan field pengganti
-            fields_to_replace = {
-                "[nama_pelanggan]": customer_data.get("name", "-"),
-                "[no_servis]": customer_data.get("service_number", "-"),
-                "[nama_paket]": ", ".join(
-                    [pkg.get("name", "-") for pkg in invoice_data.get("package", [])]
-                ),
-                "[jumlah_tagihan]": ThousandSeparator(invoice_data.get("amount", 0)),
-                "[status]": "SUDAH DIBAYAR",
-                "[hari]": GetCurrentDateTime().strftime("%d"),
-                "[bulan]": bulan_str,
-                "[tahun]": GetCurrentDateTime().strftime("%Y"),
-                "[metode_bayar]": invoice_data.get("payment", {}).get("method", "-"),
-                "[thanks_wa]": whatsapp_message.get("advance", {}).get(
-                    "thanks_message", ""
-                ),
-            }
-
-            # 🔁 Ganti semua placeholder
-            for key, value in fields_to_replace.items():
-                try:
-                    message = message.replace(key, str(value))
-                except Exception:
-                    message = message.replace(key, "-")
-
-            # 🔗 Kirim ke WhatsApp Gateway
-            phone_number = str(customer_data.get("phone_number", "")).lstrip("0")
-            response = await SendWhatsappSingleMessage(db, phone_number, message)
-            await asyncio.sleep(WHATSAPP_DELAY_TIME_SECONDS)
-        except Exception as e:
-            print(str(e))
-            continue
 
+async def SendWhatsappPaymentSuccessBillMessage(db, invoice_ids):
+    await SendWhatsappInvoiceMessages(db, invoice_ids, RenderPaymentSuccessBillMessage)
     return {"message": "Pesan Telah Dikirimkan!"}
@@ -0,0 +1,381 @@
+import asyncio
+from datetime import timedelta
+import time
+from bson import ObjectId
+from pymongo import IndexModel, InsertOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.models.notifications import NotificationTypeData
+from app.models.users import UserRole
+from app.models.whatsapp_messages import WhatsappGatewayType, WhatsappOutboxStatusData
+from app.modules.bablast_whatsapp_message import SendBablastWhatsappSingleMessage
+from app.modules.crud_operations import (
+    CreateOneData,
+    GetAggregateData,
+    InvalidateDataCount,
+)
+from app.modules.database import GetAmretaDatabase
+from app.modules.generals import GetCurrentDateTime
+from app.modules.indexes import EnsureIndexes, RegisterIndexes
+from app.modules.jobs import JOB_WORKER_ID
+from app.modules.message_template import GetWhatsappTemplateConfig
+from app.modules.mpwa_whatsapp_message import SendMPWAWhatsappSingleMessage
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WHATSAPP_DELAY_TIME_SECONDS = int(os.getenv("WHATSAPP_DELAY_TIME_SECONDS"))
+# default pace keeps the old one-message-per-delay behaviour
+WHATSAPP_RATE_PER_MINUTE = float(
+    os.getenv(
+        "WHATSAPP_RATE_PER_MINUTE",
+        60 / WHATSAPP_DELAY_TIME_SECONDS if WHATSAPP_DELAY_TIME_SECONDS > 0 else 60,
+    )
+)
+WHATSAPP_RATE_BURST = int(os.getenv("WHATSAPP_RATE_BURST", 1))
+# messages per minute of each gateway, e.g. WHATSAPP_MPWA_RATE_PER_MINUTE=20
+WHATSAPP_GATEWAY_RATES = {
+    gateway.value: float(
+        os.getenv(f"WHATSAPP_{gateway.value}_RATE_PER_MINUTE", WHATSAPP_RATE_PER_MINUTE)
+    )
+    for gateway in WhatsappGatewayType
+}
+WHATSAPP_OUTBOX_MAX_ATTEMPTS = int(os.getenv("WHATSAPP_OUTBOX_MAX_ATTEMPTS", 5))
+WHATSAPP_OUTBOX_RETRY_SECONDS = int(os.getenv("WHATSAPP_OUTBOX_RETRY_SECONDS", 60))
+WHATSAPP_OUTBOX_POLL_SECONDS = int(os.getenv("WHATSAPP_OUTBOX_POLL_SECONDS", 5))
+WHATSAPP_OUTBOX_BATCH_SIZE = 50
+WHATSAPP_OUTBOX_LEASE_SECONDS = 300
+WHATSAPP_OUTBOX_MAX_RETRY_SECONDS = 3600
+
+# token bucket of each gateway, local to this process
+WHATSAPP_TOKEN_BUCKETS = {}
+WHATSAPP_OUTBOX_WORKER = {"task": None}
+
+
+async def CreateWhatsappErrorNotification(db, description: str):
+    notification_data = {
+        "title": "Whatsapp Message Error",
+        "description": description,
+        "type": NotificationTypeData.SYSTEM_ERROR.value,
+        "is_read": 0,
+        "created_at": GetCurrentDateTime(),
+    }
+    admin_user = await GetAggregateData(
+        db.users, [{"$match": {"role": UserRole.OWNER.value}}]
+    )
+    for user in admin_user:
+        notification_data["id_user"] = ObjectId(user["_id"])
+        await CreateOneData(db.notifications, notification_data.copy())
+
+
+async def GetCurrentWhatsappGateway(db):
+    whatsapp_gateway = WhatsappGatewayType.BABLAST.value
+    whatsapp_config = (await GetWhatsappTemplateConfig(db))["config"]
+    if whatsapp_config:
+        whatsapp_gateway = whatsapp_config.get("advance", {}).get(
+            "whatsapp_gateway", WhatsappGatewayType.BABLAST.value
+        )
+
+    return whatsapp_gateway
+
+
+async def SendWhatsappGatewayMessage(
+    whatsapp_gateway: str, destination_number: str, message: str
+):
+    destination_number = f"62{destination_number}"
+    if whatsapp_gateway == WhatsappGatewayType.MPWA.value:
+        return await SendMPWAWhatsappSingleMessage(destination_number, message)
+
+    return await SendBablastWhatsappSingleMessage(destination_number, message)
+
+
+RegisterIndexes(
+    "whatsapp_outbox",
+    [
+        IndexModel(
+            [("status", 1), ("next_attempt_at", 1)],
+            name="status_next_attempt_at",
+            background=True,
+        ),
+        # the key is dropped once a message is final, so it only dedupes
+        # messages that are still waiting to be sent, and sent messages
+        # whose sent flag could not be written
+        IndexModel(
+            [("key", 1)],
+            name="key_unique",
+            unique=True,
+            partialFilterExpression={"key": {"$exists": True}},
+            background=True,
+        ),
+    ],
+)
+
+
+async def EnsureWhatsappOutboxIndex(db):
+    failed = await EnsureIndexes(db, ["whatsapp_outbox"])
+    return len(failed) == 0
+
+
+def CreateWhatsappOutboxData(
+    destination_number: str,
+    message: str,
+    key: str = None,
+    on_sent: dict = None,
+):
+    """
+    Build a pending outbox message. on_sent is {"collection", "id", "field"}
+    of the flag set to True once the message is delivered, key dedupes
+    messages that are still waiting to be sent.
+    """
+    now = GetCurrentDateTime()
+    outbox_data = {
+        "destination": str(destination_number),
+        "message": message,
+        "status": WhatsappOutboxStatusData.PENDING.value,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+    if key:
+        outbox_data["key"] = key
+    if on_sent:
+        outbox_data["on_sent"] = on_sent
+
+    return outbox_data
+
+
+async def EnqueueWhatsappMessage(
+    db,
+    destination_number: str,
+    message: str,
+    key: str = None,
+    on_sent: dict = None,
+):
+    outbox_data = CreateWhatsappOutboxData(destination_number, message, key, on_sent)
+    if not key:
+        await CreateOneData(db.whatsapp_outbox, outbox_data)
+        return True
+
+    try:
+        result = await db.whatsapp_outbox.update_one(
+            {"key": key}, {"$setOnInsert": outbox_data}, upsert=True
+        )
+        return result.upserted_id is not None
+    except DuplicateKeyError:
+        return False
+
+
+async def EnqueueWhatsappMessages(db, outbox_items: list):
+    if len(outbox_items) == 0:
+        return 0
+
+    operations = []
+    for outbox_data in outbox_items:
+        if outbox_data.get("key"):
+            operations.append(
+                UpdateOne(
+                    {"key": outbox_data["key"]},
+                    {"$setOnInsert": outbox_data},
+                    upsert=True,
+                )
+            )
+        else:
+            operations.append(InsertOne(outbox_data))
+
+    try:
+        result = await db.whatsapp_outbox.bulk_write(operations, ordered=False)
+        return result.inserted_count + result.upserted_count
+    except BulkWriteError as e:
+        # duplicated keys are messages that are already waiting in the outbox
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") != 11000:
+                print(error.get("errmsg"))
+
+        return e.details.get("nInserted", 0) + e.details.get("nUpserted", 0)
+
+
+async def AcquireWhatsappToken(whatsapp_gateway: str):
+    rate_per_second = (
+        WHATSAPP_GATEWAY_RATES.get(whatsapp_gateway, WHATSAPP_RATE_PER_MINUTE) / 60
+    )
+    bucket = WHATSAPP_TOKEN_BUCKETS.setdefault(
+        whatsapp_gateway,
+        {"tokens": WHATSAPP_RATE_BURST, "updated_at": time.monotonic()},
+    )
+    while True:
+        now = time.monotonic()
+        bucket["tokens"] = min(
+            WHATSAPP_RATE_BURST,
+            bucket["tokens"] + (now - bucket["updated_at"]) * rate_per_second,
+        )
+        bucket["updated_at"] = now
+        if bucket["tokens"] >= 1:
+            bucket["tokens"] -= 1
+            return
+
+        await asyncio.sleep((1 - bucket["tokens"]) / rate_per_second)
+
+
+async def ClaimWhatsappOutboxMessage(db):
+    now = GetCurrentDateTime()
+    outbox_data = await db.whatsapp_outbox.find_one_and_update(
+        {
+            "$or": [
+                {
+                    "status": WhatsappOutboxStatusData.PENDING.value,
+                    "next_attempt_at": {"$lte": now},
+                },
+                # picked by a worker that died before recording the result
+                {
+                    "status": WhatsappOutboxStatusData.SENDING.value,
+                    "locked_until": {"$lt": now},
+                },
+            ]
+        },
+        {
+            "$set": {
+                "status": WhatsappOutboxStatusData.SENDING.value,
+                "locked_by": JOB_WORKER_ID,
+                "locked_until": now + timedelta(seconds=WHATSAPP_OUTBOX_LEASE_SECONDS),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    return outbox_data
+
+
+def GetWhatsappRetryAt(attempts: int):
+    retry_seconds = min(
+        WHATSAPP_OUTBOX_RETRY_SECONDS * (2 ** max(attempts - 1, 0)),
+        WHATSAPP_OUTBOX_MAX_RETRY_SECONDS,
+    )
+    return GetCurrentDateTime() + timedelta(seconds=retry_seconds)
+
+
+async def SetWhatsappSentFlags(db, on_sent_items: list):
+    # group the delivered flags into one bulk write per collection
+    flag_ids = {}
+    for on_sent in on_sent_items:
+        flag_ids.setdefault((on_sent["collection"], on_sent["field"]), []).append(
+            on_sent["id"]
+        )
+
+    operations = {}
+    for (collection, field), ids in flag_ids.items():
+        operations.setdefault(collection, []).append(
+            UpdateMany({"_id": {"$in": ids}}, {"$set": {field: True}})
+        )
+
+    for collection, collection_operations in operations.items():
+        await db[collection].bulk_write(collection_operations, ordered=False)
+        InvalidateDataCount(db[collection])
+
+
+async def DeliverWhatsappOutboxMessage(db, outbox_data: dict, whatsapp_gateway: str):
+    try:
+        response = await SendWhatsappGatewayMessage(
+            whatsapp_gateway, outbox_data["destination"], outbox_data["message"]
+        )
+    except Exception as e:
+        response = {"success": False, "error": str(e)}
+
+    now = GetCurrentDateTime()
+    update_data = {
+        "$set": {"gateway": whatsapp_gateway, "updated_at": now},
+        "$unset": {"locked_by": "", "locked_until": ""},
+    }
+    if response.get("success"):
+        update_data["$set"].update(
+            {"status": WhatsappOutboxStatusData.SENT.value, "sent_at": now}
+        )
+        # the flag is written before the dedupe key is dropped, a reminder
+        # run in between sees one or the other and never sends it twice
+        is_flag_set = True
+        if outbox_data.get("on_sent"):
+            try:
+                await SetWhatsappSentFlags(db, [outbox_data["on_sent"]])
+            except Exception as e:
+                # the gateway took the message, it is SENT either way. The
+                # kept key still blocks a second send in place of the flag
+                is_flag_set = False
+                print(f"Whatsapp sent flag not written: {str(e)}")
+                update_data["$set"]["last_error"] = str(e)
+
+        if is_flag_set:
+            update_data["$unset"]["key"] = ""
+    else:
+        error = str(response.get("error") or response.get("data"))
+        update_data["$set"]["last_error"] = error
+        if outbox_data.get("attempts", 0) >= WHATSAPP_OUTBOX_MAX_ATTEMPTS:
+            update_data["$set"]["status"] = WhatsappOutboxStatusData.FAILED.value
+            update_data["$unset"]["key"] = ""
+            await CreateWhatsappErrorNotification(db, error)
+        else:
+            update_data["$set"].update(
+                {
+                    "status": WhatsappOutboxStatusData.PENDING.value,
+                    "next_attempt_at": GetWhatsappRetryAt(outbox_data["attempts"]),
+                }
+            )
+
+    await db.whatsapp_outbox.update_one({"_id": outbox_data["_id"]}, update_data)
+    return response.get("success", False)
+
+
+async def DrainWhatsappOutbox(db, limit: int = WHATSAPP_OUTBOX_BATCH_SIZE):
+    whatsapp_gateway = await GetCurrentWhatsappGateway(db)
+    delivered = 0
+    while delivered < limit:
+        outbox_data = await ClaimWhatsappOutboxMessage(db)
+        if not outbox_data:
+            break
+
+        await AcquireWhatsappToken(whatsapp_gateway)
+        await DeliverWhatsappOutboxMessage(db, outbox_data, whatsapp_gateway)
+        delivered += 1
+
+    return delivered
+
+
+async def WhatsappOutboxWorkerLoop():
+    db = await GetAmretaDatabase()
+    await EnsureWhatsappOutboxIndex(db)
+    while True:
+        delivered = 0
+        try:
+            delivered = await DrainWhatsappOutbox(db)
+        except Exception as e:
+            print(str(e))
+
+        if delivered == 0:
+            await asyncio.sleep(WHATSAPP_OUTBOX_POLL_SECONDS)
+
+
+async def StartWhatsappOutboxWorker():
+    WHATSAPP_OUTBOX_WORKER["task"] = asyncio.create_task(WhatsappOutboxWorkerLoop())
+
+
+async def StopWhatsappOutboxWorker():
+    task = WHATSAPP_OUTBOX_WORKER["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    # release the message that was being sent so the next worker retries it
+    db = await GetAmretaDatabase()
+    await db.whatsapp_outbox.update_many(
+        {
+            "status": WhatsappOutboxStatusData.SENDING.value,
+            "locked_by": JOB_WORKER_ID,
+        },
+        {
+            "$set": {
+                "status": WhatsappOutboxStatusData.PENDING.value,
+                "next_attempt_at": GetCurrentDateTime(),
+            },
+            "$unset": {"locked_by": "", "locked_until": ""},
+        },
+    )
@@ -18,6 +18,7 @@ from app.routes.v1 import (
     information_routes,
     user_routes,
     invoice_routes,
+    job_routes,
     payment_routes,
     income_routes,
     expenditure_routes,
@@ -42,6 +43,7 @@ router.include_router(inventory_routes.router)
 router.include_router(invoice_routes.router)
 router.include_router(income_routes.router)
 router.include_router(information_routes.router)
+router.include_router(job_routes.router)
 router.include_router(mikrotik_routes.router)
 router.include_router(notification_routes.router)
 router.include_router(odc_routes.router)
@@ -19,6 +19,7 @@ from app.modules.crud_operations import (
     GetAggregateData,
     GetManyData,
     GetOneData,
+    InvalidateDataCount,
     UpdateOneData,
 )
 from app.modules.whatsapp_message import (
@@ -333,6 +334,7 @@ async def pay_off_bill(
         {"_id": invoice_id},
         {"$set": update_data}
     )
+    InvalidateDataCount(db.invoices)
 
     if result.modified_count == 0:
         print(f"Invoice {invoice_id} already has the same status or amount.")
@@ -349,6 +351,7 @@ async def pay_off_bill(
         "created_at": GetCurrentDateTime(),
     }
     await db.incomes.update_one({"id_invoice": invoice_id}, {"$set": income_data}, upsert=True)
+    InvalidateDataCount(db.incomes)
 
     customer_data = await GetOneData(db.customers, {"_id": ObjectId(invoice_data["id_customer"])})
     if customer_data:
@@ -357,6 +360,7 @@ async def pay_off_bill(
                 {"_id": ObjectId(invoice_data["id_customer"])},
                 {"$set": {"status": CustomerStatusData.ACTIVE.value}}
             )
+            InvalidateDataCount(db.customers)
             await ActivateMikrotikPPPSecret(db, customer_data, False)
 
         await CheckMitraFee(db, customer_data, id)
@@ -428,6 +432,7 @@ async def mark_bill_as_collected(
         }
 
         result = await db.invoices.update_one({"_id": invoice["_id"]}, update_data)
+        InvalidateDataCount(db.invoices)
         if result.modified_count > 0:
             modified_count += 1
 
@@ -535,6 +540,7 @@ async def mark_bill_as_approved(
         }
 
         result = await db.invoices.update_one({"_id": invoice["_id"]}, update_data)
+        InvalidateDataCount(db.invoices)
         if result.modified_count > 0:
             modified_count += 1
 
@@ -584,6 +590,9 @@ async def auto_repeat_collector_status(
         await db.invoices.update_one({"_id": invoice["_id"]}, update_data)
         updated_count += 1
 
+    if updated_count > 0:
+        InvalidateDataCount(db.invoices)
+
     return {
         "message": "Repeat monthly collector status updated.",
         "updated_count": updated_count,
@@ -612,6 +621,7 @@ async def delete_invoice_collector_data(
     result = await db.invoices.update_many(
         {"_id": {"$in": id_list}}, {"$unset": {"collector": ""}}
     )
+    InvalidateDataCount(db.invoices)
 
     if result.modified_count == 0:
         raise HTTPException(
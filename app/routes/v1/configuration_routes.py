@@ -11,6 +11,7 @@ from app.models.users import UserData
 from app.modules.crud_operations import GetOneData, UpdateOneData
 from app.modules.database import AsyncIOMotorClient, GetAmretaDatabase
 from app.modules.generals import GetCurrentDateTime
+from app.modules.message_template import InvalidateWhatsappTemplateCache
 from app.modules.response_message import (
     DATA_HAS_UPDATED_MESSAGE,
     SYSTEM_ERROR_MESSAGE,
@@ -101,4 +102,5 @@ async def update_whatsapp_bot(
     if not result:
         raise HTTPException(status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE})
 
+    InvalidateWhatsappTemplateCache()
     return JSONResponse(content={"message": DATA_HAS_UPDATED_MESSAGE})
@@ -14,12 +14,15 @@ from app.models.notifications import NotificationTypeData
 from app.models.generals import Pagination, SortingDirection
 from app.models.tickets import TicketStatusData, TicketTypeData
 from app.models.users import UserData, UserRole
+from app.modules.bson_response import BSONJSONResponse
 from app.modules.geodistances import GetNearestODP
 from app.modules.crud_operations import (
     CreateOneData,
     DeleteOneData,
     GetAggregateData,
     GetManyData,
+    GetManyDataByCursor,
+    GetManyDataCachedCount,
     GetOneData,
     UpdateManyData,
     UpdateOneData,
@@ -88,10 +91,14 @@ async def get_customers(
     items: int = 10,
     sort_key: CustomerSortingsData = CustomerSortingsData.SERVICE_NUMBER.value,
     sort_direction: SortingDirection = SortingDirection.ASC.value,
+    cursor: str = None,
+    with_count: bool = True,
     current_user: UserData = Depends(GetCurrentUser),
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
     pipeline = []
+    odp_pipeline = []
+    lookup_pipeline = []
     query = {}
     if key:
         query["$or"] = [
@@ -119,7 +126,7 @@ async def get_customers(
     pipeline.append({"$match": query})
 
     # add join id odp query
-    pipeline.append(
+    odp_pipeline.append(
         {
             "$lookup": {
                 "from": "odp",
@@ -132,7 +139,7 @@ async def get_customers(
             }
         }
     )
-    pipeline.append(
+    odp_pipeline.append(
         {
             "$addFields": {
                 "odp_name": {"$ifNull": [{"$arrayElemAt": ["$odp.name", 0]}, None]}
@@ -141,7 +148,7 @@ async def get_customers(
     )
 
     # add join id package query
-    pipeline.append(
+    lookup_pipeline.append(
         {
             "$lookup": {
                 "from": "packages",
@@ -154,7 +161,7 @@ async def get_customers(
             }
         }
     )
-    pipeline.append(
+    lookup_pipeline.append(
         {
             "$addFields": {
                 "package_billing": {
@@ -165,7 +172,7 @@ async def get_customers(
     )
 
     # add join id add-on package query
-    pipeline.append(
+    lookup_pipeline.append(
         {
             "$lookup": {
                 "from": "packages",
@@ -183,7 +190,7 @@ async def get_customers(
             }
         }
     )
-    pipeline.append(
+    lookup_pipeline.append(
         {
             "$addFields": {
                 "add_on_billing": {
@@ -200,7 +207,7 @@ async def get_customers(
     )
 
     # counting package & add-on package price query
-    pipeline.append(
+    lookup_pipeline.append(
         {
             "$addFields": {
                 "billing": {"$add": ["$package_billing", "$add_on_billing"]}
@@ -208,11 +215,57 @@ async def get_customers(
         }
     )
 
-    pipeline.append({"$sort": {sort_key: 1 if sort_direction == "asc" else -1}})
-    customer_data, count = await GetManyData(
+    sort_value = 1 if sort_direction == "asc" else -1
+    if cursor is not None:
+        # keyset mode, an empty cursor is the first page. The joins run only
+        # for the page, except the odp join when the page is sorted by it
+        if sort_key == CustomerSortingsData.ODP_NAME:
+            pipeline += odp_pipeline
+        else:
+            lookup_pipeline = odp_pipeline + lookup_pipeline
+
+        try:
+            customer_data, count, next_cursor, is_count_exact = (
+                await GetManyDataByCursor(
+                    db.customers,
+                    pipeline,
+                    [(sort_key, sort_value)],
+                    cursor,
+                    items,
+                    lookup_pipeline,
+                    CustomerProjections,
+                    with_count=with_count,
+                )
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail={"message": "Cursor Tidak Valid!"}
+            )
+
+        pagination_info: Pagination = {
+            "items": items,
+            "count": count,
+            "is_count_exact": is_count_exact,
+            "next_cursor": next_cursor,
+        }
+        return JSONResponse(
+            content={
+                "customer_data": customer_data,
+                "pagination_info": pagination_info,
+            }
+        )
+
+    pipeline += odp_pipeline + lookup_pipeline
+    pipeline.append({"$sort": {sort_key: sort_value}})
+    customer_data, count, is_count_exact = await GetManyDataCachedCount(
         db.customers, pipeline, CustomerProjections, {"page": page, "items": items}
     )
-    pagination_info: Pagination = {"page": page, "items": items, "count": count}
+    pagination_info: Pagination = {
+        "page": page,
+        "items": items,
+        "count": count,
+        "is_count_exact": is_count_exact,
+    }
 
     return JSONResponse(
         content={
@@ -381,9 +434,9 @@ async def get_customer_maps(
     pipeline.append({"$match": query})
 
     customer_maps_data = await GetAggregateData(
-        db.customers, pipeline, CustomerProjections
+        db.customers, pipeline, CustomerProjections, is_json=False
     )
-    return JSONResponse(content={"customer_maps_data": customer_maps_data})
+    return BSONJSONResponse(content={"customer_maps_data": customer_maps_data})
 
 
 @router.get("/generate-service-number")
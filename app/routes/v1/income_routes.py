@@ -25,6 +25,8 @@ from app.modules.crud_operations import (
     DeleteOneData,
     GetAggregateData,
     GetManyData,
+    GetManyDataByCursor,
+    GetManyDataCachedCount,
     GetOneData,
     UpdateOneData,
 )
@@ -80,6 +82,8 @@ async def get_incomes(
     to_date: datetime = None,
     page: int = 1,
     items: int = 1,
+    cursor: str = None,
+    with_count: bool = True,
     current_user: UserData = Depends(GetCurrentUser),
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
@@ -100,9 +104,7 @@ async def get_incomes(
     if from_date and to_date:
         query["date"] = {"$gte": from_date, "$lte": to_date}
 
-    pipeline = [
-        {"$match": query},
-        {"$sort": {"date": -1}},
+    lookup_pipeline = [
         {
             "$lookup": {
                 "from": "users",
@@ -122,11 +124,46 @@ async def get_incomes(
             }
         },
     ]
+    if cursor is not None:
+        # keyset mode, an empty cursor is the first page
+        try:
+            income_data, count, next_cursor, is_count_exact = await GetManyDataByCursor(
+                db.incomes,
+                [{"$match": query}],
+                [("date", -1)],
+                cursor,
+                items,
+                lookup_pipeline,
+                with_count=with_count,
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail={"message": "Cursor Tidak Valid!"}
+            )
+
+        pagination_info: Pagination = {
+            "items": items,
+            "count": count,
+            "is_count_exact": is_count_exact,
+            "next_cursor": next_cursor,
+        }
+        return JSONResponse(
+            content={
+                "income_data": income_data,
+                "pagination_info": pagination_info,
+            }
+        )
 
-    income_data, count = await GetManyData(
+    pipeline = [{"$match": query}, {"$sort": {"date": -1}}, *lookup_pipeline]
+    income_data, count, is_count_exact = await GetManyDataCachedCount(
         db.incomes, pipeline, {}, {"page": page, "items": items}
     )
-    pagination_info: Pagination = {"page": page, "items": items, "count": count}
+    pagination_info: Pagination = {
+        "page": page,
+        "items": items,
+        "count": count,
+        "is_count_exact": is_count_exact,
+    }
     return JSONResponse(
         content={
             "income_data": income_data,
@@ -1,12 +1,12 @@
 import base64
 from calendar import monthrange
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+from datetime import timedelta
 from typing import Optional, List
 import asyncio
 from bson import ObjectId
 from fastapi import APIRouter, Body, Depends, HTTPException
 from fastapi.responses import JSONResponse, StreamingResponse
+from pymongo.errors import DuplicateKeyError
 from app.models.invoices import (
     InvoiceInsertData,
     InvoiceOwnerVerifiedStatusData,
@@ -14,6 +14,7 @@ from app.models.invoices import (
     InvoiceStatusData,
     InvoiceUpdateData,
 )
+from app.models.jobs import JobTypeData
 from app.models.payments import PaymentMethodData
 from app.models.generals import Pagination, SortingDirection
 from app.models.users import UserData, UserRole
@@ -22,14 +23,24 @@ from app.modules.crud_operations import (
     DeleteManyData,
     DeleteOneData,
     GetAggregateData,
+    GetDataCount,
     GetDistinctData,
-    GetManyData,
+    GetManyDataByCursor,
+    GetManyDataCachedCount,
     GetOneData,
     UpdateManyData,
     UpdateOneData,
 )
+from app.modules.invoice_generator import CreateInvoiceData, GenerateCustomerInvoices
+from app.modules.invoice_pricing import (
+    InvoiceCustomerProjections,
+    GetInvoiceLineItems,
+    GetPackagePriceTable,
+    PriceCustomerInvoices,
+)
+from app.modules.jobs import JOB_CHUNK_SIZE, CreateJob, RegisterJobHandler
 from app.modules.pdf import CreateInvoicePDF, CreateInvoiceThermal
-from app.modules.mikrotik import ActivateMikrotikPPPSecret
+from app.modules.mikrotik import ProvisionMikrotikPPPSecrets
 from app.modules.telegram_message import SendTelegramPaymentMessage
 from app.modules.whatsapp_message import (
     SendWhatsappCustomerActivatedMessage,
@@ -52,13 +63,6 @@ from app.modules.response_message import (
 )
 from app.routes.v1.auth_routes import GetCurrentUser
 from app.routes.v1.payment_routes import CheckMitraFee
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-PPN = int(os.getenv("PPN"))
-PAID_LEAVE_PERCENTAGE = int(os.getenv("PAID_LEAVE_PERCENTAGE"))
 
 
 async def CreateNewInvoice(db, payload: dict, is_send_whatsapp: bool = False):
@@ -75,160 +79,35 @@ async def CreateNewInvoice(db, payload: dict, is_send_whatsapp: bool = False):
     max_date_of_month = monthrange(
         GetCurrentDateTime().year, GetCurrentDateTime().month
     )[1]
-    pipeline = []
-    query = {"_id": ObjectId(payload["id_customer"])}
-
-    # add filter query
-    pipeline.append({"$match": query})
-
-    # add join id package query
-    pipeline.append(
-        {
-            "$lookup": {
-                "from": "packages",
-                "let": {"idPackage": "$id_package"},
-                "pipeline": [
-                    {"$match": {"$expr": {"$eq": ["$_id", "$$idPackage"]}}},
-                    {
-                        "$project": {
-                            "name": 1,
-                            "price": 1,
-                        }
-                    },
-                    {"$limit": 1},
-                ],
-                "as": "package",
-            }
-        }
-    )
-    pipeline.append(
-        {
-            "$addFields": {
-                "package_amount": {
-                    "$ifNull": [{"$arrayElemAt": ["$package.price.regular", 0]}, 0]
-                }
-            }
-        }
-    )
-
-    # add join id add-on package query
-    pipeline.append(
-        {
-            "$lookup": {
-                "from": "packages",
-                "let": {"idAddOnPackage": "$id_add_on_package"},
-                "pipeline": [
-                    {
-                        "$match": {
-                            "$expr": {
-                                "$in": ["$_id", {"$ifNull": ["$$idAddOnPackage", []]}]
-                            }
-                        }
-                    },
-                    {
-                        "$project": {
-                            "name": 1,
-                            "price": 1,
-                        }
-                    },
-                ],
-                "as": "add_on_packages",
-            }
-        }
+    customer_data = await GetAggregateData(
+        db.customers,
+        [{"$match": {"_id": ObjectId(payload["id_customer"])}}],
+        InvoiceCustomerProjections,
     )
-    pipeline.append(
-        {
-            "$addFields": {
-                "add_on_package_amount": {
-                    "$sum": {
-                        "$map": {
-                            "input": "$add_on_packages",
-                            "as": "add_on",
-                            "in": {"$ifNull": ["$$add_on.price.regular", 0]},
-                        }
-                    }
-                }
-            }
-        }
-    )
-
-    # counting package & add-on package price query
-    pipeline.append(
-        {
-            "$addFields": {
-                "amount": {"$add": ["$package_amount", "$add_on_package_amount"]}
-            },
-        }
-    )
-
-    # add projection query
-    pipeline.append(
-        {
-            "$project": {
-                "name": 1,
-                "service_number": 1,
-                "due_date": 1,
-                "ppn": 1,
-                "package": 1,
-                "package_amount": 1,
-                "add_on_packages": 1,
-                "add_on_package_amount": 1,
-                "amount": 1,
-                "status": 1,
-                "unique_code": 1,
-            }
-        }
-    )
-
-    customer_data = await GetAggregateData(db.customers, pipeline)
     if len(customer_data) == 0:
         raise HTTPException(status_code=404, detail={"message": NOT_FOUND_MESSAGE})
 
+    price_table = await GetPackagePriceTable(db)
+    invoice_line_items = PriceCustomerInvoices(customer_data, price_table)
+
     invoice_exist = 0
     invoice_created = 0
     invoice_ids = []
-    for customer in customer_data:
+    for customer, line_items in zip(customer_data, invoice_line_items):
         customer_due_date = customer.get("due_date")
         if int(customer_due_date) > max_date_of_month:
             customer_due_date = str(max_date_of_month).zfill(2)
 
-        unique_code = customer.get("unique_code", 1)
-        ppn = 0
-        paid_leave_discount = 0
-        if customer.get("ppn", 0):
-            ppn = customer["amount"] * (PPN / 100)
-
-        if customer["status"] == CustomerStatusData.PAID_LEAVE.value:
-            paid_leave_discount = customer["amount"] * (
-                (100 - PAID_LEAVE_PERCENTAGE) / 100
-            )
-            customer["amount"] = customer["amount"] - paid_leave_discount
-
-        final_amount = customer["amount"] + ppn + unique_code
-        invoice_data = {
-            "id_customer": ObjectId(customer["_id"]),
-            "name": customer["name"],
-            "service_number": customer["service_number"],
-            "package": customer["package"],
-            "due_date": datetime.strptime(
-                f"{payload['year']}-{payload['month']}-{customer_due_date} 23:59:59",
-                "%Y-%m-%d %H:%M:%S",
-            ),
-            "add_on_packages": customer["add_on_packages"],
-            "month": payload["month"],
-            "year": payload["year"],
-            "status": "UNPAID",
-            "package_amount": customer["package_amount"],
-            "add_on_package_amount": customer["add_on_package_amount"],
-            "ppn": ppn,
-            "unique_code": unique_code,
-            "amount": final_amount,
-            "created_at": GetCurrentDateTime(),
-        }
-        if paid_leave_discount:
-            invoice_data["paid_leave_discount"] = paid_leave_discount
+        invoice_data = CreateInvoiceData(
+            customer, line_items, payload["month"], payload["year"], customer_due_date
+        )
+        try:
+            invoice_result = await CreateOneData(db.invoices, invoice_data)
+        except DuplicateKeyError:
+            # created concurrently after the check above, the unique period
+            # index keeps one invoice per service number, month and year
+            raise HTTPException(status_code=400, detail={"message": EXIST_DATA_MESSAGE})
 
-        invoice_result = await CreateOneData(db.invoices, invoice_data)
         if not invoice_result.inserted_id:
             raise HTTPException(
                 status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE}
@@ -248,6 +127,163 @@ async def CreateNewInvoice(db, payload: dict, is_send_whatsapp: bool = False):
     )
 
 
+def GetInvoiceGenerateQuery(current_month_dates: list, next_month_dates: list):
+    query = {
+        "status": {
+            "$in": [
+                CustomerStatusData.ACTIVE.value,
+                CustomerStatusData.PAID_LEAVE.value,
+            ]
+        },
+        "$or": [
+            {
+                "due_date": {"$in": current_month_dates},
+            },
+            {
+                "due_date": {"$in": next_month_dates},
+            },
+        ],
+    }
+    return query
+
+
+@RegisterJobHandler(JobTypeData.INVOICE_GENERATE.value)
+async def GenerateInvoiceJobHandler(db, job: dict):
+    params = job["params"]
+    chunk = {}
+    query = GetInvoiceGenerateQuery(
+        params["current_month_dates"], params["next_month_dates"]
+    )
+    if job.get("checkpoint"):
+        query = {"$and": [query, {"_id": {"$gt": ObjectId(job["checkpoint"])}}]}
+    else:
+        chunk["total"] = await GetDataCount(db.customers, query)
+
+    result = await GenerateCustomerInvoices(
+        db,
+        query,
+        params["next_month_dates"],
+        params["current_date"],
+        JOB_CHUNK_SIZE,
+    )
+    # enqueued before the checkpoint moves, a resumed chunk is deduped by
+    # the outbox key and the sent flag
+    if params.get("is_send_whatsapp") and len(result["invoice_ids"]) > 0:
+        await SendWhatsappPaymentCreatedMessage(db, result["invoice_ids"], True)
+
+    chunk.update(
+        {
+            "checkpoint": result["id_last_customer"] or job.get("checkpoint"),
+            "processed": result["customer_count"],
+            "is_done": result["customer_count"] < JOB_CHUNK_SIZE,
+            "result": {
+                "invoice_exist": result["invoice_exist"],
+                "invoice_created": result["invoice_created"],
+                "timings": result["timings"],
+            },
+        }
+    )
+    return chunk
+
+
+async def GetInvoiceCustomerData(db, pipeline: list):
+    invoice_data = await GetAggregateData(db.invoices, pipeline)
+    customer_ids = {ObjectId(item["id_customer"]) for item in invoice_data}
+    customer_data = await GetAggregateData(
+        db.customers, [{"$match": {"_id": {"$in": list(customer_ids)}}}]
+    )
+    return invoice_data, {item["_id"]: item for item in customer_data}
+
+
+async def SetCustomerProvisionStatus(db, customers: list, status: str):
+    # the router is provisioned per batch, grouped by id_router
+    if len(customers) == 0:
+        return {"routers": {}, "failed": []}
+
+    await UpdateManyData(
+        db.customers,
+        {"_id": {"$in": [ObjectId(item["_id"]) for item in customers]}},
+        {"$set": {"status": status}},
+    )
+    return await ProvisionMikrotikPPPSecrets(
+        db, customers, status == CustomerStatusData.ISOLIR.value
+    )
+
+
+@RegisterJobHandler(JobTypeData.CUSTOMER_ISOLIR.value)
+async def IsolirCustomerJobHandler(db, job: dict):
+    params = job["params"]
+    chunk = {}
+    invoice_ids = []
+    customers = {}
+    if params.get("invoice_ids"):
+        start = job.get("checkpoint") or 0
+        if start == 0:
+            chunk["total"] = len(params["invoice_ids"])
+
+        invoice_ids = params["invoice_ids"][start : start + JOB_CHUNK_SIZE]
+        invoice_data, customer_data = await GetInvoiceCustomerData(
+            db,
+            [{"$match": {"_id": {"$in": [ObjectId(id) for id in invoice_ids]}}}],
+        )
+        for invoice in invoice_data:
+            if invoice["id_customer"] in customer_data:
+                customers[invoice["id_customer"]] = customer_data[
+                    invoice["id_customer"]
+                ]
+
+        chunk["checkpoint"] = start + len(invoice_ids)
+        chunk["processed"] = len(invoice_ids)
+        chunk["is_done"] = chunk["checkpoint"] >= len(params["invoice_ids"])
+    else:
+        query = {
+            "status": InvoiceStatusData.UNPAID.value,
+            "due_date": {"$lt": params["due_date"]},
+            "is_whatsapp_isolir_sended": {"$exists": False},
+        }
+        if job.get("checkpoint"):
+            query["_id"] = {"$gt": ObjectId(job["checkpoint"])}
+        else:
+            chunk["total"] = await GetDataCount(db.invoices, query)
+
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"_id": 1}},
+            {"$limit": JOB_CHUNK_SIZE},
+        ]
+        invoice_data, customer_data = await GetInvoiceCustomerData(db, pipeline)
+        for invoice in invoice_data:
+            customer = customer_data.get(invoice["id_customer"])
+            if not customer or invoice["id_customer"] in customers:
+                continue
+
+            if customer.get("status") != CustomerStatusData.ISOLIR.value:
+                customers[invoice["id_customer"]] = customer
+                invoice_ids.append(invoice["_id"])
+
+        chunk["checkpoint"] = (
+            invoice_data[-1]["_id"] if invoice_data else job.get("checkpoint")
+        )
+        chunk["processed"] = len(invoice_data)
+        chunk["is_done"] = len(invoice_data) < JOB_CHUNK_SIZE
+
+    provision_result = await SetCustomerProvisionStatus(
+        db, list(customers.values()), CustomerStatusData.ISOLIR.value
+    )
+    if len(invoice_ids) > 0:
+        await SendWhatsappIsolirMessage(db, invoice_ids, True)
+
+    chunk["result"] = {
+        "customer_isolated": len(customers),
+        "provision_failed": len(provision_result["failed"]),
+        "provision_seconds": {
+            id_router: router["seconds"]
+            for id_router, router in provision_result["routers"].items()
+        },
+    }
+    return chunk
+
+
 router = APIRouter(prefix="/invoice", tags=["Invoice"])
 
 
@@ -263,6 +299,8 @@ async def get_invoice(
     items: int = 1,
     sort_key: InvoiceSortingsData = InvoiceSortingsData.DUE_DATE.value,
     sort_direction: SortingDirection = SortingDirection.ASC.value,
+    cursor: str = None,
+    with_count: bool = True,
     current_user: UserData = Depends(GetCurrentUser),
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
@@ -292,8 +330,7 @@ async def get_invoice(
     if owner_verified_status is not None:
         query["owner_verified_status"] = owner_verified_status
 
-    pipeline = [
-        {"$match": query},
+    lookup_pipeline = [
         {
             "$lookup": {
                 "from": "customers",
@@ -312,13 +349,54 @@ async def get_invoice(
             }
         },
         {"$unwind": "$customer"},
-        {"$sort": {sort_key: 1 if sort_direction == "asc" else -1}},
     ]
+    sort_value = 1 if sort_direction == "asc" else -1
+    if cursor is not None:
+        # keyset mode, an empty cursor is the first page
+        try:
+            invoice_data, count, next_cursor, is_count_exact = (
+                await GetManyDataByCursor(
+                    db.invoices,
+                    [{"$match": query}],
+                    [(sort_key, sort_value)],
+                    cursor,
+                    items,
+                    lookup_pipeline,
+                    with_count=with_count,
+                )
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail={"message": "Cursor Tidak Valid!"}
+            )
+
+        pagination_info: Pagination = {
+            "items": items,
+            "count": count,
+            "is_count_exact": is_count_exact,
+            "next_cursor": next_cursor,
+        }
+        return JSONResponse(
+            content={
+                "invoice_data": invoice_data,
+                "pagination_info": pagination_info,
+            }
+        )
 
-    invoice_data, count = await GetManyData(
+    pipeline = [
+        {"$match": query},
+        *lookup_pipeline,
+        {"$sort": {sort_key: sort_value}},
+    ]
+    invoice_data, count, is_count_exact = await GetManyDataCachedCount(
         db.invoices, pipeline, {}, {"page": page, "items": items}
     )
-    pagination_info: Pagination = {"page": page, "items": items, "count": count}
+    pagination_info: Pagination = {
+        "page": page,
+        "items": items,
+        "count": count,
+        "is_count_exact": is_count_exact,
+    }
     return JSONResponse(
         content={
             "invoice_data": invoice_data,
@@ -354,218 +432,19 @@ async def generate_invoice(
     is_send_whatsapp: bool = False,
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
-    pipeline = []
-    max_date_of_month = monthrange(
-        GetCurrentDateTime().year, GetCurrentDateTime().month
-    )[1]
     current_month_dates, next_month_dates = GetDueDateRange(10)
-    query = {
-        "status": {
-            "$in": [
-                CustomerStatusData.ACTIVE.value,
-                CustomerStatusData.PAID_LEAVE.value,
-            ]
-        },
-        "$or": [
-            {
-                "due_date": {"$in": current_month_dates},
-            },
-            {
-                "due_date": {"$in": next_month_dates},
-            },
-        ],
-    }
-
-    # add filter query
-    pipeline.append({"$match": query})
-
-    # add join id package query
-    pipeline.append(
-        {
-            "$lookup": {
-                "from": "packages",
-                "let": {"idPackage": "$id_package"},
-                "pipeline": [
-                    {"$match": {"$expr": {"$eq": ["$_id", "$$idPackage"]}}},
-                    {
-                        "$project": {
-                            "name": 1,
-                            "price": 1,
-                        }
-                    },
-                    {"$limit": 1},
-                ],
-                "as": "package",
-            }
-        }
-    )
-    pipeline.append(
-        {
-            "$addFields": {
-                "package_amount": {
-                    "$ifNull": [{"$arrayElemAt": ["$package.price.regular", 0]}, 0]
-                }
-            }
-        }
-    )
-
-    # add join id add-on package query
-    pipeline.append(
-        {
-            "$lookup": {
-                "from": "packages",
-                "let": {"idAddOnPackage": "$id_add_on_package"},
-                "pipeline": [
-                    {
-                        "$match": {
-                            "$expr": {
-                                "$in": ["$_id", {"$ifNull": ["$$idAddOnPackage", []]}]
-                            }
-                        }
-                    },
-                    {
-                        "$project": {
-                            "name": 1,
-                            "price": 1,
-                        }
-                    },
-                ],
-                "as": "add_on_packages",
-            }
-        }
-    )
-    pipeline.append(
-        {
-            "$addFields": {
-                "add_on_package_amount": {
-                    "$sum": {
-                        "$map": {
-                            "input": "$add_on_packages",
-                            "as": "add_on",
-                            "in": {"$ifNull": ["$$add_on.price.regular", 0]},
-                        }
-                    }
-                }
-            }
-        }
-    )
-
-    # counting package & add-on package price query
-    pipeline.append(
-        {
-            "$addFields": {
-                "amount": {"$add": ["$package_amount", "$add_on_package_amount"]}
-            },
-        }
-    )
-
-    # add projection query
-    pipeline.append(
+    id_job = await CreateJob(
+        db,
+        JobTypeData.INVOICE_GENERATE.value,
         {
-            "$project": {
-                "name": 1,
-                "service_number": 1,
-                "due_date": 1,
-                "ppn": 1,
-                "package": 1,
-                "package_amount": 1,
-                "add_on_packages": 1,
-                "add_on_package_amount": 1,
-                "amount": 1,
-                "status": 1,
-                "unique_code": 1,
-            }
-        }
+            "current_month_dates": current_month_dates,
+            "next_month_dates": next_month_dates,
+            "current_date": GetCurrentDateTime(),
+            "is_send_whatsapp": is_send_whatsapp,
+        },
     )
-
-    customer_data = await GetAggregateData(db.customers, pipeline)
-    if len(customer_data) == 0:
-        return
-
-    invoice_ids = []
-    invoice_exist = 0
-    invoice_created = 0
-    current_date = GetCurrentDateTime()
-    next_month = current_date + relativedelta(months=1)
-    for customer in customer_data:
-        try:
-            customer_due_date = customer.get("due_date")
-            if int(customer_due_date) > max_date_of_month:
-                customer_due_date = str(max_date_of_month).zfill(2)
-            target_month = current_date.strftime("%m")
-            target_year = current_date.strftime("%Y")
-            if customer_due_date in next_month_dates:
-                target_month = next_month.strftime("%m")
-                target_year = next_month.strftime("%Y")
-
-            query = {
-                "service_number": customer["service_number"],
-                "month": target_month,
-                "year": target_year,
-            }
-            exist_invoice = await GetOneData(db.invoices, query)
-            if exist_invoice:
-                invoice_exist += 1
-                continue
-
-            unique_code = customer.get("unique_code", 1)
-            ppn = 0
-            paid_leave_discount = 0
-            if customer.get("ppn", 0):
-                ppn = customer["amount"] * (PPN / 100)
-
-            if customer["status"] == CustomerStatusData.PAID_LEAVE.value:
-                paid_leave_discount = customer["amount"] * (
-                    (100 - PAID_LEAVE_PERCENTAGE) / 100
-                )
-                customer["amount"] = customer["amount"] - paid_leave_discount
-
-            final_amount = customer["amount"] + ppn + unique_code
-            invoice_data = {
-                "id_customer": ObjectId(customer["_id"]),
-                "name": customer["name"],
-                "service_number": customer["service_number"],
-                "package": customer["package"],
-                "due_date": datetime.strptime(
-                    f"{target_year}-{target_month}-{customer_due_date} 23:59:59",
-                    "%Y-%m-%d %H:%M:%S",
-                ),
-                "add_on_packages": customer["add_on_packages"],
-                "month": target_month,
-                "year": target_year,
-                "status": "UNPAID",
-                "package_amount": customer["package_amount"],
-                "add_on_package_amount": customer["add_on_package_amount"],
-                "ppn": ppn,
-                "unique_code": unique_code,
-                "amount": final_amount,
-                "created_at": GetCurrentDateTime(),
-            }
-            if paid_leave_discount:
-                invoice_data["paid_leave_discount"] = paid_leave_discount
-
-            invoice_result = await CreateOneData(db.invoices, invoice_data)
-            if not invoice_result.inserted_id:
-                raise HTTPException(
-                    status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE}
-                )
-
-            if is_send_whatsapp:
-                invoice_ids.append(str(invoice_result.inserted_id))
-
-            invoice_created += 1
-        except Exception as e:
-            print(str(e))
-            continue
-
-    if len(invoice_ids) > 0:
-        asyncio.create_task(SendWhatsappPaymentCreatedMessage(db, invoice_ids))
-
     return JSONResponse(
-        content={
-            "invoice_exist": invoice_exist,
-            "invoice_created": invoice_created,
-        }
+        content={"message": "Tagihan Sedang Dalam Proses Pembuatan!", "id_job": id_job}
     )
 
 
@@ -756,58 +635,15 @@ async def isolir_customer(
     id: str = None,
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
-    invoice_ids = []
+    params = {"due_date": GetCurrentDateTime()}
     if id:
         decoded_id = base64.b64decode(id).decode("utf-8")
-        invoice_ids = [item.strip() for item in decoded_id.split(",")]
-        for id in invoice_ids:
-            invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id)})
-            if not invoice_data:
-                continue
-
-            customer_data = await GetOneData(
-                db.customers, {"_id": ObjectId(invoice_data["id_customer"])}
-            )
-            if not customer_data:
-                continue
-
-            await UpdateOneData(
-                db.customers,
-                {"_id": ObjectId(invoice_data["id_customer"])},
-                {"$set": {"status": CustomerStatusData.ISOLIR.value}},
-            )
-            await ActivateMikrotikPPPSecret(db, customer_data, True)
-    else:
-        pipeline = [
-            {
-                "$match": {
-                    "status": InvoiceStatusData.UNPAID.value,
-                    "due_date": {"$lt": GetCurrentDateTime()},
-                    "is_whatsapp_isolir_sended": {"$exists": False},
-                }
-            }
-        ]
-        invoice_data = await GetAggregateData(db.invoices, pipeline)
-        for invoice in invoice_data:
-            customer_data = await GetOneData(
-                db.customers, {"_id": ObjectId(invoice["id_customer"])}
-            )
-            if not customer_data:
-                continue
+        params["invoice_ids"] = [item.strip() for item in decoded_id.split(",")]
 
-            if customer_data.get("status") != CustomerStatusData.ISOLIR.value:
-                await UpdateOneData(
-                    db.customers,
-                    {"_id": ObjectId(invoice["id_customer"])},
-                    {"$set": {"status": CustomerStatusData.ISOLIR.value}},
-                )
-                await ActivateMikrotikPPPSecret(db, customer_data, True)
-                invoice_ids.append(invoice["_id"])
-
-    if len(invoice_ids) > 0:
-        asyncio.create_task(SendWhatsappIsolirMessage(db, invoice_ids))
-
-    return JSONResponse(content={"message": "Pengguna Telah Diisolir!"})
+    id_job = await CreateJob(db, JobTypeData.CUSTOMER_ISOLIR.value, params)
+    return JSONResponse(
+        content={"message": "Pengguna Sedang Dalam Proses Isolir!", "id_job": id_job}
+    )
 
 
 @router.get("/activate-customer")
@@ -816,27 +652,20 @@ async def activate_customer(
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
     decoded_id = base64.b64decode(id).decode("utf-8")
-    id_list = [item.strip() for item in decoded_id.split(",")]
-    for id in id_list:
-        invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id)})
-        if not invoice_data:
-            continue
-
-        customer_data = await GetOneData(
-            db.customers, {"_id": ObjectId(invoice_data["id_customer"])}
-        )
-        if not customer_data:
-            continue
-
-        await UpdateOneData(
-            db.customers,
-            {"_id": ObjectId(invoice_data["id_customer"])},
-            {"$set": {"status": CustomerStatusData.ACTIVE.value}},
-        )
-        await ActivateMikrotikPPPSecret(db, customer_data, False)
-        asyncio.create_task(
-            SendWhatsappCustomerActivatedMessage(db, invoice_data["id_customer"])
-        )
+    id_list = [ObjectId(item.strip()) for item in decoded_id.split(",")]
+    invoice_data, customer_data = await GetInvoiceCustomerData(
+        db, [{"$match": {"_id": {"$in": id_list}}}]
+    )
+    customers = {
+        invoice["id_customer"]: customer_data[invoice["id_customer"]]
+        for invoice in invoice_data
+        if invoice["id_customer"] in customer_data
+    }
+    await SetCustomerProvisionStatus(
+        db, list(customers.values()), CustomerStatusData.ACTIVE.value
+    )
+    for id_customer in customers.keys():
+        asyncio.create_task(SendWhatsappCustomerActivatedMessage(db, id_customer))
 
     return JSONResponse(content={"message": "Pengguna Telah Diaktifkan!"})
 
@@ -879,138 +708,48 @@ async def update_invoice(
                 status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE}
             )
 
-        pipeline = []
-        query = {"_id": ObjectId(payload["id_customer"])}
-        # add filter query
-        pipeline.append({"$match": query})
-
-        # add join id package query
-        pipeline.append(
-            {
-                "$lookup": {
-                    "from": "packages",
-                    "let": {"idPackage": "$id_package"},
-                    "pipeline": [
-                        {"$match": {"$expr": {"$eq": ["$_id", "$$idPackage"]}}},
-                        {
-                            "$project": {
-                                "name": 1,
-                                "price": 1,
-                            }
-                        },
-                        {"$limit": 1},
-                    ],
-                    "as": "package",
-                }
-            }
-        )
-        pipeline.append(
-            {
-                "$addFields": {
-                    "package_amount": {
-                        "$ifNull": [{"$arrayElemAt": ["$package.price.regular", 0]}, 0]
-                    }
-                }
-            }
-        )
-
-        # add join id add-on package query
-        pipeline.append(
-            {
-                "$lookup": {
-                    "from": "packages",
-                    "let": {"idAddOnPackage": "$id_add_on_package"},
-                    "pipeline": [
-                        {
-                            "$match": {
-                                "$expr": {
-                                    "$in": [
-                                        "$_id",
-                                        {"$ifNull": ["$$idAddOnPackage", []]},
-                                    ]
-                                }
-                            }
-                        },
-                        {
-                            "$project": {
-                                "name": 1,
-                                "price": 1,
-                            }
-                        },
-                    ],
-                    "as": "add_on_packages",
-                }
-            }
+        customer_data = await GetAggregateData(
+            db.customers,
+            [{"$match": {"_id": ObjectId(payload["id_customer"])}}],
+            InvoiceCustomerProjections,
         )
-        pipeline.append(
-            {
-                "$addFields": {
-                    "add_on_package_amount": {
-                        "$sum": {
-                            "$map": {
-                                "input": "$add_on_packages",
-                                "as": "add_on",
-                                "in": {"$ifNull": ["$$add_on.price.regular", 0]},
-                            }
-                        }
-                    }
-                }
-            }
+        if len(customer_data) == 0:
+            raise HTTPException(status_code=404, detail={"message": NOT_FOUND_MESSAGE})
+
+        # priced like a generated invoice, only the unique code is kept
+        price_table = await GetPackagePriceTable(db)
+        line_items = GetInvoiceLineItems(
+            {**customer_data[0], "unique_code": invoice_data["unique_code"]},
+            price_table,
         )
-
-        # counting package & add-on package price query
-        pipeline.append(
-            {
-                "$addFields": {
-                    "amount": {"$add": ["$package_amount", "$add_on_package_amount"]}
-                },
+        invoice_update_data = {
+            "$set": {
+                "package": line_items["package"],
+                "add_on_packages": line_items["add_on_packages"],
+                "package_amount": line_items["package_amount"],
+                "add_on_package_amount": line_items["add_on_package_amount"],
+                "ppn": line_items["ppn"],
+                "amount": line_items["amount"],
             }
-        )
+        }
+        if line_items["paid_leave_discount"]:
+            invoice_update_data["$set"]["paid_leave_discount"] = line_items[
+                "paid_leave_discount"
+            ]
+        else:
+            invoice_update_data["$unset"] = {"paid_leave_discount": ""}
 
-        # add projection query
-        pipeline.append(
-            {
-                "$project": {
-                    "name": 1,
-                    "service_number": 1,
-                    "due_date": 1,
-                    "ppn": 1,
-                    "package": 1,
-                    "package_amount": 1,
-                    "add_on_packages": 1,
-                    "add_on_package_amount": 1,
-                    "amount": 1,
-                    "unique_code": 1,
-                }
-            }
+        invoice_result = await UpdateOneData(
+            db.invoices,
+            {"_id": ObjectId(payload["id_invoice"])},
+            invoice_update_data,
         )
-
-        customer_data, _ = await GetManyData(db.customers, pipeline)
-        for customer in customer_data:
-            ppn = 0
-            if customer.get("ppn", 0):
-                ppn = customer["amount"] * (PPN / 100)
-            final_amount = customer["amount"] + ppn + invoice_data["unique_code"]
-            invoice_update_data = {
-                "package": customer["package"],
-                "add_on_packages": customer["add_on_packages"],
-                "package_amount": customer["package_amount"],
-                "add_on_package_amount": customer["add_on_package_amount"],
-                "ppn": ppn,
-                "amount": final_amount,
-            }
-
-            invoice_result = await UpdateOneData(
-                db.invoices,
-                {"_id": ObjectId(payload["id_invoice"])},
-                {"$set": invoice_update_data},
+        if not invoice_result:
+            raise HTTPException(
+                status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE}
             )
-            if not invoice_result:
-                raise HTTPException(
-                    status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE}
-                )
 
-            return JSONResponse(content={"message": DATA_HAS_UPDATED_MESSAGE})
+        return JSONResponse(content={"message": DATA_HAS_UPDATED_MESSAGE})
     except HTTPException as http_err:
         raise http_err
     except Exception as e:
@@ -1070,22 +809,23 @@ async def update_invoice_status(
     if status == InvoiceStatusData.PAID.value:
         for id in invoice_ids:
             asyncio.create_task(SendTelegramPaymentMessage(db, id))
-            invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id)})
-            if invoice_data:
-                customer_data = await GetOneData(
-                    db.customers, {"_id": ObjectId(invoice_data["id_customer"])}
+
+        invoice_data, customer_data = await GetInvoiceCustomerData(
+            db, [{"$match": {"_id": {"$in": invoice_ids}}}]
+        )
+        inactive_customers = {
+            item["_id"]: item
+            for item in customer_data.values()
+            if item.get("status", None) != CustomerStatusData.ACTIVE
+        }
+        await SetCustomerProvisionStatus(
+            db, list(inactive_customers.values()), CustomerStatusData.ACTIVE.value
+        )
+        for invoice in invoice_data:
+            if invoice["id_customer"] in customer_data:
+                await CheckMitraFee(
+                    db, customer_data[invoice["id_customer"]], invoice["_id"]
                 )
-                if customer_data:
-                    status = customer_data.get("status", None)
-                    if status != CustomerStatusData.ACTIVE and CustomerStatusData.FREE:
-                        await UpdateOneData(
-                            db.customers,
-                            {"_id": ObjectId(invoice_data["id_customer"])},
-                            {"$set": {"status": CustomerStatusData.ACTIVE.value}},
-                        )
-                        await ActivateMikrotikPPPSecret(db, customer_data, False)
-
-                    await CheckMitraFee(db, customer_data, id)
 
     if len(invoice_ids) > 0:
         asyncio.create_task(SendWhatsappPaymentSuccessMessage(db, invoice_ids))
@@ -0,0 +1,76 @@
+from bson import ObjectId
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+)
+from fastapi.responses import JSONResponse
+from app.models.jobs import JobProjections, JobStatusData, JobTypeData
+from app.models.users import UserData, UserRole
+from app.models.generals import Pagination
+from app.routes.v1.auth_routes import GetCurrentUser
+from app.modules.crud_operations import GetManyData
+from app.modules.jobs import GetJobDetail, GetJobProgress
+from app.modules.database import AsyncIOMotorClient, GetAmretaDatabase
+from app.modules.response_message import (
+    FORBIDDEN_ACCESS_MESSAGE,
+    NOT_FOUND_MESSAGE,
+)
+
+router = APIRouter(prefix="/job", tags=["Jobs"])
+
+
+@router.get("")
+async def get_jobs(
+    type: JobTypeData = None,
+    status: JobStatusData = None,
+    page: int = 1,
+    items: int = 10,
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+    query = {}
+    if type:
+        query["type"] = type.value
+    if status:
+        query["status"] = status.value
+
+    pipeline = [{"$match": query}, {"$sort": {"created_at": -1}}]
+
+    job_data, count = await GetManyData(
+        db.jobs, pipeline, JobProjections, {"page": page, "items": items}
+    )
+    for item in job_data:
+        item.update(GetJobProgress(item))
+
+    pagination_info: Pagination = {"page": page, "items": items, "count": count}
+    return JSONResponse(
+        content={
+            "job_data": job_data,
+            "pagination_info": pagination_info,
+        }
+    )
+
+
+@router.get("/detail/{id}")
+async def get_job_detail(
+    id: str,
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+    if not ObjectId.is_valid(id):
+        raise HTTPException(status_code=404, detail={"message": NOT_FOUND_MESSAGE})
+
+    job_data = await GetJobDetail(db, id)
+    if not job_data:
+        raise HTTPException(status_code=404, detail={"message": NOT_FOUND_MESSAGE})
+
+    return JSONResponse(content={"job_data": job_data})
@@ -1,27 +1,49 @@
+from bson import ObjectId
+from datetime import datetime, timedelta
+import re
 from fastapi import (
     APIRouter,
     Body,
     Depends,
+    Header,
     HTTPException,
+    Request,
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from app.models.mikrotik import (
     MikrotikDeleteData,
     MikrotikSecretDeleteData,
+    MikrotikTelemetryResolutionData,
+    MikrotikTrafficPeriodData,
     MikrotikUpdateData,
 )
 from app.models.users import UserData, UserRole
 from app.routes.v1.auth_routes import GetCurrentUser
-from app.modules.mikrotik import GetMikrotikRouterDataByName, MikrotikConnection
+from app.modules.mikrotik import MIKROTIK_ERRORS, GetMikrotikRouterDataByName
+from app.modules.mikrotik_log import StreamMikrotikLog
+from app.modules.mikrotik_mirror import (
+    GetMikrotikMirrorData,
+    GetMikrotikMirrorRouter,
+    RequestMikrotikMirrorSync,
+)
+from app.modules.mikrotik_pool import RunMikrotikCommand
+from app.modules.mikrotik_telemetry import GetMikrotikTelemetryHistory
+from app.modules.mikrotik_traffic import (
+    GetCustomerUsageHistory,
+    GetDefaultUsageRange,
+    GetTopCustomerUsage,
+)
+from app.modules.crud_operations import GetDataCount
+from app.modules.generals import GetCurrentDateTime
+from app.modules.mikrotik_reconcile import ReconcileMikrotikSecrets
 from app.modules.database import AsyncIOMotorClient, GetAmretaDatabase
-import requests
 from app.modules.response_message import (
     DATA_HAS_DELETED_MESSAGE,
     DATA_HAS_UPDATED_MESSAGE,
     FORBIDDEN_ACCESS_MESSAGE,
+    NOT_FOUND_MESSAGE,
     SYSTEM_ERROR_MESSAGE,
 )
-from librouteros.query import Key, Or
 
 router = APIRouter(prefix="/mikrotik", tags=["Mikrotik"])
 
@@ -29,6 +51,9 @@ router = APIRouter(prefix="/mikrotik", tags=["Mikrotik"])
 @router.get("/interface")
 async def get_interface_data(
     router: str,
+    key: str = None,
+    page: int = 1,
+    items: int = None,
     current_user: UserData = Depends(GetCurrentUser),
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
@@ -36,35 +61,34 @@ async def get_interface_data(
         raise HTTPException(
             status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
         )
-    interface_data = []
 
-    host, username, password, port = await GetMikrotikRouterDataByName(db, router)
-    if not host:
+    id_router, mirror_info = await GetMikrotikMirrorRouter(db, router)
+    if not id_router:
         return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
 
-    try:
-        mikrotik = MikrotikConnection(host, username, password, port)
-        type = Key("type")
-        for row in (
-            mikrotik.path("/interface")
-            .select()
-            .where(
-                Or(
-                    type == "ether",
-                    type == "vlan",
-                ),
-            )
-        ):
-            interface_data.append(row)
-    except requests.exceptions.RequestException as e:
-        print(str(e))
+    query = {"type": {"$in": ["ether", "vlan"]}}
+    if key:
+        query["name"] = {"$regex": key, "$options": "i"}
 
-    return JSONResponse(content={"interface_data": interface_data})
+    pagination = {"page": page, "items": items} if items else {}
+    interface_data, count = await GetMikrotikMirrorData(
+        db, "interface", id_router, query, pagination
+    )
+    return JSONResponse(
+        content={
+            "interface_data": interface_data,
+            "pagination_info": {**pagination, "count": count},
+            "mirror_info": mirror_info,
+        }
+    )
 
 
 @router.get("/profile")
 async def get_profile_data(
     router: str,
+    key: str = None,
+    page: int = 1,
+    items: int = None,
     current_user: UserData = Depends(GetCurrentUser),
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
@@ -72,19 +96,26 @@ async def get_profile_data(
         raise HTTPException(
             status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
         )
-    profile_data = []
 
-    host, username, password, port = await GetMikrotikRouterDataByName(db, router)
-    if not host:
-        return JSONResponse(content={"profile_data": profile_data})
-    try:
-        mikrotik = MikrotikConnection(host, username, password, port)
-        for row in mikrotik.path("/ppp/profile").select():
-            profile_data.append(row)
-    except requests.exceptions.RequestException as e:
-        print(str(e))
+    id_router, mirror_info = await GetMikrotikMirrorRouter(db, router)
+    if not id_router:
+        return JSONResponse(content={"profile_data": []})
 
-    return JSONResponse(content={"profile_data": profile_data})
+    query = {}
+    if key:
+        query["name"] = {"$regex": key, "$options": "i"}
+
+    pagination = {"page": page, "items": items} if items else {}
+    profile_data, count = await GetMikrotikMirrorData(
+        db, "profile", id_router, query, pagination
+    )
+    return JSONResponse(
+        content={
+            "profile_data": profile_data,
+            "pagination_info": {**pagination, "count": count},
+            "mirror_info": mirror_info,
+        }
+    )
 
 
 @router.put("/profile/delete/{id}")
@@ -104,14 +135,25 @@ async def delete_profile(
     )
     if not host:
         return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
-    mikrotik = MikrotikConnection(host, username, password, port)
-    mikrotik.path("/ppp/profile").remove(id)
+    await RunMikrotikCommand(
+        host,
+        username,
+        password,
+        port,
+        lambda mikrotik: mikrotik.path("/ppp/profile").remove(id),
+    )
+    await RequestMikrotikMirrorSync(db, payload["router"])
     return JSONResponse(content={"message": DATA_HAS_DELETED_MESSAGE})
 
 
 @router.get("/secret")
 async def get_secret_data(
     router: str,
+    key: str = None,
+    profile: str = None,
+    disabled: bool = None,
+    page: int = 1,
+    items: int = None,
     current_user: UserData = Depends(GetCurrentUser),
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
@@ -119,22 +161,33 @@ async def get_secret_data(
         raise HTTPException(
             status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
         )
-    secret_data = []
 
-    host, username, password, port = await GetMikrotikRouterDataByName(db, router)
-    if not host:
-        return JSONResponse(content={"secret_data": secret_data})
-
-    try:
-        mikrotik = MikrotikConnection(host, username, password, port)
-        for row in mikrotik.path("/ppp/secret").select():
-            row["name"] = str(row.get("name", ""))
-            row["password"] = str(row.get("password", ""))
-            secret_data.append(row)
-    except requests.exceptions.RequestException as e:
-        print(str(e))
-
-    return JSONResponse(content={"secret_data": secret_data})
+    id_router, mirror_info = await GetMikrotikMirrorRouter(db, router)
+    if not id_router:
+        return JSONResponse(content={"secret_data": []})
+
+    query = {}
+    if key:
+        query["$or"] = [
+            {"name": {"$regex": key, "$options": "i"}},
+            {"comment": {"$regex": key, "$options": "i"}},
+        ]
+    if profile:
+        query["profile"] = profile
+    if disabled is not None:
+        query["disabled"] = disabled
+
+    pagination = {"page": page, "items": items} if items else {}
+    secret_data, count = await GetMikrotikMirrorData(
+        db, "secret", id_router, query, pagination
+    )
+    return JSONResponse(
+        content={
+            "secret_data": secret_data,
+            "pagination_info": {**pagination, "count": count},
+            "mirror_info": mirror_info,
+        }
+    )
 
 
 @router.put("/secret/update/{id}")
@@ -167,8 +220,14 @@ async def update_secret(
     if "disabled" in payload:
         update_data["disabled"] = payload["disabled"]
 
-    mikrotik = MikrotikConnection(host, username, password, port)
-    mikrotik.path("/ppp/secret").update(**update_data)
+    await RunMikrotikCommand(
+        host,
+        username,
+        password,
+        port,
+        lambda mikrotik: mikrotik.path("/ppp/secret").update(**update_data),
+    )
+    await RequestMikrotikMirrorSync(db, payload["router"])
     return JSONResponse(content={"message": DATA_HAS_UPDATED_MESSAGE})
 
 
@@ -190,8 +249,14 @@ async def delete_secret(
     if not host:
         return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
 
-    mikrotik = MikrotikConnection(host, username, password, port)
-    mikrotik.path("/ppp/secret").remove(id)
+    await RunMikrotikCommand(
+        host,
+        username,
+        password,
+        port,
+        lambda mikrotik: mikrotik.path("/ppp/secret").remove(id),
+    )
+    await RequestMikrotikMirrorSync(db, payload["router"])
     return JSONResponse(content={"message": DATA_HAS_DELETED_MESSAGE})
 
 
@@ -212,10 +277,15 @@ async def get_system_resource_data(
         return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
 
     try:
-        mikrotik = MikrotikConnection(host, username, password, port)
-        for row in mikrotik.path("/system/resource").select():
-            system_resource_data.append(row)
-    except requests.exceptions.RequestException as e:
+        system_resource_data = await RunMikrotikCommand(
+            host,
+            username,
+            password,
+            port,
+            lambda mikrotik: list(mikrotik.path("/system/resource").select()),
+            is_retry=True,
+        )
+    except MIKROTIK_ERRORS as e:
         print(str(e))
 
     return JSONResponse(
@@ -237,30 +307,103 @@ async def get_user_stats_data(
         raise HTTPException(
             status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
         )
-    ppp = []
-    secret = []
 
-    host, username, password, port = await GetMikrotikRouterDataByName(db, router)
-    if not host:
+    id_router, mirror_info = await GetMikrotikMirrorRouter(db, router)
+    if not id_router:
         return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
 
-    try:
-        mikrotik = MikrotikConnection(host, username, password, port)
-        for row in mikrotik.path("/ppp/active").select():
-            ppp.append(row)
-        for row in mikrotik.path("/ppp/secret").select():
-            secret.append(row)
-    except requests.exceptions.RequestException as e:
-        print(str(e))
-
+    ppp = await GetDataCount(db.mikrotik_active, {"id_router": id_router})
+    secret = await GetDataCount(db.mikrotik_secrets, {"id_router": id_router})
     return JSONResponse(
         content={
-            "ppp": len(ppp),
-            "secret": len(secret),
+            "ppp": ppp,
+            "secret": secret,
+            "mirror_info": mirror_info,
         }
     )
 
 
+@router.get("/telemetry")
+async def get_telemetry_data(
+    router: str,
+    resolution: MikrotikTelemetryResolutionData = None,
+    from_date: datetime = None,
+    to_date: datetime = None,
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+
+    id_router, _ = await GetMikrotikMirrorRouter(db, router)
+    if not id_router:
+        return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
+
+    to_date = to_date or GetCurrentDateTime()
+    from_date = from_date or to_date - timedelta(days=1)
+    telemetry_data = await GetMikrotikTelemetryHistory(
+        db,
+        id_router,
+        from_date,
+        to_date,
+        resolution.value if resolution else None,
+    )
+    return JSONResponse(content={"telemetry_data": telemetry_data})
+
+
+@router.get("/usage/top")
+async def get_top_usage_data(
+    period: MikrotikTrafficPeriodData = MikrotikTrafficPeriodData.DAILY,
+    router: str = None,
+    from_date: datetime = None,
+    to_date: datetime = None,
+    limit: int = 10,
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+
+    id_router = None
+    if router:
+        id_router, _ = await GetMikrotikMirrorRouter(db, router)
+        if not id_router:
+            return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
+
+    from_date, to_date = GetDefaultUsageRange(period.value, from_date, to_date)
+    usage_data = await GetTopCustomerUsage(
+        db, period.value, from_date, to_date, limit, id_router
+    )
+    return JSONResponse(content={"usage_data": usage_data})
+
+
+@router.get("/usage/customer/{id}")
+async def get_customer_usage_data(
+    id: str,
+    period: MikrotikTrafficPeriodData = MikrotikTrafficPeriodData.HOURLY,
+    from_date: datetime = None,
+    to_date: datetime = None,
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+    if not ObjectId.is_valid(id):
+        raise HTTPException(status_code=404, detail={"message": NOT_FOUND_MESSAGE})
+
+    from_date, to_date = GetDefaultUsageRange(period.value, from_date, to_date)
+    usage_data = await GetCustomerUsageHistory(
+        db, ObjectId(id), period.value, from_date, to_date
+    )
+    return JSONResponse(content={"usage_data": usage_data})
+
+
 @router.get("/log")
 async def get_log_data(
     router: str,
@@ -278,15 +421,63 @@ async def get_log_data(
         return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
 
     try:
-        mikrotik = MikrotikConnection(host, username, password, port)
-        for row in mikrotik.path("/log").select():
-            log_data.append(row)
-    except requests.exceptions.RequestException as e:
+        log_data = await RunMikrotikCommand(
+            host,
+            username,
+            password,
+            port,
+            lambda mikrotik: list(mikrotik.path("/log").select()),
+            is_retry=True,
+        )
+    except MIKROTIK_ERRORS as e:
         print(str(e))
 
     return JSONResponse(content={"log_data": log_data})
 
 
+@router.get("/log/stream")
+async def stream_log_data(
+    request: Request,
+    router: str,
+    topics: str = None,
+    pattern: str = None,
+    last_event_id: str = Header(None, alias="Last-Event-ID"),
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+
+    host, username, password, port = await GetMikrotikRouterDataByName(db, router)
+    if not host:
+        return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
+
+    try:
+        compiled_pattern = re.compile(pattern, re.IGNORECASE) if pattern else None
+    except re.error:
+        raise HTTPException(
+            status_code=400, detail={"message": "Pola Pencarian Tidak Valid!"}
+        )
+
+    return StreamingResponse(
+        StreamMikrotikLog(
+            router,
+            host,
+            username,
+            password,
+            port,
+            set(topics.split(",")) if topics else None,
+            compiled_pattern,
+            int(last_event_id) if last_event_id and last_event_id.isdigit() else 0,
+            request.is_disconnected,
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/reboot")
 async def reboot_mikrotik(
     router: str,
@@ -303,9 +494,38 @@ async def reboot_mikrotik(
         return JSONResponse(content={"message": SYSTEM_ERROR_MESSAGE})
 
     try:
-        mikrotik = MikrotikConnection(host, username, password, port)
-        mikrotik("/system/reboot")
-    except requests.exceptions.RequestException as e:
+        await RunMikrotikCommand(
+            host,
+            username,
+            password,
+            port,
+            lambda mikrotik: tuple(mikrotik("/system/reboot")),
+        )
+    except MIKROTIK_ERRORS as e:
         print(str(e))
 
     return JSONResponse(content={"message": "Mikrotik Telah Direboot"})
+
+
+@router.post("/reconcile")
+async def reconcile_secret_data(
+    router: str = None,
+    dry_run: bool = True,
+    is_remove_extra: bool = False,
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+
+    reconcile_data = await ReconcileMikrotikSecrets(
+        db, {"name": router} if router else {}, dry_run, is_remove_extra
+    )
+    if len(reconcile_data) == 0:
+        raise HTTPException(
+            status_code=404, detail={"message": "Data Router Tidak Ditemukan!"}
+        )
+
+    return JSONResponse(content={"dry_run": dry_run, "reconcile_data": reconcile_data})
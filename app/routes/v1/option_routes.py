@@ -16,8 +16,7 @@ from app.models.inventory import InventoryPositionData
 from app.routes.v1.auth_routes import GetCurrentUser
 from app.modules.crud_operations import GetAggregateData, GetDataCount
 from app.modules.database import AsyncIOMotorClient, GetAmretaDatabase
-import requests
-from app.modules.mikrotik import GetMikrotikRouterDataByName, MikrotikConnection
+from app.modules.mikrotik_mirror import GetMikrotikMirrorData, GetMikrotikMirrorRouter
 
 router = APIRouter(prefix="/options", tags=["Options"])
 
@@ -317,17 +316,18 @@ async def get_router_profile_options(
 ):
     router_profile_options = []
 
-    host, username, password, port = await GetMikrotikRouterDataByName(db, name)
-    if not host:
+    id_router, mirror_info = await GetMikrotikMirrorRouter(db, name)
+    if not id_router:
         return JSONResponse(content={"router_profile_options": router_profile_options})
-    try:
-        mikrotik = MikrotikConnection(host, username, password, port)
-        for row in mikrotik.path("/ppp/profile").select():
-            router_profile_options.append(row.get("name", ""))
-    except requests.exceptions.RequestException as e:
-        print(str(e))
-
-    return JSONResponse(content={"router_profile_options": router_profile_options})
+
+    profile_data, _ = await GetMikrotikMirrorData(db, "profile", id_router)
+    router_profile_options = [row.get("name", "") for row in profile_data]
+    return JSONResponse(
+        content={
+            "router_profile_options": router_profile_options,
+            "mirror_info": mirror_info,
+        }
+    )
 
 
 @router.get("/area-province")
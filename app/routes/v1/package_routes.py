@@ -5,6 +5,8 @@ from fastapi import (
     Depends,
     HTTPException,
 )
+from app.models.customers import CustomerStatusData
+from app.models.jobs import JobTypeData
 from app.models.packages import PackageCategoryData, PackageInsertData
 from app.modules.response_message import (
     DATA_HAS_DELETED_MESSAGE,
@@ -22,12 +24,84 @@ from app.routes.v1.auth_routes import GetCurrentUser
 from app.modules.crud_operations import (
     CreateOneData,
     DeleteOneData,
+    GetAggregateData,
+    GetDataCount,
+    GetDistinctData,
     GetManyData,
     GetOneData,
     UpdateOneData,
 )
 from app.models.packages import PackageProjections
 from app.modules.database import AsyncIOMotorClient, GetAmretaDatabase
+from app.modules.jobs import CreateJob, RegisterJobHandler
+from app.modules.mikrotik import PropagateMikrotikPPPProfile
+
+
+@RegisterJobHandler(JobTypeData.PACKAGE_PROFILE_PROPAGATE.value)
+async def PropagatePackageProfileJobHandler(db, job: dict):
+    # one chunk per router, its /ppp/secret and /ppp/active are read once
+    # for the whole job instead of once per batch of customers
+    params = job["params"]
+    chunk = {}
+    # add-on packages carry no router_profile, the secret profile always
+    # comes from the main package
+    query = {
+        "id_package": ObjectId(params["id_package"]),
+        "status": {"$ne": CustomerStatusData.NONACTIVE.value},
+        "id_router": {"$ne": None},
+    }
+    if not job.get("checkpoint"):
+        chunk["total"] = await GetDataCount(db.customers, query)
+
+    router_ids = sorted(
+        str(id_router)
+        for id_router in await GetDistinctData(db.customers, query, "id_router")
+        if str(id_router) > str(job.get("checkpoint") or "")
+    )
+    if len(router_ids) == 0:
+        chunk.update(
+            {"checkpoint": job.get("checkpoint"), "processed": 0, "is_done": True}
+        )
+        return chunk
+
+    customer_data = await GetAggregateData(
+        db.customers,
+        [{"$match": {**query, "id_router": ObjectId(router_ids[0])}}],
+        {"pppoe_username": 1, "id_router": 1},
+    )
+    propagate_result = await PropagateMikrotikPPPProfile(
+        db, customer_data, params["router_profile"]
+    )
+    routers = propagate_result["routers"].values()
+    chunk.update(
+        {
+            "checkpoint": router_ids[0],
+            "processed": len(customer_data),
+            "is_done": len(router_ids) == 1,
+            "result": {
+                "secret_updated": sum(item.get("updated", 0) for item in routers),
+                "secret_missing": sum(item.get("missing", 0) for item in routers),
+                "active_removed": sum(
+                    item.get("active_removed", 0) for item in routers
+                ),
+                "propagate_failed": len(propagate_result["failed"]),
+                "propagate_seconds": {
+                    id_router: router["seconds"]
+                    for id_router, router in propagate_result["routers"].items()
+                },
+            },
+        }
+    )
+    return chunk
+
+
+async def CreatePackageProfileJob(db, id_package: str, router_profile: str):
+    return await CreateJob(
+        db,
+        JobTypeData.PACKAGE_PROFILE_PROPAGATE.value,
+        {"id_package": id_package, "router_profile": router_profile},
+    )
+
 
 router = APIRouter(prefix="/package", tags=["Packages"])
 
@@ -134,7 +208,38 @@ async def update_package(
     if not result:
         raise HTTPException(status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE})
 
-    return JSONResponse(content={"message": DATA_HAS_UPDATED_MESSAGE})
+    id_job = None
+    if payload.get("router_profile") and payload["router_profile"] != exist_data.get(
+        "router_profile"
+    ):
+        id_job = await CreatePackageProfileJob(db, id, payload["router_profile"])
+
+    return JSONResponse(content={"message": DATA_HAS_UPDATED_MESSAGE, "id_job": id_job})
+
+
+@router.post("/propagate-profile/{id}")
+async def propagate_package_profile(
+    id: str,
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+    exist_data = await GetOneData(db.packages, {"_id": ObjectId(id)})
+    if not exist_data:
+        raise HTTPException(status_code=404, detail={"message": NOT_FOUND_MESSAGE})
+
+    if not exist_data.get("router_profile"):
+        raise HTTPException(
+            status_code=400, detail={"message": "Profile Router Paket Kosong!"}
+        )
+
+    id_job = await CreatePackageProfileJob(db, id, exist_data["router_profile"])
+    return JSONResponse(
+        content={"message": "Profile Paket Sedang Diterapkan!", "id_job": id_job}
+    )
 
 
 @router.delete("/delete/{id}")
@@ -14,13 +14,18 @@ import urllib.parse
 from app.models.notifications import NotificationTypeData
 from app.models.invoices import InvoiceOwnerVerifiedStatusData, InvoiceStatusData
 from app.models.payments import (
+    BankMutationStatusData,
     PaymentPayOffData,
     RequestConfirmData,
 )
 from app.models.bill import BillStatusData
 
 from app.models.customers import CustomerStatusData
-from app.modules.response_message import NOT_FOUND_MESSAGE, SYSTEM_ERROR_MESSAGE
+from app.modules.response_message import (
+    FORBIDDEN_ACCESS_MESSAGE,
+    NOT_FOUND_MESSAGE,
+    SYSTEM_ERROR_MESSAGE,
+)
 from fastapi.responses import JSONResponse
 from app.models.users import UserData, UserRole
 from app.modules.generals import DateIDFormatter, GetCurrentDateTime, ThousandSeparator
@@ -33,12 +38,19 @@ from app.modules.crud_operations import (
     UpdateOneData,
 )
 from app.modules.database import AsyncIOMotorClient, GetAmretaDatabase
+from app.modules.http_client import GetHTTPClient
 from app.models.payments import PaymentMethodData
+from app.modules.ipaymu import (
+    GetIpaymuChannelCacheInfo,
+    GetIpaymuChannels,
+    StoreIpaymuCallback,
+)
 from app.modules.mikrotik import ActivateMikrotikPPPSecret
+from app.modules.moota import RequestMootaConfirm, StoreBankMutations
+from app.modules.payment_confirmation import CheckMitraFee
 from app.modules.whatsapp_message import (
     SendWhatsappPaymentSuccessMessage,
 )
-import requests
 from dotenv import load_dotenv
 import hashlib
 import os
@@ -56,52 +68,10 @@ IPAYMU_CALLBACK_URL = os.getenv("IPAYMU_CALLBACK_URL")
 MOOTA_CALLBACK_SECRET_KEY = os.getenv("MOOTA_CALLBACK_SECRET_KEY")
 MOOTA_API_TOKEN = os.getenv("MOOTA_API_TOKEN")
 MOOTA_BANK_ACCOUNT_ID = os.getenv("MOOTA_BANK_ACCOUNT_ID")
-# autoconfirm config
-AUTOCONFIRM_USER_ID = os.getenv("AUTOCONFIRM_USER_ID")
-AUTOCONFIRM_USER_EMAIL = os.getenv("AUTOCONFIRM_USER_EMAIL")
 
 router = APIRouter(prefix="/payment", tags=["Payments"])
 
 
-async def CheckMitraFee(db, customer_data, id_invoice):
-    invoice_data, count = await GetManyData(
-        db.invoices,
-        [{"$match": {"id_customer": ObjectId(customer_data.get("_id"))}}],
-        {"_id": 1},
-    )
-    if count <= 1:
-        return
-
-    if customer_data.get("referral", None):
-        referral_user = await GetOneData(
-            db.users, {"referral": customer_data.get("referral")}
-        )
-        if referral_user and referral_user.get("role") == UserRole.MITRA:
-            package_data = await GetOneData(
-                db.packages,
-                {"_id": ObjectId(customer_data.get("id_package"))},
-            )
-            if package_data:
-                package_fee = package_data.get("price", {}).get("mitra_fee", 0)
-                mitra_fee = referral_user.get("saldo", 0) + package_fee
-                await UpdateOneData(
-                    db.users,
-                    {"referral": customer_data.get("referral")},
-                    {"$set": {"saldo": mitra_fee}},
-                )
-                await CreateOneData(
-                    db.invoice_fees,
-                    {
-                        "id_customer": ObjectId(customer_data.get("_id")),
-                        "id_invoice": ObjectId(id_invoice),
-                        "id_user": ObjectId(referral_user.get("_id")),
-                        "referral": referral_user.get("referral"),
-                        "fee": package_fee,
-                        "created_at": GetCurrentDateTime(),
-                    },
-                )
-
-
 @router.put("/pay-off/{id}")
 async def pay_off_payment(
     id: str,
@@ -342,41 +312,44 @@ async def request_confirm_payment(
 @router.get("/ipaymu/channel")
 async def get_ipaymu_channel():
     try:
-        timestamp = GetCurrentDateTime().strftime("%Y%m%d%H%M%S")
-        body = {}
+        channel_options = await GetIpaymuChannels()
+        return JSONResponse(content={"channel_options": channel_options})
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE, "err_msg": str(e)}
+        )
 
-        data_body = json.dumps(body)
-        data_body = json.dumps(body, separators=(",", ":"))
-        encrypt_body = hashlib.sha256(data_body.encode()).hexdigest()
-        string_to_sign = "{}:{}:{}:{}".format(
-            "GET", IPAYMU_VA, encrypt_body, IPAYMU_API_TOKEN
+
+@router.get("/ipaymu/channel/cache")
+async def get_ipaymu_channel_cache(
+    current_user: UserData = Depends(GetCurrentUser),
+):
+    if current_user.role != UserRole.OWNER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
         )
-        signature = (
-            hmac.new(IPAYMU_API_TOKEN.encode(), string_to_sign.encode(), hashlib.sha256)
-            .hexdigest()
-            .lower()
+
+    return JSONResponse(content={"cache_info": GetIpaymuChannelCacheInfo()})
+
+
+@router.post("/ipaymu/channel/refresh")
+async def refresh_ipaymu_channel_cache(
+    current_user: UserData = Depends(GetCurrentUser),
+):
+    if current_user.role != UserRole.OWNER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
         )
-        headers = {
-            "Content-type": "application/json",
-            "Accept": "application/json",
-            "signature": signature,
-            "va": IPAYMU_VA,
-            "timestamp": timestamp,
-        }
-        ipaymu_url = f"{IPAYMU_API_DOMAIN}/api/v2/payment-channels"
-        response = requests.get(ipaymu_url, headers=headers, data=data_body, timeout=60)
-        response = response.json()
-        channel_options = []
-        for item in response.get("Data", []):
-            if item.get("Code") in ["cstore", "va"]:
-                channel_options += item.get("Channels", [])
 
-        return JSONResponse(content={"channel_options": channel_options})
+    try:
+        await GetIpaymuChannels(is_refresh=True)
     except Exception as e:
         raise HTTPException(
             status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE, "err_msg": str(e)}
         )
 
+    return JSONResponse(content={"cache_info": GetIpaymuChannelCacheInfo()})
+
 
 @router.post("/ipaymu/add/{id_invoice}")
 async def create_ipaymu_payment(
@@ -433,8 +406,8 @@ async def create_ipaymu_payment(
             "timestamp": timestamp,
         }
         ipaymu_url = f"{IPAYMU_API_DOMAIN}/api/v2/payment"
-        response = requests.post(
-            ipaymu_url, headers=headers, data=data_body, timeout=60
+        response = await GetHTTPClient("ipaymu").post(
+            ipaymu_url, headers=headers, content=data_body
         )
         response = response.json()
 
@@ -471,83 +444,10 @@ async def ipaymu_payment_callback(
             parsed_data = urllib.parse.parse_qs(body_str)
             callback_data = {key: value[0] for key, value in parsed_data.items()}
 
-        status_code = callback_data.get("status_code", "0")
-        id_invoice = callback_data.get("reference_id", None)
-        channel = callback_data.get("payment_channel", "")
-        if status_code == "1" and id_invoice:
-            invoice_data = await GetOneData(db.invoices, {"_id": ObjectId(id_invoice)})
-            if not invoice_data:
-                pass
-
-            result = await UpdateOneData(
-                db.invoices,
-                {"_id": ObjectId(id_invoice)},
-                {
-                    "$set": {
-                        "status": InvoiceStatusData.PAID,
-                        "payment.method": PaymentMethodData.TRANSFER.value,
-                        "payment.paid_at": GetCurrentDateTime(),
-                        "payment.description": f"Pembayaran Tagihan Periode {DateIDFormatter(str(invoice_data.get('due_date')))} (By IPaymu)",
-                        "payment.confirmed_at": GetCurrentDateTime(),
-                        "payment.confirmed_by": AUTOCONFIRM_USER_EMAIL,
-                        "payment.channel": channel,
-                        "owner_verified_status": InvoiceOwnerVerifiedStatusData.ACCEPTED.value,
-                    }
-                },
-                upsert=True,
-            )
-            if not result:
-                pass
-
-            income_data = {
-                "id_invoice": ObjectId(id_invoice),
-                "nominal": invoice_data.get("amount", 0),
-                "category": "BAYAR TAGIHAN",
-                "description": f"Pembayaran Tagihan dengan Nomor Layanan {invoice_data.get('service_number', '-')} a/n {invoice_data.get('name', '-')}, Periode {DateIDFormatter(invoice_data.get('due_date'))}",
-                "method": PaymentMethodData.TRANSFER.value,
-                "date": GetCurrentDateTime(),
-                "id_receiver": ObjectId(AUTOCONFIRM_USER_ID),
-                "created_at": GetCurrentDateTime(),
-            }
-            await UpdateOneData(
-                db.incomes,
-                {"id_invoice": ObjectId(id_invoice)},
-                {"$set": income_data},
-                upsert=True,
-            )
-
-            asyncio.create_task(SendWhatsappPaymentSuccessMessage(db, [id_invoice]))
-            asyncio.create_task(SendTelegramPaymentMessage(db, id_invoice))
-
-            customer_data = await GetOneData(
-                db.customers, {"_id": ObjectId(invoice_data["id_customer"])}
-            )
-            if not customer_data:
-                pass
-
-            status = customer_data.get("status", None)
-            if (
-                status != CustomerStatusData.ACTIVE
-                and status != CustomerStatusData.FREE
-            ):
-                await UpdateOneData(
-                    db.customers,
-                    {"_id": ObjectId(invoice_data["id_customer"])},
-                    {"$set": {"status": CustomerStatusData.ACTIVE.value}},
-                )
-                await ActivateMikrotikPPPSecret(db, customer_data, False)
-
-            await CheckMitraFee(db, customer_data, id_invoice)
-
-            notification_data = {
-                "id_user": ObjectId(customer_data["id_user"]),
-                "title": "Tagihan Telah Dibayar",
-                "description": f"Tagihan anda senilai Rp{ThousandSeparator(invoice_data.get('amount', 0))} telah dkonfirmasi!",
-                "type": NotificationTypeData.OTHER.value,
-                "is_read": 0,
-                "created_at": GetCurrentDateTime(),
-            }
-            await CreateOneData(db.notifications, notification_data)
+        if callback_data.get("reference_id"):
+            # stored once per reference_id and status_code, a gateway retry is
+            # acknowledged without running the confirmation again
+            await StoreIpaymuCallback(db, callback_data)
 
         return JSONResponse(content={"message": "Callback Diterima"})
     except Exception as e:
@@ -562,3 +462,103 @@ async def ipaymu_payment_callback(
         raise HTTPException(
             status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE, "err_msg": str(e)}
         )
+
+
+@router.post("/moota/callback")
+async def moota_payment_callback(
+    request: Request,
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    body = await request.body()
+    signature = hmac.new(
+        str(MOOTA_CALLBACK_SECRET_KEY).encode(), body, hashlib.sha256
+    ).hexdigest()
+    if not MOOTA_CALLBACK_SECRET_KEY or not hmac.compare_digest(
+        signature, request.headers.get("Signature", "")
+    ):
+        raise HTTPException(
+            status_code=401, detail={"message": "Signature Tidak Valid!"}
+        )
+
+    try:
+        mutations = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail={"message": "Body is Not JSON"})
+
+    if isinstance(mutations, dict):
+        mutations = mutations.get("data", [mutations])
+
+    if not isinstance(mutations, list) or not all(
+        isinstance(item, dict) for item in mutations
+    ):
+        raise HTTPException(
+            status_code=400, detail={"message": "Body is Not Mutation List"}
+        )
+
+    # stored idempotently by mutation_id, a retried callback is a no-op, the
+    # matching and confirmation are left to the moota worker
+    await StoreBankMutations(
+        db, [item for item in mutations if item.get("mutation_id")]
+    )
+    RequestMootaConfirm()
+    return JSONResponse(content={"message": "Callback Diterima"})
+
+
+@router.get("/moota/mutations")
+async def get_moota_mutations(
+    key: str = None,
+    status: BankMutationStatusData = None,
+    type: str = None,
+    page: int = 1,
+    items: int = 10,
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+
+    query = {}
+    if status:
+        query["status"] = status.value
+    if type:
+        query["type"] = type
+    if key:
+        query["$or"] = [
+            {"description": {"$regex": key, "$options": "i"}},
+            {"mutation_id": key},
+        ]
+        if key.isdigit():
+            query["$or"].append({"amount": int(key)})
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"date": -1}},
+        {
+            "$lookup": {
+                "from": "invoices",
+                "localField": "id_invoice",
+                "foreignField": "_id",
+                "as": "invoice",
+            }
+        },
+        {
+            "$addFields": {
+                "name": {"$arrayElemAt": ["$invoice.name", 0]},
+                "service_number": {"$arrayElemAt": ["$invoice.service_number", 0]},
+            }
+        },
+    ]
+    mutation_data, count = await GetManyData(
+        db.bank_mutations,
+        pipeline,
+        {"invoice": 0},
+        {"page": page, "items": items},
+    )
+    return JSONResponse(
+        content={
+            "mutation_data": mutation_data,
+            "pagination_info": {"page": page, "items": items, "count": count},
+        }
+    )
@@ -40,7 +40,8 @@ from app.modules.crud_operations import (
     CreateOneData,
     DeleteOneData,
     GetAggregateData,
-    GetManyData,
+    GetManyDataByCursor,
+    GetManyDataCachedCount,
     GetOneData,
     UpdateOneData,
 )
@@ -58,6 +59,8 @@ async def get_tickets(
     created_by: str = None,
     page: int = 1,
     items: int = 1,
+    cursor: str = None,
+    with_count: bool = True,
     current_user: UserData = Depends(GetCurrentUser),
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
@@ -77,7 +80,7 @@ async def get_tickets(
     if created_by:
         query["created_by"] = ObjectId(created_by)
 
-    pipeline = [
+    match_pipeline = [
         {"$match": query},
         {
             "$addFields": {
@@ -117,12 +120,8 @@ async def get_tickets(
                 }
             }
         },
-        {
-            "$sort": {
-                "status_priority": 1,
-                "created_at": 1,
-            }
-        },
+    ]
+    lookup_pipeline = [
         {
             "$lookup": {
                 "from": "users",
@@ -230,11 +229,55 @@ async def get_tickets(
             }
         },
     ]
+    if cursor is not None:
+        # keyset mode, an empty cursor is the first page
+        try:
+            ticket_data, count, next_cursor, is_count_exact = await GetManyDataByCursor(
+                db.tickets,
+                match_pipeline,
+                [("status_priority", 1), ("created_at", 1)],
+                cursor,
+                items,
+                lookup_pipeline,
+                with_count=with_count,
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail={"message": "Cursor Tidak Valid!"}
+            )
+
+        pagination_info: Pagination = {
+            "items": items,
+            "count": count,
+            "is_count_exact": is_count_exact,
+            "next_cursor": next_cursor,
+        }
+        return JSONResponse(
+            content={
+                "ticket_data": ticket_data,
+                "pagination_info": pagination_info,
+            }
+        )
 
-    ticket_data, count = await GetManyData(
+    pipeline = [
+        *match_pipeline,
+        {
+            "$sort": {
+                "status_priority": 1,
+                "created_at": 1,
+            }
+        },
+        *lookup_pipeline,
+    ]
+    ticket_data, count, is_count_exact = await GetManyDataCachedCount(
         db.tickets, pipeline, {}, {"page": page, "items": items}
     )
-    pagination_info: Pagination = {"page": page, "items": items, "count": count}
+    pagination_info: Pagination = {
+        "page": page,
+        "items": items,
+        "count": count,
+        "is_count_exact": is_count_exact,
+    }
     return JSONResponse(
         content={
             "ticket_data": ticket_data,
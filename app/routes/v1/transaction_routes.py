@@ -5,9 +5,10 @@ from fastapi import (
     HTTPException,
 )
 from app.modules.response_message import FORBIDDEN_ACCESS_MESSAGE
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import StreamingResponse
 from app.models.users import UserData, UserRole
 from app.routes.v1.auth_routes import GetCurrentUser
+from app.modules.bson_response import BSONJSONResponse
 from app.modules.crud_operations import GetAggregateData
 from app.modules.database import AsyncIOMotorClient, GetAmretaDatabase
 from app.modules.generals import GetCurrentDateTime, NumberToWords
@@ -49,6 +50,7 @@ async def get_cashflow(
             "credit": "$nominal",
             "type": "INCOMES",
         },
+        is_json=False,
     )
     expenditures_data = await GetAggregateData(
         db.expenditures,
@@ -61,13 +63,12 @@ async def get_cashflow(
             "debit": "$nominal",
             "type": "EXPENDITURES",
         },
+        is_json=False,
     )
 
     cashflow_data = incomes_data + expenditures_data
-    cashflow_data = sorted(
-        cashflow_data,
-        key=lambda x: datetime.strptime(x["date"], "%Y-%m-%d %H:%M:%S"),
-    )
+    # zero padded "%Y-%m-%d %H:%M:%S" strings sort chronologically
+    cashflow_data = sorted(cashflow_data, key=lambda x: x["date"] or "")
     saldo_count = 0
     for entry in cashflow_data:
         if entry["type"] == "INCOMES":
@@ -77,7 +78,7 @@ async def get_cashflow(
 
         entry["saldo"] = saldo_count
 
-    return JSONResponse(
+    return BSONJSONResponse(
         content={
             "cashflow_data": cashflow_data,
             "saldo_count": saldo_count,
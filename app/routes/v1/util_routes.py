@@ -1,4 +1,6 @@
+import asyncio
 import json
+import textwrap
 from bson import json_util
 from fastapi import (
     APIRouter,
@@ -9,10 +11,17 @@ from fastapi import (
     UploadFile,
 )
 from app.models.generals import UploadImageType
+from app.models.jobs import JobTypeData
 from app.modules.generals import GetCurrentDateTime
 from pathlib import Path
 import shutil
-from app.modules.crud_operations import UpdateOneData
+from app.modules.crud_operations import (
+    InvalidateDataCount,
+    IterateBatches,
+    IterateData,
+    UpdateOneData,
+)
+from app.modules.jobs import CreateJob, RegisterJobHandler
 from app.modules.database import AsyncIOMotorClient, GetAmretaDatabase
 import os
 from passlib.context import CryptContext
@@ -65,25 +74,63 @@ async def reset_unique_code(db: AsyncIOMotorClient = Depends(GetAmretaDatabase))
     return result
 
 
+def WriteBackupDocuments(backup_file, documents: list, is_first: bool):
+    # written as json.dump(documents, indent=4) would, one batch at a time
+    for index, document in enumerate(documents):
+        text = json.dumps(
+            document, indent=4, default=json_util.default, ensure_ascii=False
+        )
+        separator = "[\n" if is_first and index == 0 else ",\n"
+        backup_file.write(separator + textwrap.indent(text, "    "))
+
+
+@RegisterJobHandler(JobTypeData.DATA_BACKUP.value)
+async def BackupDataJobHandler(db, job: dict):
+    collections = job["params"]["collections"]
+    index = job.get("checkpoint") or 0
+    chunk = {"result": {}}
+    if index == 0:
+        chunk["total"] = len(collections)
+
+    if index < len(collections):
+        collection_name = collections[index]
+        backup_filename = f"{BACKUP_DIR}/{collection_name}.json"
+        backup_file = None
+        try:
+            # streamed, a large collection is never loaded whole
+            async for documents in IterateBatches(
+                IterateData(db[collection_name], is_json=False)
+            ):
+                is_first = backup_file is None
+                if is_first:
+                    backup_file = open(backup_filename, "w", encoding="utf-8")
+
+                await asyncio.to_thread(
+                    WriteBackupDocuments, backup_file, documents, is_first
+                )
+        finally:
+            if backup_file:
+                backup_file.write("\n]")
+                backup_file.close()
+
+        if backup_file:
+            chunk["result"] = {"collection_backup": 1, "file": backup_filename}
+
+    chunk["checkpoint"] = index + 1
+    chunk["processed"] = 1 if index < len(collections) else 0
+    chunk["is_done"] = index + 1 >= len(collections)
+    return chunk
+
+
 @router.get("/backup")
 async def backup_data(
     db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
 ):
     collections = await db.list_collection_names()
-
-    for collection_name in collections:
-        collection = db[collection_name]
-        documents = await collection.find().to_list(None)
-        if len(list(documents)) == 0:
-            continue
-
-        backup_filename = f"{BACKUP_DIR}/{collection_name}.json"
-        with open(backup_filename, "w", encoding="utf-8") as f:
-            json.dump(
-                documents, f, indent=4, default=json_util.default, ensure_ascii=False
-            )
-
-    return {"message": "Backup berhasil", "file": backup_filename}
+    id_job = await CreateJob(
+        db, JobTypeData.DATA_BACKUP.value, {"collections": sorted(collections)}
+    )
+    return {"message": "Backup Sedang Dalam Proses!", "id_job": id_job}
 
 
 @router.get("/restore")
@@ -99,6 +146,7 @@ async def restore_data(
             collection = db[collection_name]
             if documents:
                 await collection.insert_many(documents)
+                InvalidateDataCount(collection)
 
         return {"message": "Restore berhasil"}
 
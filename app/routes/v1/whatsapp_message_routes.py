@@ -1,4 +1,3 @@
-import asyncio
 from bson import ObjectId
 from fastapi import (
     APIRouter,
@@ -6,10 +5,13 @@ from fastapi import (
     Depends,
     HTTPException,
 )
+from app.models.jobs import JobTypeData
 from app.models.whatsapp_messages import (
     AdvanceMessageTemplateData,
     SendBroadcastMessageData,
     SendSingleMessageData,
+    WhatsappOutboxProjections,
+    WhatsappOutboxStatusData,
 )
 from app.modules.whatsapp_message import (
     SendWhatsappBroadcastMessage,
@@ -30,11 +32,15 @@ from app.models.generals import Pagination
 from app.modules.generals import ReminderDateFormatter
 from app.routes.v1.auth_routes import GetCurrentUser
 from app.modules.crud_operations import (
+    GetAggregateData,
+    GetDataCount,
     GetDistinctData,
     GetManyData,
     GetOneData,
     UpdateOneData,
 )
+from app.modules.jobs import CreateJob, RegisterJobHandler
+from app.modules.message_template import InvalidateWhatsappTemplateCache
 from app.modules.database import AsyncIOMotorClient, GetAmretaDatabase
 import os
 from dotenv import load_dotenv
@@ -44,9 +50,46 @@ load_dotenv()
 WHATSAPP_BOT_NUMBER = os.getenv("WHATSAPP_BOT_NUMBER")
 MPWA_API_TOKEN = os.getenv("MPWA_API_TOKEN")
 
+WHATSAPP_BROADCAST_CHUNK_SIZE = int(os.getenv("WHATSAPP_BROADCAST_CHUNK_SIZE", 20))
+
 router = APIRouter(prefix="/whatsapp-message", tags=["Whatsapp Messages"])
 
 
+@RegisterJobHandler(JobTypeData.WHATSAPP_BROADCAST.value)
+async def SendBroadcastJobHandler(db, job: dict):
+    params = job["params"]
+    chunk = {}
+    collection = db[params["collection_name"]]
+    query = dict(params["query"])
+    if job.get("checkpoint"):
+        query["_id"] = {"$gt": ObjectId(job["checkpoint"])}
+    else:
+        chunk["total"] = await GetDataCount(collection, query)
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"_id": 1}},
+        {"$limit": WHATSAPP_BROADCAST_CHUNK_SIZE},
+    ]
+    contact_data = await GetAggregateData(
+        collection, pipeline, {"name": 1, "phone_number": 1}
+    )
+    if len(contact_data) > 0:
+        await SendWhatsappBroadcastMessage(db, contact_data, params["message"])
+
+    chunk.update(
+        {
+            "checkpoint": (
+                contact_data[-1]["_id"] if contact_data else job.get("checkpoint")
+            ),
+            "processed": len(contact_data),
+            "is_done": len(contact_data) < WHATSAPP_BROADCAST_CHUNK_SIZE,
+            "result": {"message_sent": len(contact_data)},
+        }
+    )
+    return chunk
+
+
 @router.get("/template")
 async def get_message_template(
     current_user: UserData = Depends(GetCurrentUser),
@@ -89,6 +132,7 @@ async def update_message_template(
     if not result:
         raise HTTPException(status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE})
 
+    InvalidateWhatsappTemplateCache()
     return JSONResponse(content={"message": DATA_HAS_UPDATED_MESSAGE})
 
 
@@ -117,6 +161,7 @@ async def update_advance_message_template(
     if not result:
         raise HTTPException(status_code=500, detail={"message": SYSTEM_ERROR_MESSAGE})
 
+    InvalidateWhatsappTemplateCache()
     return JSONResponse(content={"message": DATA_HAS_UPDATED_MESSAGE})
 
 
@@ -179,6 +224,42 @@ async def get_reminder(
     )
 
 
+@router.get("/outbox")
+async def get_outbox_messages(
+    key: str = None,
+    status: WhatsappOutboxStatusData = None,
+    page: int = 1,
+    items: int = 10,
+    current_user: UserData = Depends(GetCurrentUser),
+    db: AsyncIOMotorClient = Depends(GetAmretaDatabase),
+):
+    if current_user.role == UserRole.CUSTOMER:
+        raise HTTPException(
+            status_code=403, detail={"message": FORBIDDEN_ACCESS_MESSAGE}
+        )
+    query = {}
+    if key:
+        query["destination"] = {"$regex": key, "$options": "i"}
+    if status:
+        query["status"] = status.value
+
+    pipeline = [{"$match": query}, {"$sort": {"created_at": -1}}]
+
+    outbox_data, count = await GetManyData(
+        db.whatsapp_outbox,
+        pipeline,
+        WhatsappOutboxProjections,
+        {"page": page, "items": items},
+    )
+    pagination_info: Pagination = {"page": page, "items": items, "count": count}
+    return JSONResponse(
+        content={
+            "outbox_data": outbox_data,
+            "pagination_info": pagination_info,
+        }
+    )
+
+
 @router.post("/single/send")
 async def send_single_message(
     data: SendSingleMessageData = Body(..., embed=True),
@@ -221,7 +302,6 @@ async def send_broadcast_message(
         payload = data.dict(exclude_unset=True)
         collection_name = "customers"
         query = {}
-        pipeline = []
         if payload["group"] == "user":
             query = {}
             if payload["destination"] != "all":
@@ -239,20 +319,24 @@ async def send_broadcast_message(
                 status_code=400, detail={"message": DATA_FORMAT_NOT_VALID_MESSAGE}
             )
 
-        pipeline.append({"$match": query})
-        contact_data, _ = await GetManyData(
-            db[collection_name], pipeline, {"name": 1, "phone_number": 1}
-        )
-        if len(contact_data) == 0:
+        contact_count = await GetDataCount(db[collection_name], query)
+        if contact_count == 0:
             raise HTTPException(
                 status_code=404,
                 detail={"message": "Daftar Kontak Tujuan Tidak Ditemukan!"},
             )
 
         message = WhatsappMessageFormatter(payload["title"], payload["message"])
-        asyncio.create_task(SendWhatsappBroadcastMessage(db, contact_data, message))
+        id_job = await CreateJob(
+            db,
+            JobTypeData.WHATSAPP_BROADCAST.value,
+            {"collection_name": collection_name, "query": query, "message": message},
+        )
         return JSONResponse(
-            content={"message": "Pesan Sedang Dalam Proses Pengiriman!"}
+            content={
+                "message": "Pesan Sedang Dalam Proses Pengiriman!",
+                "id_job": id_job,
+            }
         )
     except HTTPException as http_err:
         raise http_err
@@ -0,0 +1,111 @@
+"""
+Compare the CPU time and peak memory of a list response built from the
+old JSON round trip of the CRUD helpers, the one-pass converter and the
+native documents written by BSONJSONResponse.
+
+Run from the project root: python -m benchmarks.crud_serialization_benchmark
+"""
+
+from datetime import datetime, timedelta
+import json
+import time
+import tracemalloc
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from app.modules.bson_response import BSONJSONResponse
+from app.modules.crud_operations import JsonObjectConverter, JsonObjectFormatter
+
+CUSTOMER_COUNT = 5000
+CASHFLOW_COUNT = 20000
+REPEAT = 5
+
+
+def CreateCustomerMapsData():
+    # shaped like /customer/maps with CustomerProjections
+    created_at = datetime(2026, 3, 1, 8, 30, 15, 123456)
+    return [
+        {
+            "_id": ObjectId(),
+            "name": f"Budi Santoso {index}",
+            "service_number": 2401000 + index,
+            "phone_number": "81234567890",
+            "email": f"budi{index}@example.com",
+            "id_router": ObjectId(),
+            "id_odp": ObjectId(),
+            "id_package": ObjectId(),
+            "status": 1,
+            "referral": "AMR001",
+            "location": {
+                "latitude": -7.5 + index / 100000,
+                "longitude": 110.8 + index / 100000,
+                "address": "Jl. Mawar No. 1, Surakarta",
+                "house_status": "OWN",
+                "house_owner": "Budi Santoso",
+            },
+            "created_at": created_at + timedelta(minutes=index),
+            "updated_at": created_at + timedelta(minutes=index),
+        }
+        for index in range(CUSTOMER_COUNT)
+    ]
+
+
+def CreateCashflowData():
+    # shaped like /transaction/cashflow, dates already formatted by mongo
+    created_at = datetime(2026, 3, 1, 8, 30, 15)
+    return [
+        {
+            "_id": ObjectId(),
+            "category": "BAYAR TAGIHAN",
+            "date": str(created_at + timedelta(minutes=index)),
+            "description": f"Pembayaran Tagihan dengan Nomor Layanan {2401000 + index}",
+            "method": "TRANSFER",
+            "credit": 166501,
+            "type": "INCOMES",
+            "saldo": 166501 * index,
+        }
+        for index in range(CASHFLOW_COUNT)
+    ]
+
+
+def JsonRoundTripResponse(data: list):
+    result = json.loads(json.dumps(data, default=JsonObjectFormatter))
+    return JSONResponse(content={"data": result}).body
+
+
+def ConverterResponse(data: list):
+    return JSONResponse(content={"data": JsonObjectConverter(data)}).body
+
+
+def NativeResponse(data: list):
+    return BSONJSONResponse(content={"data": data}).body
+
+
+def RunBenchmark(name: str, function, data: list):
+    seconds = []
+    for _ in range(REPEAT):
+        start = time.process_time()
+        function(data)
+        seconds.append(time.process_time() - start)
+
+    tracemalloc.start()
+    function(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<28} {min(seconds) * 1000:9.2f} ms cpu {peak / 1048576:9.2f} MiB peak"
+    )
+
+
+if __name__ == "__main__":
+    for title, data in [
+        (f"customer maps ({CUSTOMER_COUNT} documents)", CreateCustomerMapsData()),
+        (f"cashflow ({CASHFLOW_COUNT} entries)", CreateCashflowData()),
+    ]:
+        assert json.loads(JsonRoundTripResponse(data)) == json.loads(
+            NativeResponse(data)
+        )
+        print(title)
+        RunBenchmark("json round trip (before)", JsonRoundTripResponse, data)
+        RunBenchmark("one-pass converter", ConverterResponse, data)
+        RunBenchmark("native + BSONJSONResponse", NativeResponse, data)
+        print()
@@ -0,0 +1,76 @@
+"""
+Compare the compiled message templates with the old replace loop.
+
+Run from the project root: python -m benchmarks.message_template_benchmark
+"""
+
+from datetime import datetime
+import timeit
+from app.modules.generals import DateIDFormatter
+from app.modules.message_template import CompileMessageTemplate, RenderMessageTemplate
+
+TEMPLATE = (
+    "*Tagihan Internet*\n\n"
+    "Yth. [nama_pelanggan] ([no_servis]),\n"
+    "tagihan paket [nama_paket] bulan [bulan_tagihan] [tahun_tagihan] sebesar "
+    "Rp[jumlah_tagihan] berstatus [status] dan jatuh tempo pada tanggal "
+    "[tgl_due_date].\n\nBayar melalui [link]\n\n"
+    + (
+        "Layanan akan diisolir otomatis apabila tagihan belum dibayar setelah "
+        "jatuh tempo. Abaikan pesan ini bila sudah melakukan pembayaran.\n"
+    )
+    * 8
+    + "\n[footer_wa]"
+)
+FIELDS_TO_REPLACE = {
+    "[nama_pelanggan]": "Budi Santoso",
+    "[no_servis]": "2401001",
+    "[nama_paket]": "Home 20 Mbps",
+    "[jumlah_tagihan]": "166.501",
+    "[status]": "BELUM DIBAYAR",
+    "[tgl_due_date]": "05",
+    "[bulan_tagihan]": "Maret",
+    "[tahun_tagihan]": "2026",
+    "[link]": "https://example.com/quick-payment?id=65f000000000000000000000",
+    "[footer_wa]": "Terima kasih telah berlangganan.",
+}
+CREATED_AT = datetime(2026, 3, 1, 8, 30, 15, 123456)
+ITERATIONS = 50000
+REPEAT = 5
+
+
+def ReplaceLoopRender(message: str, fields_to_replace: dict):
+    for key, value in fields_to_replace.items():
+        try:
+            message = message.replace(key, str(value))
+        except Exception:
+            message = message.replace(key, "-")
+
+    return message
+
+
+def RunBenchmark(name: str, statement):
+    seconds = min(timeit.repeat(statement, number=ITERATIONS, repeat=REPEAT))
+    print(f"{name:<32} {seconds / ITERATIONS * 1_000_000:8.3f} us/op")
+    return seconds
+
+
+if __name__ == "__main__":
+    compiled_template = CompileMessageTemplate(TEMPLATE)
+    assert RenderMessageTemplate(
+        compiled_template, FIELDS_TO_REPLACE
+    ) == ReplaceLoopRender(TEMPLATE, FIELDS_TO_REPLACE)
+
+    RunBenchmark("replace loop", lambda: ReplaceLoopRender(TEMPLATE, FIELDS_TO_REPLACE))
+    RunBenchmark(
+        "compile + render",
+        lambda: RenderMessageTemplate(
+            CompileMessageTemplate(TEMPLATE), FIELDS_TO_REPLACE
+        ),
+    )
+    RunBenchmark(
+        "render (compiled once)",
+        lambda: RenderMessageTemplate(compiled_template, FIELDS_TO_REPLACE),
+    )
+    RunBenchmark("date from string", lambda: DateIDFormatter(str(CREATED_AT), True))
+    RunBenchmark("date from datetime", lambda: DateIDFormatter(CREATED_AT, True))
@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+from app.modules.database import ConnectToMongoDB, DisconnectMongoDB, GetAmretaDatabase
+from app.modules.indexes import INDEX_REGISTRY, EnsureIndexes, GetIndexReport
+
+# the routes import every module that registers its indexes
+import app.routes.main  # noqa: F401
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Create the registered MongoDB indexes and report the drift"
+    )
+    parser.add_argument(
+        "--report", action="store_true", help="only report, create nothing"
+    )
+    parser.add_argument("--collection", help="one collection, all when omitted")
+    args = parser.parse_args()
+
+    await ConnectToMongoDB()
+    db = await GetAmretaDatabase()
+    try:
+        failed = {}
+        if not args.report:
+            failed = await EnsureIndexes(
+                db, [args.collection] if args.collection else None
+            )
+
+        report = await GetIndexReport(db)
+    finally:
+        await DisconnectMongoDB()
+
+    for collection in sorted(report):
+        if args.collection and collection != args.collection:
+            continue
+
+        collection_report = report[collection]
+        print(f"{collection}: {len(INDEX_REGISTRY[collection])} registered")
+        for name in collection_report["missing"]:
+            print(f"  missing {name}")
+        for name in collection_report["unregistered"]:
+            print(f"  unregistered {name}")
+        for item in collection_report["unused"]:
+            print(f"  unused {item['name']} since {item['since']}")
+
+    for name, error in failed.items():
+        print(f"failed {name}: {error}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
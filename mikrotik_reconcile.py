@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+from app.modules.database import ConnectToMongoDB, DisconnectMongoDB, GetAmretaDatabase
+from app.modules.mikrotik_pool import CloseMikrotikPools
+from app.modules.mikrotik_reconcile import (
+    RECONCILE_DIFF_TYPES,
+    ReconcileMikrotikSecrets,
+)
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Reconcile router PPP secrets with the customer data"
+    )
+    parser.add_argument("--router", help="router name, all routers when omitted")
+    parser.add_argument(
+        "--apply", action="store_true", help="apply the diff, dry run by default"
+    )
+    parser.add_argument(
+        "--remove-extra",
+        action="store_true",
+        help="also remove secrets that do not belong to any customer",
+    )
+    parser.add_argument("--verbose", action="store_true", help="print every diff entry")
+    args = parser.parse_args()
+
+    await ConnectToMongoDB()
+    db = await GetAmretaDatabase()
+    try:
+        reconcile_data = await ReconcileMikrotikSecrets(
+            db,
+            {"name": args.router} if args.router else {},
+            not args.apply,
+            args.remove_extra,
+        )
+    finally:
+        await CloseMikrotikPools()
+        await DisconnectMongoDB()
+
+    if len(reconcile_data) == 0:
+        print("Router not found")
+        return
+
+    for router_result in reconcile_data.values():
+        if "error" in router_result:
+            print(f"{router_result['name']}: error {router_result['error']}")
+            continue
+
+        print(
+            f"{router_result['name']}: {router_result['secret_count']} secrets, "
+            f"{router_result['customer_count']} customers, "
+            f"{router_result['seconds']}s"
+        )
+        for diff_type in RECONCILE_DIFF_TYPES:
+            line = f"  {diff_type}: {router_result['summary'][diff_type]}"
+            if "applied" in router_result:
+                line += f" (applied {router_result['applied'][diff_type]})"
+            print(line)
+            if args.verbose:
+                for item in router_result["diff"][diff_type]:
+                    print(f"    {item}")
+
+        for item in router_result.get("failed", []):
+            print(f"  failed {item['name']}: {item['error']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())